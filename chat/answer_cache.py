@@ -0,0 +1,166 @@
+"""
+Caché semántica de respuestas del chat por contexto.
+
+Usuarios distintos de un mismo contexto público suelen hacer casi la misma
+pregunta. Antes de reservar turno en el LLM se busca una respuesta previa del
+mismo contexto, con la misma versión de contenido y el mismo modelo, cuya
+pregunta tenga similitud coseno >= CHAT_ANSWER_CACHE_THRESHOLD. Si existe, se
+reproduce como stream NDJSON (mismo formato que Ollama) sin pasar por
+recuperación, SQL ni generación.
+
+Solo se usa para la primera pregunta de un chat: con historial la respuesta
+depende de la conversación y no es reutilizable.
+
+La versión de contenido es una huella de los archivos procesados del contexto;
+además, agregar o quitar archivos borra las entradas del contexto (signals.py).
+"""
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterator, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from fileuploads.embeddings_service import embedder
+from fileuploads.models import Files
+from .models import AnswerCache, History
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHUNK_CHARS = 80
+
+# Respuesta que el prompt pide cuando no hay datos (ver chat/views.py): no se
+# reutiliza aunque la pregunta se repita
+NO_INFO_ANSWER = "No hay información suficiente en los registros"
+
+
+@dataclass
+class CacheLookup:
+    """Resultado de la búsqueda: `entry` es None si no hubo acierto"""
+    context_id: int
+    content_version: str
+    model: str
+    query: str
+    query_embedding: np.ndarray
+    entry: Optional[AnswerCache] = None
+
+
+def context_content_version(context_id: int) -> str:
+    """Huella de los archivos procesados del contexto (cambia al agregar, quitar o reprocesar)"""
+    files = (
+        Files.objects.filter(contexts__id=context_id, processed=True)
+        .order_by("id")
+        .values_list("id", "chunks_total")
+    )
+    fingerprint = ",".join(f"{file_id}:{chunks}" for file_id, chunks in files)
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+
+def lookup_answer(payload: dict, model: str) -> Optional[CacheLookup]:
+    """
+    Devuelve None si la petición no es cacheable; si lo es, un CacheLookup
+    con la entrada encontrada (o sin ella, para guardar la respuesta después).
+    """
+    if not getattr(settings, "CHAT_ANSWER_CACHE", True) or payload.get("type") != "RAG":
+        return None
+
+    history = History.objects.filter(id=payload.get("chat_id")).values_list("history_array", flat=True).first()
+    if history:
+        return None
+
+    query = payload["messages"][1]["content"]
+    query_embedding = embedder.embed_query(query)
+    if query_embedding is None or not np.any(query_embedding):
+        return None
+
+    context_id = int(payload["context_id"])
+    lookup = CacheLookup(
+        context_id=context_id,
+        content_version=context_content_version(context_id),
+        model=model,
+        query=query,
+        query_embedding=query_embedding,
+    )
+
+    threshold = getattr(settings, "CHAT_ANSWER_CACHE_THRESHOLD", 0.95)
+    ttl = getattr(settings, "CHAT_ANSWER_CACHE_TTL", 7 * 24 * 3600)
+    lookup.entry = (
+        AnswerCache.objects.filter(
+            context_id=context_id,
+            content_version=lookup.content_version,
+            model=model,
+            created_date__gte=timezone.now() - timedelta(seconds=ttl),
+        )
+        .annotate(distance=CosineDistance("query_embedding", query_embedding))
+        .filter(distance__lte=1 - threshold)
+        .order_by("distance")
+        .only("id", "query", "answer", "title")
+        .first()
+    )
+
+    if lookup.entry is not None:
+        AnswerCache.objects.filter(id=lookup.entry.id).update(hits=F("hits") + 1, last_hit_date=timezone.now())
+        logger.info(
+            f"Respuesta en caché para context={context_id} "
+            f"(similitud {1 - lookup.entry.distance:.3f}): {lookup.entry.query[:80]}"
+        )
+    return lookup
+
+
+def store_answer(lookup: Optional[CacheLookup], answer: str, title: Optional[str] = None,
+                 degraded: bool = False):
+    """
+    Guarda la respuesta generada y descarta las entradas de versiones
+    anteriores del contexto. No se guardan respuestas `degraded` (alguna rama
+    de recuperación no llegó o no hubo información) ni la respuesta de "sin
+    información": se servirían a todos durante el TTL.
+    """
+    if lookup is None or lookup.entry is not None or not answer.strip():
+        return
+    if degraded or NO_INFO_ANSWER in answer:
+        logger.info(f"Respuesta sin guardar en caché (incompleta o sin información): {lookup.query[:80]}")
+        return
+    try:
+        AnswerCache.objects.filter(context_id=lookup.context_id).exclude(
+            content_version=lookup.content_version
+        ).delete()
+        AnswerCache.objects.create(
+            context_id=lookup.context_id,
+            content_version=lookup.content_version,
+            model=lookup.model,
+            query=lookup.query,
+            query_embedding=lookup.query_embedding,
+            answer=answer,
+            title=title,
+        )
+    except Exception as e:
+        logger.error(f"No se pudo guardar la respuesta en caché: {str(e)}")
+
+
+def replay_answer(entry: AnswerCache, model: str) -> Iterator[str]:
+    """Reproduce la respuesta guardada con el formato NDJSON del stream de Ollama"""
+    answer = entry.answer
+    for start in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        yield json.dumps({
+            "model": model,
+            "message": {"role": "assistant", "content": answer[start:start + REPLAY_CHUNK_CHARS]},
+            "done": False,
+        }) + "\n"
+    yield json.dumps({
+        "model": model,
+        "message": {"role": "assistant", "content": ""},
+        "done": True,
+        "cached": True,
+    }) + "\n"
+
+
+def invalidate_context(context_ids):
+    deleted, _ = AnswerCache.objects.filter(context_id__in=list(context_ids)).delete()
+    if deleted:
+        logger.info(f"Caché de respuestas invalidada para contextos {list(context_ids)}: {deleted} entradas")
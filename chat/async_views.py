@@ -0,0 +1,184 @@
+"""
+Variante asíncrona (ASGI) del endpoint de chat.
+
+El streaming hacia Ollama usa un `httpx.AsyncClient` compartido (pool de
+conexiones), así que una respuesta en curso no ocupa un hilo del servidor:
+bajo uvicorn un solo proceso puede mantener cientos de streams abiertos.
+La preparación del prompt (ORM, búsqueda RAG/JSON) reutiliza el código
+síncrono de views.py a través de `sync_to_async`.
+"""
+import asyncio
+import json
+import logging
+import os
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .context_packer import calibrate_from_response
+from .llm_scheduler import llm_scheduler, AsyncScheduledStream, SchedulerFull, SchedulerTimeout
+from .models import History
+from .answer_cache import lookup_answer, replay_answer, store_answer
+from .views import build_chat_messages, save_cached_answer, save_chat_history, mark_chat_error
+
+logger = logging.getLogger(__name__)
+
+# Llave del scope donde expose_receive deja el `receive` de la conexión
+RECEIVE_SCOPE_KEY = "chat.receive"
+
+_http_client = None
+_http_client_loop = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Cliente httpx compartido por todas las peticiones del event loop actual"""
+    global _http_client, _http_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(int(os.environ.get("OLLAMA_TIMEOUT", 600)), connect=10),
+            limits=httpx.Limits(
+                max_connections=getattr(settings, "CHAT_HTTP_MAX_CONNECTIONS", 200),
+                max_keepalive_connections=20,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+def _run_with_db(func, *args):
+    # Los hilos de sync_to_async no pasan por el ciclo request/response de
+    # Django, así que las conexiones a la BD se cierran explícitamente
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args):
+    """Ejecuta código síncrono con ORM en el pool de hilos sin serializarlo"""
+    return await sync_to_async(_run_with_db, thread_sensitive=False)(func, *args)
+
+
+def expose_receive(app):
+    """
+    Envoltura ASGI (llm/asgi.py) que deja el `receive` de la conexión en el
+    scope. Django 4.2 solo lo usa para leer el cuerpo; el chat lo escucha
+    después para detectar que el cliente se desconectó durante el streaming.
+    """
+    async def wrapper(scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, RECEIVE_SCOPE_KEY: receive}
+        await app(scope, receive, send)
+    return wrapper
+
+
+async def chat_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Método no permitido"}, status=405)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "JSON inválido"}, status=400)
+
+    server = settings.OLLAMA_API_URL
+    model = payload.get("model")
+    logger.info(f"modelo: {model}")
+
+    # Validaciones requeridas
+    if not model:
+        return JsonResponse({"error": "Se requiere el parámetro 'model'"}, status=400)
+
+    if 'type' not in payload or payload['type'] not in ['Preguntar', 'RAG']:
+        return JsonResponse({"error": "El parámetro 'type' debe ser 'Preguntar' o 'RAG'"}, status=400)
+
+    if payload['type'] == 'RAG' and 'context_id' not in payload:
+        return JsonResponse({"error": "Se requiere context_id para tipo RAG"}, status=400)
+
+    # Configuración para Ollama
+    updated_payload = {
+        **payload,
+        "stream": True,
+    }
+
+    # Pregunta ya respondida en este contexto: se reproduce sin pasar por el LLM
+    cache_lookup = await run_sync(lookup_answer, payload, model)
+    if cache_lookup is not None and cache_lookup.entry is not None:
+        async def cached_stream():
+            # La respuesta ya está en memoria: se reproduce sin pasar por hilos
+            for line in replay_answer(cache_lookup.entry, model):
+                yield line
+            await run_sync(save_cached_answer, payload, cache_lookup, server, model)
+
+        return StreamingHttpResponse(cached_stream(), content_type='text/event-stream')
+
+    # Reservar turno en el planificador del LLM
+    user_id = payload.get('user_id') or await History.objects.filter(
+        id=payload.get('chat_id')
+    ).values_list('user_id', flat=True).afirst()
+    try:
+        ticket = llm_scheduler.enqueue(user_id)
+    except SchedulerFull:
+        return JsonResponse({"error": "Servicio ocupado, intenta más tarde"}, status=503)
+
+    async def event_stream():
+        try:
+            # Esperar turno informando la posición en cola al cliente
+            try:
+                async for position in llm_scheduler.wait_async(ticket):
+                    yield json.dumps({
+                        "queue": {"position": position},
+                        "message": {"role": "assistant", "content": ""},
+                        "done": False,
+                    }) + "\n"
+            except SchedulerTimeout:
+                yield json.dumps({
+                    "error": "Tiempo de espera agotado en la cola, intenta más tarde",
+                    "done": True,
+                }) + "\n"
+                return
+
+            new_messages, degraded = await run_sync(build_chat_messages, payload, updated_payload, server, model)
+            llm_response = {"role": "assistant", "content": ''}
+
+            # =================== LLAMADA A OLLAMA ===================
+            logger.debug(f"Enviando {len(updated_payload['messages'])} mensajes a Ollama (async)")
+            async with get_http_client().stream("POST", f"{server}/api/chat", json=updated_payload) as resp:
+                resp.raise_for_status()
+
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+                    yield f"{line}\n"
+                    line_json = json.loads(line)
+                    llm_response["content"] += str(line_json.get('message', {}).get("content", ""))
+                    calibrate_from_response(model, updated_payload["messages"], line_json)
+
+            new_messages.append(llm_response)
+
+            # =================== GUARDAR HISTORIAL ===================
+            title = await run_sync(save_chat_history, payload['chat_id'], new_messages, server, model)
+            await run_sync(store_answer, cache_lookup, llm_response["content"], title, degraded=degraded)
+
+        except Exception as e:
+            logger.error(f"Error en chat async: {str(e)}")
+            await run_sync(mark_chat_error, payload['chat_id'])
+        finally:
+            llm_scheduler.release(ticket)
+
+    return StreamingHttpResponse(
+        AsyncScheduledStream(event_stream(), llm_scheduler, ticket, request.scope.get(RECEIVE_SCOPE_KEY)),
+        content_type='text/event-stream'
+    )
+
+
+# El chat no usa sesión de Django; igual que las vistas DRF queda exento de CSRF.
+# (En Django 4.2 el decorador csrf_exempt no conserva las vistas async)
+chat_async.csrf_exempt = True
@@ -0,0 +1,214 @@
+"""
+Empaquetado del prompt del chat con presupuesto de tokens.
+
+La ventana de contexto del modelo se reparte entre las partes fijas (prompt de
+sistema, instrucciones y pregunta), la respuesta reservada y las secciones
+variables: pasajes RAG, registros estructurados (JSON/SQL) e historial. Cada
+sección recibe primero su cuota mínima y el sobrante se asigna por prioridad,
+de modo que el tamaño del prompt (y el tiempo de prefill) queda acotado.
+
+Los tokens se cuentan con el tokenizer de Hugging Face configurado en
+CHAT_TOKENIZER o, si no hay, con un estimador de caracteres por token que se
+calibra con el `prompt_eval_count` que devuelve Ollama en cada respuesta.
+"""
+import logging
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    def __init__(self, default_chars_per_token: float = 3.5, smoothing: float = 0.2):
+        self.default_chars_per_token = default_chars_per_token
+        self.smoothing = smoothing
+        self._ratios: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+
+    def _get_tokenizer(self):
+        name = getattr(settings, "CHAT_TOKENIZER", "")
+        if not name:
+            return None
+        if not self._tokenizer_loaded:
+            with self._lock:
+                if not self._tokenizer_loaded:
+                    try:
+                        from transformers import AutoTokenizer
+                        self._tokenizer = AutoTokenizer.from_pretrained(name)
+                    except Exception as e:
+                        logger.error(f"No se pudo cargar el tokenizer {name}: {str(e)}")
+                    self._tokenizer_loaded = True
+        return self._tokenizer
+
+    def chars_per_token(self, model: Optional[str] = None) -> float:
+        return self._ratios.get(model or "", self.default_chars_per_token)
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        tokenizer = self._get_tokenizer()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token(model)) + 1
+
+    def calibrate(self, model: str, prompt_chars: int, prompt_tokens: Optional[int]):
+        """Ajusta (media móvil) la relación caracteres/token del modelo con un conteo real"""
+        if not prompt_tokens or prompt_chars <= 0:
+            return
+        observed = prompt_chars / prompt_tokens
+        with self._lock:
+            current = self._ratios.get(model)
+            self._ratios[model] = observed if current is None else (
+                (1 - self.smoothing) * current + self.smoothing * observed
+            )
+
+
+def calibrate_from_response(model: str, messages: List[dict], response: dict):
+    """Usa el prompt_eval_count del último mensaje de Ollama para calibrar el estimador"""
+    if response.get("done") and response.get("prompt_eval_count"):
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+        token_counter.calibrate(model, prompt_chars, response["prompt_eval_count"])
+
+
+token_counter = TokenCounter(
+    default_chars_per_token=getattr(settings, "CHAT_CHARS_PER_TOKEN", 3.5),
+)
+
+
+@lru_cache(maxsize=32)
+def _model_context_length(server: str, model: str) -> Optional[int]:
+    """context_length que reporta Ollama (/api/show) para el modelo"""
+    try:
+        response = requests.post(f"{server}/api/show", json={"model": model}, timeout=10)
+        response.raise_for_status()
+        for key, value in (response.json().get("model_info") or {}).items():
+            if key.endswith(".context_length"):
+                return int(value)
+    except Exception as e:
+        logger.warning(f"No se pudo consultar la ventana de contexto de {model}: {str(e)}")
+    return None
+
+
+def get_context_window(server: str, model: str) -> int:
+    """
+    Ventana efectiva: CHAT_NUM_CTX acotado por la longitud que soporta el
+    modelo. Se envía como options.num_ctx para que Ollama use la misma.
+    """
+    num_ctx = getattr(settings, "CHAT_NUM_CTX", 8192)
+    model_length = _model_context_length(server, model)
+    return min(num_ctx, model_length) if model_length else num_ctx
+
+
+def ollama_options(server: str, model: str, **options) -> dict:
+    """
+    `options` para Ollama con el num_ctx de get_context_window. Todas las
+    llamadas al modelo del chat lo envían igual: un num_ctx distinto obliga a
+    Ollama a recargar el modelo.
+    """
+    return {"num_ctx": get_context_window(server, model), **options}
+
+
+@dataclass
+class Section:
+    """Parte variable del prompt: `items` van del más al menos importante"""
+    name: str
+    items: List[str]
+    priority: int
+    min_share: float = 0.0
+    separator_tokens: int = 1
+
+
+@dataclass
+class PackedContext:
+    budget: int
+    used: int
+    sections: Dict[str, List[str]] = field(default_factory=dict)
+
+    def items(self, name: str) -> List[str]:
+        return self.sections.get(name, [])
+
+
+class ContextPacker:
+    def __init__(self, context_window: int, model: Optional[str] = None,
+                 response_tokens: Optional[int] = None, counter: TokenCounter = token_counter):
+        self.context_window = context_window
+        self.model = model
+        self.response_tokens = (
+            response_tokens if response_tokens is not None
+            else getattr(settings, "CHAT_RESPONSE_TOKENS", 1024)
+        )
+        self.counter = counter
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text, self.model)
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """Recorta un texto a aproximadamente `tokens` tokens"""
+        if tokens <= 0:
+            return ""
+        if self.count(text) <= tokens:
+            return text
+        chars = int(tokens * self.counter.chars_per_token(self.model))
+        while chars > 0 and self.count(text[:chars]) > tokens:
+            chars = int(chars * 0.9)
+        return text[:chars]
+
+    def available(self, fixed: List[str], overhead_tokens: int = 0) -> int:
+        """Tokens que quedan para las secciones variables después de lo fijo y la respuesta"""
+        budget = (self.context_window - self.response_tokens - overhead_tokens
+                  - sum(self.count(text) for text in fixed))
+        return max(0, budget)
+
+    def pack(self, fixed: List[str], sections: List[Section], overhead_tokens: int = 0) -> PackedContext:
+        """
+        Reparte el presupuesto restante entre las secciones:
+        1. cada sección toma ítems completos hasta su cuota mínima (min_share)
+        2. el sobrante se asigna en orden de prioridad (menor número primero)
+        `overhead_tokens` cubre plantillas y encabezados que no están en `fixed`.
+        Si el primer ítem de una sección no cabe en el paso 2, se recorta en
+        vez de omitirlo.
+        """
+        budget = self.available(fixed, overhead_tokens)
+
+        costs = {s.name: [self.count(item) + s.separator_tokens for item in s.items] for s in sections}
+        taken = {s.name: 0 for s in sections}
+        kept: Dict[str, List[str]] = {s.name: [] for s in sections}
+        remaining = budget
+
+        def take(section: Section, limit: int, allow_truncate: bool) -> int:
+            spent = 0
+            while taken[section.name] < len(section.items):
+                index = taken[section.name]
+                cost = costs[section.name][index]
+                if cost > limit - spent:
+                    if allow_truncate and index == 0 and limit - spent > section.separator_tokens:
+                        text = self.truncate(section.items[0], limit - spent - section.separator_tokens)
+                        if text:
+                            kept[section.name].append(text)
+                            spent += self.count(text) + section.separator_tokens
+                        taken[section.name] = 1
+                    break
+                kept[section.name].append(section.items[index])
+                taken[section.name] += 1
+                spent += cost
+            return spent
+
+        ordered = sorted(sections, key=lambda s: s.priority)
+        for section in ordered:
+            remaining -= take(section, min(remaining, int(budget * section.min_share)), False)
+        for section in ordered:
+            remaining -= take(section, remaining, True)
+
+        packed = PackedContext(budget=budget, used=budget - remaining, sections=kept)
+        logger.debug(
+            f"Prompt empaquetado: {packed.used}/{budget} tokens "
+            + ", ".join(f"{s.name}={len(kept[s.name])}/{len(s.items)}" for s in sections)
+        )
+        return packed
@@ -0,0 +1,127 @@
+"""
+Extracción por lotes con el LLM sobre los chunks de varios archivos.
+
+Lo usa location_index.py (lugares de chat/location_extractor.py y de
+localidades/utils.py):
+
+- Los chunks de todos los archivos se agrupan en lotes por presupuesto de
+  tokens (LLM_EXTRACTION_BATCH_TOKENS) en vez de un número fijo de chunks.
+- Los chunks con texto idéntico a uno ya visto (frecuentes en CSV) se omiten
+  y quedan registrados como alias del original.
+- Los lotes se envían a un pool compartido con LLM_EXTRACTION_CONCURRENCY
+  hilos (por defecto OLLAMA_NUM_PARALLEL), así que varias extracciones a la
+  vez no superan los slots paralelos de Ollama en este proceso.
+"""
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from .context_packer import token_counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+EXTRACTION_CONCURRENCY = max(1, getattr(settings, "LLM_EXTRACTION_CONCURRENCY", 1))
+
+_extraction_executor = ThreadPoolExecutor(
+    max_workers=EXTRACTION_CONCURRENCY,
+    thread_name_prefix="llm-extract",
+)
+
+
+@dataclass
+class BatchChunk:
+    id: int
+    file_id: int
+    chunk_index: int
+    text: str
+
+
+@dataclass
+class TextBatch:
+    chunks: List[BatchChunk]
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(chunk.text for chunk in self.chunks)
+
+
+@dataclass
+class BatchStats:
+    chunks: int = 0
+    duplicates: int = 0
+    batches: int = 0
+    # chunk original -> chunks omitidos por tener el mismo texto
+    aliases: Dict[int, List[int]] = field(default_factory=dict)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def iter_text_batches(chunks: QuerySet, model: Optional[str] = None,
+                      token_budget: Optional[int] = None,
+                      stats: Optional[BatchStats] = None) -> Iterator[TextBatch]:
+    """
+    Recorre los chunks (DocumentEmbedding) en orden de archivo y posición y
+    devuelve los lotes. Un chunk que por sí solo excede el presupuesto forma
+    su propio lote.
+    """
+    if token_budget is None:
+        token_budget = getattr(settings, "LLM_EXTRACTION_BATCH_TOKENS", 3000)
+    stats = stats if stats is not None else BatchStats()
+
+    seen: Dict[str, int] = {}
+    batch: List[BatchChunk] = []
+    used = 0
+    rows = (
+        chunks.order_by("file_id", "chunk_index")
+        .values_list("id", "file_id", "chunk_index", "text")
+        .iterator(chunk_size=2000)
+    )
+    for chunk_id, file_id, chunk_index, text in rows:
+        if not text or not text.strip():
+            continue
+        stats.chunks += 1
+        digest = _text_hash(text)
+        if digest in seen:
+            stats.duplicates += 1
+            stats.aliases.setdefault(seen[digest], []).append(chunk_id)
+            continue
+        seen[digest] = chunk_id
+
+        cost = token_counter.count(text, model)
+        if batch and used + cost > token_budget:
+            stats.batches += 1
+            yield TextBatch(batch)
+            batch, used = [], 0
+        batch.append(BatchChunk(chunk_id, file_id, chunk_index, text))
+        used += cost
+
+    if batch:
+        stats.batches += 1
+        yield TextBatch(batch)
+
+
+def map_batches(fn: Callable[[str], T], batches: Iterable[TextBatch]) -> Iterator[Tuple[TextBatch, T]]:
+    """
+    Aplica `fn` al texto de cada lote en el pool compartido y devuelve pares
+    (lote, resultado) en el orden de los lotes. Solo se adelantan tantos lotes
+    como hilos tiene el pool, para no leer todos los chunks a memoria.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append((batch, _extraction_executor.submit(fn, batch.text)))
+        if len(pending) >= EXTRACTION_CONCURRENCY:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+    while pending:
+        batch, future = pending.popleft()
+        yield batch, future.result()
@@ -0,0 +1,293 @@
+"""
+Planificador de peticiones al LLM.
+
+Reemplaza el lock global del chat: permite hasta `max_concurrent` generaciones
+simultáneas (igual que OLLAMA_NUM_PARALLEL), mantiene una cola acotada con
+tiempo máximo de espera y reparte los turnos por usuario en round-robin, de
+modo que un usuario con muchas peticiones no bloquea a los demás.
+
+El límite es por proceso: con varios workers de gunicorn la capacidad total es
+workers x max_concurrent.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+ACTIVE = "active"
+DONE = "done"
+
+
+class SchedulerFull(Exception):
+    """La cola de espera alcanzó su tamaño máximo"""
+
+
+class SchedulerTimeout(Exception):
+    """La petición esperó en cola más del tiempo permitido"""
+
+
+class Ticket:
+    __slots__ = ("id", "user_id", "state", "created", "deadline", "last_seen")
+
+    def __init__(self, ticket_id: int, user_id: str, timeout: float):
+        now = time.monotonic()
+        self.id = ticket_id
+        self.user_id = user_id
+        self.state = QUEUED
+        self.created = now
+        self.deadline = now + timeout
+        self.last_seen = now
+
+
+class LLMScheduler:
+    def __init__(self,
+                 max_concurrent: int = 1,
+                 max_queue: int = 20,
+                 queue_timeout: float = 120,
+                 stale_after: float = 30,
+                 poll_interval: float = 1.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        # usuario -> cola FIFO de sus tickets; el orden del dict es el turno round-robin
+        self._users: "OrderedDict[str, deque]" = OrderedDict()
+        self._ids = itertools.count(1)
+
+    # ------------------------------------------------------------------
+    # Internos (se llaman con el lock tomado)
+    # ------------------------------------------------------------------
+    def _remove_queued(self, ticket: Ticket):
+        queue = self._users.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._users[ticket.user_id]
+
+    def _purge_stale(self, now: float):
+        """
+        Descarta tickets en cola que nadie está esperando: por ejemplo, un
+        cliente que se desconectó antes de que empezara el streaming.
+        """
+        for queue in list(self._users.values()):
+            for ticket in list(queue):
+                if now - ticket.last_seen > self.stale_after or now >= ticket.deadline:
+                    logger.info(f"Ticket LLM {ticket.id} descartado de la cola (abandonado o vencido)")
+                    self._remove_queued(ticket)
+                    ticket.state = DONE
+
+    def _dispatch(self):
+        self._purge_stale(time.monotonic())
+        while self._active < self.max_concurrent and self._users:
+            user_id, queue = next(iter(self._users.items()))
+            ticket = queue.popleft()
+            self._queued -= 1
+
+            # El usuario pasa al final del turno si aún tiene peticiones
+            del self._users[user_id]
+            if queue:
+                self._users[user_id] = queue
+
+            ticket.state = ACTIVE
+            self._active += 1
+        self._cond.notify_all()
+
+    def _position(self, ticket: Ticket) -> int:
+        """Posición (1 = siguiente) según el orden round-robin entre usuarios"""
+        queues = list(self._users.values())
+        position = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is ticket:
+                        return position
+        return 0
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def enqueue(self, user_id: Optional[str]) -> Ticket:
+        """Registra una petición. Lanza SchedulerFull si la cola está llena"""
+        with self._cond:
+            self._purge_stale(time.monotonic())
+            if self._active >= self.max_concurrent and self._queued >= self.max_queue:
+                raise SchedulerFull()
+
+            ticket = Ticket(next(self._ids), user_id or "anonimo", self.queue_timeout)
+            self._users.setdefault(ticket.user_id, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+            return ticket
+
+    def _poll(self, ticket: Ticket) -> int:
+        """
+        Revisa el ticket (con el lock tomado): 0 si ya está activo, su posición
+        en cola si sigue esperando. Lanza SchedulerTimeout si venció.
+        """
+        if ticket.state == ACTIVE:
+            return 0
+        now = time.monotonic()
+        if ticket.state == DONE or now >= ticket.deadline:
+            self._remove_queued(ticket)
+            ticket.state = DONE
+            raise SchedulerTimeout()
+
+        ticket.last_seen = now
+        return self._position(ticket)
+
+    def wait(self, ticket: Ticket) -> Iterator[int]:
+        """
+        Espera turno. Genera la posición en cola cada vez que cambia, para
+        informarla al cliente, y termina cuando el ticket queda activo.
+        Lanza SchedulerTimeout si se vence el tiempo de espera.
+        """
+        last_position = None
+        while True:
+            with self._cond:
+                position = self._poll(ticket)
+                if not position:
+                    return
+                if position == last_position:
+                    remaining = ticket.deadline - time.monotonic()
+                    self._cond.wait(timeout=max(0.0, min(self.poll_interval, remaining)))
+                    continue
+                last_position = position
+
+            yield position
+
+    async def wait_async(self, ticket: Ticket) -> AsyncIterator[int]:
+        """Igual que `wait` pero sin bloquear el event loop (vistas ASGI)"""
+        last_position = None
+        while True:
+            with self._cond:
+                position = self._poll(ticket)
+            if not position:
+                return
+            if position != last_position:
+                last_position = position
+                yield position
+            await asyncio.sleep(self.poll_interval)
+
+    def release(self, ticket: Optional[Ticket]):
+        """Libera el turno o saca el ticket de la cola. Es idempotente"""
+        if ticket is None:
+            return
+        with self._cond:
+            if ticket.state == ACTIVE:
+                self._active -= 1
+            elif ticket.state == QUEUED:
+                self._remove_queued(ticket)
+            ticket.state = DONE
+            self._dispatch()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self._active,
+                "queued": self._queued,
+                "max_queue": self.max_queue,
+            }
+
+
+class ScheduledStream:
+    """
+    Envuelve el generador de la respuesta para liberar el ticket aunque el
+    generador nunca llegue a ejecutarse: Django llama a close() al cerrar la
+    respuesta, incluso si el cliente se desconectó antes del primer byte.
+    """
+
+    def __init__(self, generator, scheduler: LLMScheduler, ticket: Ticket):
+        self._generator = generator
+        self._scheduler = scheduler
+        self._ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._generator)
+
+    def close(self):
+        try:
+            self._generator.close()
+        finally:
+            self._scheduler.release(self._ticket)
+
+
+async def _wait_disconnect(receive: Callable[[], Awaitable[dict]]):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+class AsyncScheduledStream:
+    """
+    ScheduledStream para las vistas ASGI. Django 4.2 no detecta el
+    http.disconnect durante el streaming ni cierra el generador async, así que
+    se escucha `receive` (el de la conexión, ver chat/async_views.py): si el
+    cliente se va, se cancela el paso en curso del generador (cierra el stream
+    de Ollama) y se libera el ticket.
+    """
+
+    def __init__(self, generator, scheduler: LLMScheduler, ticket: Ticket,
+                 receive: Optional[Callable[[], Awaitable[dict]]] = None):
+        self._generator = generator
+        self._scheduler = scheduler
+        self._ticket = ticket
+        self._receive = receive
+
+    def __aiter__(self):
+        return self._stream()
+
+    async def _stream(self):
+        disconnected = asyncio.ensure_future(_wait_disconnect(self._receive)) if self._receive else None
+        try:
+            while True:
+                step = asyncio.ensure_future(self._generator.__anext__())
+                if disconnected is not None:
+                    await asyncio.wait({step, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                    if not step.done():
+                        logger.info(f"Cliente desconectado; se cancela la respuesta del ticket {self._ticket.id}")
+                        step.cancel()
+                        await asyncio.wait({step})
+                        break
+                try:
+                    chunk = await step
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            try:
+                await self._generator.aclose()
+            finally:
+                self._scheduler.release(self._ticket)
+
+    def close(self):
+        # Respaldo: Django llama a close() al cerrar la respuesta
+        self._scheduler.release(self._ticket)
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrent=getattr(settings, "LLM_MAX_CONCURRENT", 1),
+    max_queue=getattr(settings, "LLM_QUEUE_MAX", 20),
+    queue_timeout=getattr(settings, "LLM_QUEUE_TIMEOUT", 120),
+)
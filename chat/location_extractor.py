@@ -3,71 +3,16 @@ import json
 import logging
 import requests
 from django.conf import settings
-from fileuploads.models import Context, DocumentEmbedding
+from fileuploads.models import Context
+from .location_index import distinct_names, extract_pending, prompt_key
 
 logger = logging.getLogger(__name__)
 
-
-def extract_locations_from_context(context_id, model="llama3.1"):
-    """
-    Extrae ubicaciones (países, estados, municipios) de los documentos de un contexto.
-    Procesa todos los chunks en lotes para asegurar cobertura completa.
-    """
-    try:
-        context = Context.objects.get(id=context_id)
-        files = context.files.all()
-        
-        all_locations = set()
-        
-        # Configuración del lote
-        BATCH_SIZE = 5  # Número de chunks por llamada al LLM
-        
-        for file in files:
-            # Obtener todos los chunks ordenados
-            chunks = DocumentEmbedding.objects.filter(file=file).order_by('chunk_index')
-            total_chunks = chunks.count()
-            
-            logger.info(f"Procesando archivo {file.filename} con {total_chunks} chunks para extracción de lugares.")
-            
-            current_batch_text = ""
-            current_chunk_count = 0
-            
-            for chunk in chunks:
-                current_batch_text += chunk.text + "\n\n"
-                current_chunk_count += 1
-                
-                # Procesar si alcanzamos el tamaño del lote o es el último chunk
-                if current_chunk_count >= BATCH_SIZE:
-                    batch_locations = process_batch(current_batch_text, model)
-                    all_locations.update(batch_locations)
-                    
-                    # Reiniciar lote
-                    current_batch_text = ""
-                    current_chunk_count = 0
-            
-            # Procesar el remanente si existe
-            if current_batch_text:
-                batch_locations = process_batch(current_batch_text, model)
-                all_locations.update(batch_locations)
-
-        return sorted(list(all_locations))
-
-    except Exception as e:
-        logger.error(f"Error extrayendo ubicaciones: {str(e)}")
-        return []
-
-def process_batch(text, model):
-    """
-    Función auxiliar para enviar un lote de texto a Ollama.
-    """
-    if not text.strip():
-        return []
-        
-    prompt = f"""
+LOCATIONS_PROMPT = """
     Analiza el siguiente texto y extrae UNICAMENTE las **JURISDICCIONES POLÍTICO-ADMINISTRATIVAS** (lugares que tienen un gobierno, alcalde o gobernador).
 
     TEXTO:
-    {text[:12000]}
+    {text}
     
     REGLAS DE EXCLUSIÓN (Blacklist):
     NO incluyas nada que empiece o contenga:
@@ -98,6 +43,53 @@ def process_batch(text, model):
     SALIDA:
     Devuelve un JSON: {{ "lugares": ["China", "Francia", "Versalles"] }}
     """
+LOCATIONS_PROMPT_KEY = prompt_key(LOCATIONS_PROMPT)
+
+
+def extract_locations_from_context(context_id, model=None):
+    """
+    Extrae ubicaciones (países, estados, municipios) de los documentos de un contexto.
+    Solo los chunks que aún no están en el índice de lugares pasan por el LLM
+    (en lotes paralelos, ver llm_batches.py); el resultado se agrega en SQL
+    sobre el índice (location_index.py).
+    """
+    model = model or getattr(settings, "LOCATION_INDEX_MODEL", "llama3.1")
+    try:
+        context = Context.objects.get(id=context_id)
+        file_ids = list(context.files.values_list('id', flat=True))
+        index_file_locations(file_ids, model)
+        return distinct_names(file_ids, model, LOCATIONS_PROMPT_KEY)
+
+    except Exception as e:
+        logger.error(f"Error extrayendo ubicaciones: {str(e)}")
+        return []
+
+def index_file_locations(file_ids, model):
+    """Llena el índice de lugares de los chunks pendientes de los archivos"""
+    return extract_pending(
+        file_ids, model, LOCATIONS_PROMPT_KEY,
+        lambda text: extract_batch(text, model),
+        label="lugares",
+    )
+
+def extract_batch(text, model):
+    """Salida cruda del LLM y entidades normalizadas de un lote (para el índice)"""
+    raw = request_locations(text, model)
+    if raw is None:
+        return None, []
+    return raw, [{"name": name} for name in clean_locations(raw.get("lugares", []))]
+
+def process_batch(text, model):
+    """
+    Función auxiliar para enviar un lote de texto a Ollama.
+    """
+    if not text.strip():
+        return []
+    return clean_locations((request_locations(text, model) or {}).get("lugares", []))
+
+def request_locations(text, model):
+    """Salida JSON del LLM para un lote de texto, o None si la llamada falla"""
+    prompt = LOCATIONS_PROMPT.format(text=text)
 
     ollama_url = f"{settings.OLLAMA_API_URL}/api/generate"
     
@@ -119,45 +111,46 @@ def process_batch(text, model):
         response_text = result.get("response", "{}")
         
         data = json.loads(response_text)
-        locations = data.get("lugares", [])
-        
-        # Limpieza básica
-        raw_locations = data.get("lugares", [])
-        
-        # Filtro estricto post-procesamiento
-        clean_locations = []
-        
-        BLACKLIST = [
-            "catedral", "palacio", "jardines", "gran muralla", "parque nacional", 
-            "museo", "universidad", "unesco", "zona arqueológica", "abadía", 
-            "basílica", "conjunto", "sitio", "centro histórico", "reserva", 
-            "santuario", "templo", "fortaleza", "castillo", "monasterio"
-        ]
-        
-        for loc in raw_locations:
-            if not isinstance(loc, str) or not loc.strip():
-                continue
-                
-            loc_clean = loc.strip()
-            loc_lower = loc_clean.lower()
-            
-            # Regla 1: Longitud excesiva (probablemente una descripción o nombre de sitio)
-            # La mayoría de ciudades/países tienen 1-3 palabras. Más de 4 es sospechoso.
-            if len(loc_clean.split()) > 4:
-                continue
-                
-            # Regla 2: Palabras prohibidas
-            if any(bad_word in loc_lower for bad_word in BLACKLIST):
-                continue
-                
-            # Regla 3: No es dígito ni símbolo
-            if any(char.isdigit() for char in loc_clean):
-               continue
-               
-            clean_locations.append(loc_clean)
-
-        return clean_locations
+        return data if isinstance(data, dict) else {}
         
     except Exception as e:
         logger.error(f"Error en batch de extracción: {e}")
+        return None
+
+def clean_locations(raw_locations):
+    """Filtro estricto post-procesamiento de los nombres que devuelve el LLM"""
+    if not isinstance(raw_locations, list):
         return []
+
+    clean = []
+    
+    BLACKLIST = [
+        "catedral", "palacio", "jardines", "gran muralla", "parque nacional", 
+        "museo", "universidad", "unesco", "zona arqueológica", "abadía", 
+        "basílica", "conjunto", "sitio", "centro histórico", "reserva", 
+        "santuario", "templo", "fortaleza", "castillo", "monasterio"
+    ]
+    
+    for loc in raw_locations:
+        if not isinstance(loc, str) or not loc.strip():
+            continue
+            
+        loc_clean = loc.strip()
+        loc_lower = loc_clean.lower()
+        
+        # Regla 1: Longitud excesiva (probablemente una descripción o nombre de sitio)
+        # La mayoría de ciudades/países tienen 1-3 palabras. Más de 4 es sospechoso.
+        if len(loc_clean.split()) > 4:
+            continue
+            
+        # Regla 2: Palabras prohibidas
+        if any(bad_word in loc_lower for bad_word in BLACKLIST):
+            continue
+            
+        # Regla 3: No es dígito ni símbolo
+        if any(char.isdigit() for char in loc_clean):
+           continue
+           
+        clean.append(loc_clean)
+
+    return clean
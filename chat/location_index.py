@@ -0,0 +1,210 @@
+"""
+Índice persistente de lugares por chunk.
+
+El texto de un chunk no cambia después de la ingesta, así que cada chunk pasa
+una sola vez por cada extractor (modelo + prompt):
+
+- LocationExtraction marca los chunks ya procesados y guarda la salida cruda
+  del LLM de cada lote.
+- LocationEntity guarda las filas normalizadas (nombre, tipo, estado, país,
+  contexto, coordenadas) con el archivo y la posición del chunk.
+
+Una consulta de lugares de un contexto extrae solo los chunks pendientes
+(p. ej. los de archivos recién agregados) y después agrega en SQL las filas
+ya guardadas. El índice se llena de forma perezosa en cada consulta o, si
+LOCATION_INDEX_AFTER_INGEST está activo, con una tarea de Celery al terminar
+la ingesta (tasks.py).
+"""
+import hashlib
+import json
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from fileuploads.models import DocumentEmbedding, LocationExtraction
+from .llm_batches import BatchStats, TextBatch, iter_text_batches, map_batches
+
+logger = logging.getLogger(__name__)
+
+# (salida cruda del LLM o None si la llamada falló, entidades normalizadas)
+ExtractFn = Callable[[str], Tuple[Optional[object], List[dict]]]
+
+ENTITY_FIELDS = ("name", "type", "estado", "pais", "context", "longitude", "latitude")
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def pending_chunks(file_ids: Iterable[int], model: str, key: str):
+    """Chunks de los archivos que este extractor todavía no procesó"""
+    done = LocationExtraction.objects.filter(chunk_id=OuterRef("pk"), model=model, prompt_key=key)
+    return DocumentEmbedding.objects.filter(file_id__in=list(file_ids)).filter(~Exists(done))
+
+
+def _owner_chunk(batch: TextBatch, entity: dict) -> int:
+    """Chunk del lote al que pertenece la entidad: el que contiene su contexto o su nombre"""
+    for field in ("context", "name"):
+        needle = (entity.get(field) or "").strip().lower()
+        if needle:
+            for chunk in batch.chunks:
+                if needle in chunk.text.lower():
+                    return chunk.id
+    return batch.chunks[0].id
+
+
+def _json(value) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False)
+
+
+def _store_batch(batch: TextBatch, model: str, key: str, raw_output, entities: List[dict]):
+    chunks = {chunk.id: chunk for chunk in batch.chunks}
+    first_id = batch.chunks[0].id
+    with transaction.atomic(), connection.cursor() as cursor:
+        # ON CONFLICT: otra petición pudo procesar el mismo chunk al mismo tiempo;
+        # solo se guardan entidades de los chunks que marcó esta ejecución
+        cursor.execute(
+            """
+            INSERT INTO fileuploads_locationextraction
+                (chunk_id, file_id, model, prompt_key, raw_output, created_date)
+            SELECT c.id, c.file_id, %s, %s, CASE WHEN c.id = %s THEN %s::jsonb END, now()
+            FROM unnest(%s::bigint[], %s::bigint[]) AS c(id, file_id)
+            ON CONFLICT (chunk_id, model, prompt_key) DO NOTHING
+            RETURNING chunk_id
+            """,
+            [model, key, first_id, _json(raw_output), list(chunks), [c.file_id for c in chunks.values()]],
+        )
+        marked = {row[0] for row in cursor.fetchall()}
+
+        rows = []
+        for entity in entities:
+            chunk = chunks[_owner_chunk(batch, entity)]
+            if chunk.id in marked:
+                rows.append([chunk.id, chunk.file_id, model, key, chunk.chunk_index]
+                            + [entity.get(field) for field in ENTITY_FIELDS])
+        if rows:
+            cursor.executemany(
+                f"""
+                INSERT INTO fileuploads_locationentity
+                    (chunk_id, file_id, model, prompt_key, position, {", ".join(ENTITY_FIELDS)})
+                VALUES (%s, %s, %s, %s, %s, {", ".join(["%s"] * len(ENTITY_FIELDS))})
+                """,
+                rows,
+            )
+
+
+def _copy_aliases(aliases: Dict[int, List[int]], model: str, key: str):
+    """Los chunks omitidos por tener el mismo texto reciben las entidades del original"""
+    pairs = [(original, alias) for original, dups in aliases.items() for alias in dups]
+    if not pairs:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO fileuploads_locationextraction
+                (chunk_id, file_id, model, prompt_key, raw_output, created_date)
+            SELECT d.id, d.file_id, %s, %s, NULL, now()
+            FROM unnest(%s::bigint[], %s::bigint[]) AS m(original, alias)
+            JOIN fileuploads_documentembedding d ON d.id = m.alias
+            WHERE EXISTS (
+                SELECT 1 FROM fileuploads_locationextraction x
+                WHERE x.chunk_id = m.original AND x.model = %s AND x.prompt_key = %s
+            )
+            ON CONFLICT (chunk_id, model, prompt_key) DO NOTHING
+            RETURNING chunk_id
+            """,
+            [model, key, [p[0] for p in pairs], [p[1] for p in pairs], model, key],
+        )
+        marked = [row[0] for row in cursor.fetchall()]
+        if not marked:
+            return
+        cursor.execute(
+            f"""
+            INSERT INTO fileuploads_locationentity
+                (chunk_id, file_id, model, prompt_key, position, {", ".join(ENTITY_FIELDS)})
+            SELECT d.id, d.file_id, e.model, e.prompt_key, d.chunk_index, {", ".join("e." + f for f in ENTITY_FIELDS)}
+            FROM unnest(%s::bigint[], %s::bigint[]) AS m(original, alias)
+            JOIN fileuploads_locationentity e
+              ON e.chunk_id = m.original AND e.model = %s AND e.prompt_key = %s
+            JOIN fileuploads_documentembedding d ON d.id = m.alias
+            WHERE m.alias = ANY(%s::bigint[])
+            """,
+            [[p[0] for p in pairs], [p[1] for p in pairs], model, key, marked],
+        )
+
+
+def extract_pending(file_ids: Iterable[int], model: str, key: str, extract_fn: ExtractFn,
+                    label: str = "lugares") -> BatchStats:
+    """Extrae y guarda las entidades de los chunks pendientes de los archivos"""
+    file_ids = list(file_ids)
+    stats = BatchStats()
+    failed = 0
+    batches = iter_text_batches(pending_chunks(file_ids, model, key), model=model, stats=stats)
+    for batch, (raw_output, entities) in map_batches(extract_fn, batches):
+        if raw_output is None:
+            # La llamada falló: los chunks quedan pendientes para la siguiente consulta
+            failed += 1
+            continue
+        _store_batch(batch, model, key, raw_output, entities)
+    _copy_aliases(stats.aliases, model, key)
+
+    logger.info(
+        f"Extracción de {label} en {len(file_ids)} archivos: {stats.batches} lotes nuevos "
+        f"({failed} fallidos), {stats.chunks} chunks pendientes ({stats.duplicates} duplicados omitidos)"
+    )
+    return stats
+
+
+def distinct_names(file_ids: Iterable[int], model: str, key: str) -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT DISTINCT name FROM fileuploads_locationentity
+            WHERE file_id = ANY(%s) AND model = %s AND prompt_key = %s
+            ORDER BY name
+            """,
+            [list(file_ids), model, key],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def first_mentions(file_ids: Iterable[int], model: str, key: str) -> List[dict]:
+    """
+    Primera aparición (en orden de archivo y chunk) de cada (nombre, tipo),
+    con el número de menciones y el archivo donde aparece. Devuelve dicts con
+    las llaves del extractor ("país", "coordenadas").
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT name, type, estado, pais, context, longitude, latitude, mentions, file_id
+            FROM (
+                SELECT DISTINCT ON (lower(e.name), e.type) e.*,
+                       count(*) OVER (PARTITION BY lower(e.name), e.type) AS mentions
+                FROM fileuploads_locationentity e
+                WHERE e.file_id = ANY(%s) AND e.model = %s AND e.prompt_key = %s
+                ORDER BY lower(e.name), e.type, e.file_id, e.position, e.id
+            ) AS firsts
+            ORDER BY file_id, position, id
+            """,
+            [list(file_ids), model, key],
+        )
+        rows = cursor.fetchall()
+
+    entities = []
+    for name, etype, estado, pais, context, longitude, latitude, mentions, file_id in rows:
+        entity = {"name": name, "type": etype}
+        if context is not None:
+            entity["context"] = context
+        if pais is not None:
+            entity["país"] = pais
+        if estado is not None:
+            entity["estado"] = estado
+        if longitude is not None and latitude is not None:
+            entity["coordenadas"] = [longitude, latitude]
+        entity["menciones"] = mentions
+        entity["file_id"] = file_id
+        entities.append(entity)
+    return entities
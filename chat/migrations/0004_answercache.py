@@ -0,0 +1,35 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import pgvector.django.vector
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0013_documentembedding_search_vector'),
+        ('chat', '0003_alter_history_user_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_version', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=255)),
+                ('query', models.TextField()),
+                ('query_embedding', pgvector.django.vector.VectorField(dimensions=768)),
+                ('answer', models.TextField()),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_date', models.DateTimeField(blank=True, null=True)),
+                ('context', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_cache', to='fileuploads.context')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['context', 'content_version', 'model'], name='chat_answer_context_342763_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:57
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_answercache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JsonQueryPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_fingerprint', models.CharField(max_length=64)),
+                ('terms_key', models.CharField(max_length=64)),
+                ('search_terms', models.JSONField(default=dict)),
+                ('file_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('key_sql', models.TextField(blank=True, null=True)),
+                ('data_sql', models.TextField(blank=True, null=True)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_date', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='jsonqueryplan',
+            constraint=models.UniqueConstraint(fields=('schema_fingerprint', 'terms_key'), name='chat_jsonqueryplan_unique_key'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 from fileuploads.models import Context
+from pgvector.django import VectorField
 
 # Create your models here.
 class History(models.Model):
@@ -11,4 +13,42 @@ class History(models.Model):
     credate_date  = models.DateTimeField(auto_now_add=True)
     is_delete     = models.BooleanField(default=False)
     job_id        = models.UUIDField(null=True, blank=True)
-    job_status    = models.TextField(null=True, blank=True)
\ No newline at end of file
+    job_status    = models.TextField(null=True, blank=True)
+
+
+class AnswerCache(models.Model):
+    """Respuestas ya generadas para un contexto, reutilizables por similitud de la pregunta"""
+    context         = models.ForeignKey(Context, on_delete=models.CASCADE, related_name="answer_cache")
+    # Huella de los archivos procesados del contexto al momento de responder
+    content_version = models.CharField(max_length=64)
+    model           = models.CharField(max_length=255)
+    query           = models.TextField()
+    query_embedding = VectorField(dimensions=768)
+    answer          = models.TextField()
+    title           = models.CharField(max_length=255, blank=True, null=True)
+    hits            = models.IntegerField(default=0)
+    created_date    = models.DateTimeField(auto_now_add=True)
+    last_hit_date   = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['context', 'content_version', 'model']),
+        ]
+
+
+class JsonQueryPlan(models.Model):
+    """SQL validado (llaves y datos) para unas SEARCH_TERMS sobre un esquema de archivos JSON"""
+    schema_fingerprint = models.CharField(max_length=64)
+    terms_key          = models.CharField(max_length=64)
+    search_terms       = models.JSONField(default=dict)
+    file_ids           = ArrayField(models.BigIntegerField(), default=list)
+    key_sql            = models.TextField(null=True, blank=True)
+    data_sql           = models.TextField(null=True, blank=True)
+    hits               = models.IntegerField(default=0)
+    created_date       = models.DateTimeField(auto_now_add=True)
+    last_hit_date      = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['schema_fingerprint', 'terms_key'], name='chat_jsonqueryplan_unique_key'),
+        ]
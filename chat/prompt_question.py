@@ -195,6 +195,44 @@ Está TERMINANTEMENTE PROHIBIDO:
 - Usar comparaciones de año sin el operador `->>`.
 - Omitir el regex de validación numérica.
 
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+REGLA DE CONTENCIÓN `@>` (IGUALDAD EXACTA)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+`f.text_json` tiene un índice GIN (jsonb_path_ops) que SOLO se usa con el
+operador de contención `@>`. TODA comparación por IGUALDAD EXACTA DEBE
+escribirse como contención, NUNCA con `=` sobre `->` o `->>`.
+
+Aplica a:
+- years con valores y has_range = false (años explícitos)
+- quantity_filter con operator = "="
+
+El literal JSON reproduce el json_path COMPLETO como objetos anidados y el
+valor respeta el type declarado en METADATA_KEYS:
+
+- type = "number", depth 0 (json_path: ["anio"]):
+    f.text_json @> '{{"anio": 2021}}'::jsonb
+
+- type = "string", depth 0:
+    f.text_json @> '{{"anio": "2021"}}'::jsonb
+
+- anidado (json_path: ["documento", "anio"]):
+    f.text_json @> '{{"documento": {{"anio": 2021}}}}'::jsonb
+
+- is_array = True (json_path: ["autores", "anio"]):
+    f.text_json @> '{{"autores": [{{"anio": 2021}}]}}'::jsonb
+
+Varios valores → UNA contención por valor, unidas con OR:
+(f.text_json @> '{{"anio": 2020}}'::jsonb OR f.text_json @> '{{"anio": 2021}}'::jsonb)
+
+Está PROHIBIDO:
+- (f.text_json->>'anio') = '2021'
+- (f.text_json->'anio')::integer = 2021
+- Usar jsonb_array_elements() para una igualdad exacta dentro de un array.
+
+La contención NO reemplaza a `%`: los términos de texto siguen la
+REGLA DE TÉRMINOS y los rangos la REGLA DE RANGO.
+
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 REGLA DE TÉRMINOS (has_terms = true)
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -255,6 +293,7 @@ ESTRUCTURA DE SALIDA CON FILE_ID
 SELECT f.text_json
 FROM fileuploads_documentembedding AS f
 WHERE f.file_id = ANY(ARRAY{list_files_json})
+  <AND bloque_contencion si aplica>
   <AND bloque_rango si aplica>
   <AND bloque_cantidad si aplica>
   <AND bloque_terminos si aplica>
@@ -268,6 +307,7 @@ COMPORTAMIENTO FINAL
 - NO inventes arrays.
 - NO uses ILIKE.
 - NO uses CAST ::text.
+- Igualdad exacta SIEMPRE con `@>`.
 - NO accedas arrays como objetos.
 - NO generes SQL ambiguo.
 - Devuelve ÚNICAMENTE la consulta SQL.
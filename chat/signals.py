@@ -0,0 +1,36 @@
+"""
+Invalida las cachés del chat cuando cambian los archivos:
+
+- respuestas (answer_cache.py) al cambiar los archivos de un contexto
+- planes SQL (sql_plan_cache.py) al borrar un archivo
+
+Las llaves de ambas cachés ya incluyen una huella de los archivos, así que
+esto evita servir entradas viejas y además libera las que no volverán a usarse.
+"""
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from fileuploads.models import Context, Files
+from fileuploads.signals import cleared_context_ids
+from .answer_cache import invalidate_context
+from .sql_plan_cache import invalidate_files
+
+
+@receiver(m2m_changed, sender=Context.files.through)
+def invalidate_answer_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        # instance es un Files; en clear() se invalidan los contextos que tenía
+        context_ids = pk_set if pk_set is not None else cleared_context_ids(instance)
+    else:
+        context_ids = [instance.pk]
+
+    if context_ids:
+        invalidate_context(context_ids)
+
+
+@receiver(post_delete, sender=Files)
+def invalidate_sql_plans(sender, instance, **kwargs):
+    invalidate_files([instance.pk])
@@ -0,0 +1,100 @@
+"""
+Caché de planes SQL de search_in_json_files.
+
+Para un mismo conjunto de archivos JSON el esquema de llaves casi no cambia,
+así que el SQL de llaves y el de datos que el LLM generó (y que se ejecutaron
+sin error) se guardan con la llave
+
+    (huella del esquema, SEARCH_TERMS normalizadas)
+
+y una pregunta repetida o equivalente se resuelve sin las llamadas de
+generación de SQL. La huella incluye los ids de archivo y las llaves/tipos,
+por lo que agregar, quitar o reprocesar archivos cambia la llave; además, al
+borrar un archivo se eliminan los planes que lo usaban (signals.py).
+"""
+import hashlib
+import json
+import logging
+import unicodedata
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import JsonQueryPlan
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        value = unicodedata.normalize("NFKD", value)
+        value = "".join(c for c in value if not unicodedata.combining(c))
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        items = [_normalize(v) for v in value]
+        # El orden de los términos no cambia la consulta
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def search_terms_key(search_terms: dict) -> str:
+    """Hash de las SEARCH_TERMS sin importar mayúsculas, acentos, espacios ni orden"""
+    canonical = json.dumps(_normalize(search_terms), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def schema_fingerprint(file_ids: Iterable[int], keys: List[dict]) -> str:
+    """Huella de los archivos y de sus llaves/tipos (sin los conteos)"""
+    canonical = json.dumps(
+        {
+            "files": sorted(int(i) for i in file_ids),
+            "keys": sorted(f"{k['key']}:{k['type']}" for k in keys),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def get_plan(fingerprint: str, terms_key: str) -> Optional[JsonQueryPlan]:
+    if not getattr(settings, "CHAT_SQL_PLAN_CACHE", True):
+        return None
+    plan = JsonQueryPlan.objects.filter(schema_fingerprint=fingerprint, terms_key=terms_key).first()
+    if plan is not None:
+        JsonQueryPlan.objects.filter(id=plan.id).update(hits=F("hits") + 1, last_hit_date=timezone.now())
+        logger.info(f"Plan SQL en caché (id={plan.id}, hits={plan.hits + 1})")
+    return plan
+
+
+def save_plan(fingerprint: str, terms_key: str, search_terms: dict, file_ids: Iterable[int],
+              key_sql: Optional[str], data_sql: Optional[str]):
+    if not getattr(settings, "CHAT_SQL_PLAN_CACHE", True):
+        return
+    try:
+        JsonQueryPlan.objects.update_or_create(
+            schema_fingerprint=fingerprint,
+            terms_key=terms_key,
+            defaults={
+                "search_terms": search_terms,
+                "file_ids": sorted(int(i) for i in file_ids),
+                "key_sql": key_sql,
+                "data_sql": data_sql,
+            },
+        )
+    except Exception as e:
+        logger.error(f"No se pudo guardar el plan SQL: {str(e)}")
+
+
+def discard_plan(plan: JsonQueryPlan):
+    JsonQueryPlan.objects.filter(id=plan.id).delete()
+
+
+def invalidate_files(file_ids: Iterable[int]):
+    file_ids = [int(i) for i in file_ids]
+    if file_ids:
+        deleted, _ = JsonQueryPlan.objects.filter(file_ids__overlap=file_ids).delete()
+        if deleted:
+            logger.info(f"Planes SQL invalidados por archivos {file_ids}: {deleted}")
@@ -0,0 +1,19 @@
+"""
+Tareas asíncronas de Celery para chat
+"""
+from celery import shared_task
+from django.conf import settings
+
+
+@shared_task(bind=True, name='chat.index_file_locations', ignore_result=True,
+             time_limit=settings.INGEST_TASK_TIME_LIMIT,
+             soft_time_limit=settings.INGEST_TASK_TIME_LIMIT - 60)
+def index_file_locations_task(self, file_id: int):
+    """
+    Llena el índice de lugares (location_index.py) de un archivo recién
+    ingestado, para que get_context_locations no tenga que esperar al LLM.
+    """
+    from .location_extractor import index_file_locations
+
+    stats = index_file_locations([file_id], getattr(settings, "LOCATION_INDEX_MODEL", "llama3.1"))
+    return {'file_id': file_id, 'batches': stats.batches, 'chunks': stats.chunks}
@@ -1,8 +1,9 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('v1', views.chat, name='chat-api'),
+    path('v1/async', async_views.chat_async, name='chat-api-async'),
     path('history/generate', views.historyGenerate, name='history-generate'),
     path('history/user', views.historyUser, name='history-user'),
     path('history/getchats', views.get_chat_histories, name='history-chats'),
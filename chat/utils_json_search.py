@@ -3,16 +3,32 @@ from fileuploads.models import DocumentEmbedding
 from .prompt_question import BASE_SYSTEM_PROMPT_JSON
 from .prompt_keys import BASE_SYSTEM_PROMPT_KEYS
 from .prompt_semantico import BASE_SYSTEM_PROMPT_SEMANTICO
+from .context_packer import ollama_options
+from .sql_plan_cache import discard_plan, get_plan, save_plan, schema_fingerprint, search_terms_key
 import json
 import logging
 import requests
-from typing import List, Any
+import threading
+from typing import List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
-def search_in_json_files(context, query, reasoning_model, server_url) -> List[List[str]]:
+
+class SearchCancelled(Exception):
+    pass
+
+
+def _check_cancelled(cancelled: Optional[threading.Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise SearchCancelled()
+
+
+def search_in_json_files(context, query, reasoning_model, server_url,
+                         cancelled: Optional[threading.Event] = None) -> List[List[str]]:
     """
     Realiza la búsqueda en archivos JSON usando SQL generado por LLM.
+    `cancelled` se revisa antes de cada llamada al LLM: si la rama ya venció
+    su plazo en el chat (run_retrieval_branches) no se hacen más llamadas.
     Returns: List[List[str]] (rows_serializable)
     """
     try:
@@ -23,6 +39,7 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
         # 1. Semantic Search
         system_prompt_semantico = BASE_SYSTEM_PROMPT_SEMANTICO.format()
         
+        _check_cancelled(cancelled)
         url = f"{server_url}/api/chat"
         sql_payload = {
             "model": reasoning_model,
@@ -32,9 +49,7 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
             ],
             "stream": False,
             "format": "json",
-            "options": {
-                "temperature": 0
-            }
+            "options": ollama_options(server_url, reasoning_model, temperature=0)
         }
         
         resp = requests.post(
@@ -58,7 +73,22 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
         if search_terms.get("has_terms") or search_terms.get("has_quantity") or search_terms.get("has_range"):
             
             lista_de_keys = DocumentEmbedding.get_json_keys_with_types(list_files_json)
-            
+
+            # Plan SQL ya validado para este esquema y estas SEARCH_TERMS: sin LLM
+            fingerprint = schema_fingerprint(list_files_json, lista_de_keys)
+            terms_key = search_terms_key(search_terms)
+            plan = get_plan(fingerprint, terms_key)
+            if plan is not None:
+                if not plan.data_sql:
+                    return _fallback_search(list_files_json)
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(plan.data_sql)
+                        return _serialize_rows(cursor.fetchall())
+                except Exception as e:
+                    logger.error(f"Error executing cached data SQL, se descarta el plan: {e}")
+                    discard_plan(plan)
+
             llm_context_keys = f"""
                 SEARCH_TERMS (AUTORIDAD FINAL):
                 {json.dumps(search_terms, indent=2)}
@@ -66,7 +96,9 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
             system_prompt_KEYS = BASE_SYSTEM_PROMPT_KEYS.format(schema=lista_de_keys, list_files_json=list_files_json)
             
             rows_keys = []
+            key_sql_ok = None
             for _ in range(3): 
+                _check_cancelled(cancelled)
                 url = f"{server_url}/api/chat"
                 sql_payload = {
                     "model": reasoning_model,
@@ -74,7 +106,8 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
                         {"role": "system", "content": system_prompt_KEYS},
                         {"role": "user", "content": llm_context_keys},
                     ],
-                    "stream": False, "temperature": 0, "think": False
+                    "stream": False, "temperature": 0, "think": False,
+                    "options": ollama_options(server_url, reasoning_model),
                 }
                 
                 resp = requests.post(
@@ -88,6 +121,7 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
                     with connection.cursor() as cursor:
                         cursor.execute(sql)
                         rows_keys = cursor.fetchall()
+                        key_sql_ok = sql
                         break
                 except Exception as e:
                     logger.error(f"Error executing key SQL: {e}")
@@ -140,6 +174,7 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
                 
                 rows_data = None
                 for _ in range(5): 
+                    _check_cancelled(cancelled)
                     url = f"{server_url}/api/chat"
                     sql_payload = {
                         "model": reasoning_model,
@@ -147,7 +182,8 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
                             {"role": "system", "content": system_prompt},
                             {"role": "user", "content": llm_context_data},
                         ],
-                        "stream": False, "temperature": 0, "think": False
+                        "stream": False, "temperature": 0, "think": False,
+                        "options": ollama_options(server_url, reasoning_model),
                     }
                     
                     resp = requests.post(
@@ -190,30 +226,37 @@ def search_in_json_files(context, query, reasoning_model, server_url) -> List[Li
                 if rows_data is None:
                     logger.error("Failed to execute final data SQL")
                     return []
-                
-                # Serialize Results
-                rows_serializable = []
-                for row in rows_data:
-                    serialized_row = []
-                    for value in row:
-                        if value is not None:
-                            serialized_row.append(str(value))
-                    if serialized_row:
-                        rows_serializable.append(serialized_row)
-
-                return rows_serializable
+
+                save_plan(fingerprint, terms_key, search_terms, list_files_json, key_sql_ok, sql)
+                return _serialize_rows(rows_data)
 
             else:
                 # Fallback specific (has terms but no keys found to reduce)
+                if key_sql_ok is not None:
+                    save_plan(fingerprint, terms_key, search_terms, list_files_json, key_sql_ok, None)
                 return _fallback_search(list_files_json)
         else:
             # Fallback simple (no search terms)
             return _fallback_search(list_files_json)
 
+    except SearchCancelled:
+        logger.info("Búsqueda JSON cancelada: la rama venció su plazo")
+        return []
     except Exception as e:
         logger.error(f"Error in search_in_json_files: {str(e)}")
         return []
 
+def _serialize_rows(rows) -> List[List[str]]:
+    rows_serializable = []
+    for row in rows:
+        serialized_row = []
+        for value in row:
+            if value is not None:
+                serialized_row.append(str(value))
+        if serialized_row:
+            rows_serializable.append(serialized_row)
+    return rows_serializable
+
 def _fallback_search(list_files_json):
     sql = f"""
         SELECT text_json
@@ -226,16 +269,7 @@ def _fallback_search(list_files_json):
             cursor.execute(sql)
             rows = cursor.fetchall()
             
-        rows_serializable = []
-        if rows:
-            for row in rows:
-                serialized_row = []
-                for value in row:
-                    if value is not None:
-                        serialized_row.append(str(value))
-                if serialized_row:
-                    rows_serializable.append(serialized_row)
-        return rows_serializable
+        return _serialize_rows(rows or [])
     except Exception as e:
         logger.error(f"Error in fallback search: {e}")
         return []
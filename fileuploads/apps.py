@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FileuploadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fileuploads'
+
+    def ready(self):
+        # Sincronización de DocumentEmbedding.context_ids con Context.files
+        from . import signals  # noqa: F401
@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza espacios para que textos equivalentes compartan la misma llave"""
+    return " ".join(str(text).split())
+
+
+class LocalLRUCache:
+    """
+    Cache LRU en memoria del proceso, acotado por bytes (no por número de entradas).
+    Es thread-safe porque el embedder se usa desde varios hilos a la vez.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: np.ndarray):
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+
+            self._data[key] = value
+            self._bytes += value.nbytes
+            self._evict()
+
+    def _evict(self):
+        # Desalojar las entradas menos usadas hasta respetar el límite de bytes
+        while self._bytes > self.max_bytes and self._data:
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+class EmbeddingCache:
+    """
+    Cache de embeddings en dos niveles, direccionado por contenido:
+
+    1. LRU local del proceso, acotado por `max_local_mb`.
+    2. Almacén compartido en Redis, visible para todos los workers de gunicorn
+       y de Celery.
+
+    Las llaves son (modelo, sha256 del texto normalizado) y los vectores se
+    guardan como float32. Si Redis no está disponible el cache sigue
+    funcionando solo con el nivel local.
+    """
+
+    def __init__(self,
+                 model_name: str,
+                 max_local_mb: int = 50,
+                 redis_url: Optional[str] = None,
+                 ttl_seconds: int = 30 * 24 * 3600,
+                 prefix: str = "emb",
+                 retry_after_seconds: int = 60):
+        self.model_name = model_name
+        self.local = LocalLRUCache(max_bytes=int(max_local_mb * 1024 * 1024))
+        self.redis_url = redis_url
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.retry_after_seconds = retry_after_seconds
+
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._redis_lock = threading.Lock()
+
+        self.hits_local = 0
+        self.hits_shared = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # Llaves
+    # ------------------------------------------------------------------
+    def make_key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.prefix}:{self.model_name}:{digest}"
+
+    # ------------------------------------------------------------------
+    # Redis
+    # ------------------------------------------------------------------
+    def _get_redis(self):
+        """Devuelve el cliente Redis o None si está deshabilitado o caído"""
+        if not self.redis_url:
+            return None
+
+        if time.time() < self._redis_down_until:
+            return None
+
+        with self._redis_lock:
+            if self._redis is None:
+                try:
+                    import redis
+                    self._redis = redis.Redis.from_url(
+                        self.redis_url,
+                        socket_timeout=2,
+                        socket_connect_timeout=2,
+                    )
+                except Exception as e:
+                    self._mark_redis_down(e)
+                    return None
+            return self._redis
+
+    def _mark_redis_down(self, error: Exception):
+        logger.warning(f"Cache compartido de embeddings no disponible ({error}), "
+                       f"se reintenta en {self.retry_after_seconds}s")
+        self._redis_down_until = time.time() + self.retry_after_seconds
+
+    @staticmethod
+    def _to_bytes(embedding: np.ndarray) -> bytes:
+        return np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _from_bytes(raw: bytes) -> np.ndarray:
+        return np.frombuffer(raw, dtype=np.float32).copy()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def get_many(self, texts: List[str]) -> Dict[int, np.ndarray]:
+        """Busca los textos en ambos niveles. Devuelve {índice: embedding} de los aciertos"""
+        found: Dict[int, np.ndarray] = {}
+        pending: List[Tuple[int, str]] = []
+
+        for idx, text in enumerate(texts):
+            key = self.make_key(text)
+            embedding = self.local.get(key)
+            if embedding is not None:
+                found[idx] = embedding
+                self.hits_local += 1
+            else:
+                pending.append((idx, key))
+
+        client = self._get_redis() if pending else None
+        if client is not None:
+            try:
+                values = client.mget([key for _, key in pending])
+                still_pending = []
+                for (idx, key), raw in zip(pending, values):
+                    if raw:
+                        embedding = self._from_bytes(raw)
+                        self.local.set(key, embedding)
+                        found[idx] = embedding
+                        self.hits_shared += 1
+                    else:
+                        still_pending.append((idx, key))
+                pending = still_pending
+            except Exception as e:
+                self._mark_redis_down(e)
+
+        self.misses += len(pending)
+        return found
+
+    def set_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        """Guarda pares (texto, embedding) en ambos niveles"""
+        to_share = []
+        for text, embedding in items:
+            key = self.make_key(text)
+            vector = np.asarray(embedding, dtype=np.float32)
+            self.local.set(key, vector)
+            to_share.append((key, vector))
+
+        client = self._get_redis() if to_share else None
+        if client is None:
+            return
+
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, vector in to_share:
+                pipe.set(key, self._to_bytes(vector), ex=self.ttl_seconds)
+            pipe.execute()
+        except Exception as e:
+            self._mark_redis_down(e)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self.get_many([text]).get(0)
+
+    def set(self, text: str, embedding: np.ndarray):
+        self.set_many([(text, embedding)])
+
+    def clear_local(self):
+        self.local.clear()
+
+    def clear_shared(self) -> int:
+        """Elimina del almacén compartido las entradas de este modelo"""
+        client = self._get_redis()
+        if client is None:
+            return 0
+
+        deleted = 0
+        try:
+            batch = []
+            for key in client.scan_iter(match=f"{self.prefix}:{self.model_name}:*", count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    deleted += client.delete(*batch)
+                    batch = []
+            if batch:
+                deleted += client.delete(*batch)
+        except Exception as e:
+            self._mark_redis_down(e)
+        return deleted
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'cached_embeddings': len(self.local),
+            'memory_usage_mb': self.local.nbytes / 1024 / 1024,
+            'max_memory_mb': self.local.max_bytes / 1024 / 1024,
+            'shared_enabled': self._get_redis() is not None,
+            'hits_local': self.hits_local,
+            'hits_shared': self.hits_shared,
+            'misses': self.misses,
+        }
@@ -1,7 +1,7 @@
 import ollama
 import numpy as np
 from langdetect import detect
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 import time
 import logging
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -11,6 +11,7 @@ from datetime import timedelta
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.conf import settings
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 ollama_server = os.environ.get('ollama_server', 'http://host.docker.internal:11434')
@@ -33,7 +34,7 @@ class OllamaEmbedder:
         self.max_retries = max_retries
 
         try:
-            info = self.client.embeddings(model=self.model_name, prompt="ping")
+            info = self.client.embed(model=self.model_name, input="ping")
             logger.info("✅ Ollama GPU disponible (conectado correctamente).")
             self.gpu_enabled = True
         except Exception as e:
@@ -48,24 +49,20 @@ class OllamaEmbedder:
             separators=["\n\n", "\n", ". ", "! ", "? ", " ", ""]
         )
 
-        # Cache para embeddings repetidos
-        self._embedding_cache = {}
-
-        # Gestión de cache automática
-        self.last_cleanup = timezone.now()
-        self.cleanup_interval = timedelta(hours=2)
-        self.max_cache_size_mb = 50
+        # Cache de embeddings: LRU local acotado por bytes + almacén compartido (Redis)
+        self.max_cache_size_mb = getattr(settings, 'EMBEDDING_CACHE_MAX_MB', 50)
+        self.cache = EmbeddingCache(
+            model_name=self.model_name,
+            max_local_mb=self.max_cache_size_mb,
+            redis_url=getattr(settings, 'EMBEDDING_CACHE_REDIS_URL', None),
+            ttl_seconds=getattr(settings, 'EMBEDDING_CACHE_TTL', 30 * 24 * 3600),
+        )
 
     def _estimate_tokens(self, text: str) -> int:
         """Estima el número de tokens en un texto"""
         # Estimación aproximada: 1 token ≈ 4 caracteres en español
         return len(text) // 4
 
-    def _get_text_hash(self, text: str) -> str:
-        """Genera hash del texto para cache"""
-        import hashlib
-        return hashlib.md5(text.encode()).hexdigest()
-
     def detect_language(self, text: str) -> str:
         """Detecta idioma del texto con mejor manejo de errores"""
         try:
@@ -227,7 +224,43 @@ class OllamaEmbedder:
     #     return all_embeddings
 
     def embed_texts_batch(self, texts: List[str], show_progress: bool = True) -> List[np.ndarray]:
-        """Embeddings con ajuste dinámico y paralelismo"""
+        """Embeddings con cache compartido, ajuste dinámico y paralelismo"""
+        if not texts:
+            return []
+
+        t0 = time.time()
+
+        # 1. Buscar en cache (local y compartido)
+        cached = self.cache.get_many(texts)
+
+        # 2. Solo los textos faltantes (sin repetir) van a Ollama
+        missing: List[str] = []
+        seen = set()
+        for idx, text in enumerate(texts):
+            if idx not in cached and text not in seen:
+                seen.add(text)
+                missing.append(text)
+
+        computed = dict(zip(missing, self._embed_uncached(missing)))
+
+        # 3. Guardar en cache solo los embeddings válidos (no los vectores cero de fallback)
+        self.cache.set_many(
+            (text, emb) for text, emb in computed.items() if self._is_valid_embedding(emb)
+        )
+
+        all_embeddings = [
+            cached[idx] if idx in cached else computed[text]
+            for idx, text in enumerate(texts)
+        ]
+
+        dt = max(time.time() - t0, 1e-6)
+        logger.info(f"📈 {len(all_embeddings)} embeddings en {dt:.2f}s "
+                    f"({len(cached)} desde cache, {len(missing)} generados, "
+                    f"≈ {len(all_embeddings)/dt:.1f} textos/seg)")
+        return all_embeddings
+
+    def _embed_uncached(self, texts: List[str]) -> List[np.ndarray]:
+        """Genera embeddings en Ollama por lotes paralelos, conservando el orden"""
         if not texts:
             return []
 
@@ -235,39 +268,88 @@ class OllamaEmbedder:
         dynamic_batch = min(self.batch_size * (2 if self.gpu_enabled else 1), 20)
         total_batches = (len(texts) + dynamic_batch - 1) // dynamic_batch
 
-        all_embeddings = []
-        t0 = time.time()
-
-        def process_text(text: str) -> np.ndarray:
-            text_hash = self._get_text_hash(text)
-            if text_hash in self._embedding_cache:
-                return self._embedding_cache[text_hash]
-            emb = self._embed_with_retry(text)
-            self._embedding_cache[text_hash] = emb
-            return emb
+        # Los resultados se guardan por número de lote para conservar el orden
+        # de los textos aunque los lotes terminen en otro orden
+        results: Dict[int, List[np.ndarray]] = {}
 
-        # Paralelizar por lotes pequeños
+        # Paralelizar por lotes: cada lote es UNA sola petición a /api/embed
         with ThreadPoolExecutor(max_workers=min(8, total_batches)) as executor:
-            futures = []
+            futures = {}
             for i in range(0, len(texts), dynamic_batch):
                 batch = texts[i:i + dynamic_batch]
-                futures.append(executor.submit(self._process_batch, batch, i // dynamic_batch + 1, total_batches))
+                batch_num = i // dynamic_batch + 1
+                future = executor.submit(self._process_batch, batch, batch_num, total_batches)
+                futures[future] = batch_num
 
             for future in as_completed(futures):
-                batch_embeddings = future.result()
-                all_embeddings.extend(batch_embeddings)
+                results[futures[future]] = future.result()
 
-        dt = time.time() - t0
-        logger.info(f"📈 {len(all_embeddings)} embeddings generados en {dt:.2f}s "
-                    f"(≈ {len(all_embeddings)/dt:.1f} textos/seg)")
+        all_embeddings = []
+        for batch_num in sorted(results):
+            all_embeddings.extend(results[batch_num])
         return all_embeddings
     
     def _process_batch(self, batch: List[str], batch_num: int, total_batches: int):
         logger.info(f"🧵 Lote {batch_num}/{total_batches}: procesando {len(batch)} textos...")
-        embeddings = []
-        for text in batch:
-            emb = self._embed_with_retry(text)
-            embeddings.append(emb)
+        return self._embed_batch_with_retry(batch)
+
+    def _truncate_text(self, text: str) -> str:
+        """Recorta textos que exceden el límite conservador del modelo"""
+        if len(text) > 30000:
+            logger.warning(f"Texto muy largo ({len(text)} chars), truncando a 30k")
+            return text[:30000]
+        return text
+
+    def _is_valid_embedding(self, embedding: np.ndarray) -> bool:
+        return embedding.size > 0 and not np.all(embedding == 0)
+
+    def _normalize(self, vector) -> np.ndarray:
+        """
+        Norma L2 = 1. /api/embed ya normaliza (el antiguo /api/embeddings no);
+        se fuerza aquí para que consultas y chunks se comparen en la misma escala.
+        Los vectores guardados antes del cambio se normalizan en la migración 0017.
+        """
+        embedding = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _embed_batch_with_retry(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Genera los embeddings de un lote completo con una sola llamada a /api/embed.
+
+        Si la petición del lote falla, o alguno de los vectores devueltos es
+        inválido, solo esos textos se reintentan de forma individual con
+        `_embed_with_retry`; el resto del lote se conserva.
+        """
+        if not texts:
+            return []
+
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+
+        try:
+            response = self.client.embed(
+                model=self.model_name,
+                input=[self._truncate_text(text) for text in texts]
+            )
+            vectors = response['embeddings']
+
+            if len(vectors) != len(texts):
+                raise ValueError(f"Se esperaban {len(texts)} embeddings y se recibieron {len(vectors)}")
+
+            for idx, vector in enumerate(vectors):
+                embedding = self._normalize(vector)
+                if self._is_valid_embedding(embedding):
+                    embeddings[idx] = embedding
+
+        except Exception as e:
+            logger.warning(f"Falló la petición por lote ({len(texts)} textos), reintentando por texto: {e}")
+
+        failed = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if failed:
+            logger.warning(f"Reintentando individualmente {len(failed)}/{len(texts)} textos del lote")
+            for idx in failed:
+                embeddings[idx] = self._embed_with_retry(texts[idx])
+
         return embeddings
 
     def _embed_with_retry(self, text: str) -> np.ndarray:
@@ -276,19 +358,17 @@ class OllamaEmbedder:
         for attempt in range(self.max_retries):
             try:
                 # Verificar longitud del texto
-                if len(text) > 30000:  # Límite conservador
-                    logger.warning(f"Texto muy largo ({len(text)} chars), truncando a 30k")
-                    text = text[:30000]
+                text = self._truncate_text(text)
 
-                response = self.client.embeddings(
+                response = self.client.embed(
                     model=self.model_name,
-                    prompt=text
+                    input=text
                 )
 
-                embedding = np.array(response['embedding'])
+                embedding = self._normalize(response['embeddings'][0])
 
                 # Validar embedding
-                if embedding.size == 0 or np.all(embedding == 0):
+                if not self._is_valid_embedding(embedding):
                     raise ValueError("Embedding vacío o inválido")
 
                 return embedding
@@ -309,8 +389,17 @@ class OllamaEmbedder:
     def embed_query(self, query: str) -> np.ndarray:
         """Genera embedding para una consulta de búsqueda"""
         # Para queries, usar directamente sin división en chunks
+        cached = self.cache.get(query)
+        if cached is not None:
+            return cached
+
         embedding = self._embed_with_retry(query)
-        return embedding if embedding is not None else np.zeros(768)
+        if embedding is None:
+            return np.zeros(768)
+
+        if self._is_valid_embedding(embedding):
+            self.cache.set(query, embedding)
+        return embedding
 
     def embed_document_smart(self, text: str, filename: str = "documento") -> Tuple[
         List[str], List[np.ndarray], Dict[str, Any]]:
@@ -353,41 +442,37 @@ class OllamaEmbedder:
         return chunks, embeddings, metadata
 
     def should_cleanup_cache(self) -> bool:
-        """Determina si es necesario limpiar el cache"""
-        # Por tiempo
-        time_based = timezone.now() - self.last_cleanup > self.cleanup_interval
-
-        # Por tamaño
+        """Determina si el nivel local del cache excede su límite de memoria"""
         cache_stats = self.get_cache_stats()
-        size_based = cache_stats['memory_usage_mb'] > self.max_cache_size_mb
-
-        return time_based or size_based
+        return cache_stats['memory_usage_mb'] > self.max_cache_size_mb
 
     def cleanup_cache(self) -> bool:
-        """Limpia el cache de embeddings si es necesario"""
+        """
+        Limpia el nivel local del cache solo si excede su límite.
+        El almacén compartido no se toca: sus entradas expiran por TTL.
+        """
         try:
             if self.should_cleanup_cache():
                 cache_stats_before = self.get_cache_stats()
-                self.clear_cache()
+                self.cache.clear_local()
                 print(f"[INFO] Cache limpiado. Antes: {cache_stats_before}")
-                self.last_cleanup = timezone.now()
                 return True
             return False
         except Exception as e:
             print(f"[ERROR] Error limpiando cache: {str(e)}")
             return False
 
-    def clear_cache(self):
-        """Limpia el cache de embeddings"""
-        self._embedding_cache.clear()
-        logger.info("Cache de embeddings limpiado")
+    def clear_cache(self, shared: bool = False):
+        """Limpia el cache local de embeddings y, opcionalmente, el compartido"""
+        self.cache.clear_local()
+        logger.info("Cache local de embeddings limpiado")
+        if shared:
+            deleted = self.cache.clear_shared()
+            logger.info(f"Cache compartido de embeddings limpiado ({deleted} entradas)")
 
-    def get_cache_stats(self) -> Dict[str, int]:
+    def get_cache_stats(self) -> Dict[str, Any]:
         """Retorna estadísticas del cache"""
-        return {
-            'cached_embeddings': len(self._embedding_cache),
-            'memory_usage_mb': sum(emb.nbytes for emb in self._embedding_cache.values()) / 1024 / 1024
-        }
+        return self.cache.stats()
 
 
 # Instancia global mejorada
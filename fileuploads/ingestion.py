@@ -0,0 +1,317 @@
+"""
+Pipeline de ingesta asíncrona de archivos.
+
+Cada etapa corre como tarea de Celery (ver tasks.py):
+
+    1. extracción + chunking  -> los chunks se escriben en streaming a un spool JSONL
+    2. embeddings + guardado  -> el spool se procesa en ventanas de INGEST_WINDOW_SIZE
+    3. cierre                 -> marca el archivo como procesado y limpia temporales
+
+El progreso (chunks_done / chunks_total) y el estado se guardan en `Files`
+para que el frontend pueda consultarlos sin bloquear el worker web.
+"""
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import zipfile
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+from .embeddings_service import embedder
+from .models import Context, DocumentEmbedding, Files, JsonKeyCatalog
+
+logger = logging.getLogger(__name__)
+
+INGEST_WINDOW_SIZE = getattr(settings, "INGEST_WINDOW_SIZE", 500)
+UPLOADS_DIR = "uploads/proyectos"
+SPOOL_DIR = "uploads/spool"
+SUPPORTED_EXTENSIONS = ["json", "csv", "pdf", "docx", "txt"]
+
+
+def _json_default(value):
+    """ijson entrega los números como Decimal; se convierten a int/float nativos"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def get_storage() -> FileSystemStorage:
+    return FileSystemStorage(location=settings.MEDIA_ROOT)
+
+
+def spool_path(file_id: int) -> str:
+    return os.path.join(settings.MEDIA_ROOT, SPOOL_DIR, f"{file_id}.jsonl")
+
+
+def save_upload(uploaded_file, workspace) -> str:
+    """Guarda el archivo subido en MEDIA_ROOT y devuelve la ruta relativa real"""
+    uploaded_file.seek(0)
+    name = os.path.join(UPLOADS_DIR, str(workspace.id), uploaded_file.name)
+    return get_storage().save(name, uploaded_file)
+
+
+def enqueue_file_ingestion(file_id: int):
+    """
+    Encola la cadena extracción -> embeddings/guardado -> cierre.
+    Se dispara al confirmar la transacción para que el worker vea el registro.
+    """
+    from celery import chain
+    from .tasks import extract_file_task, embed_store_file_task, finalize_file_task
+
+    pipeline = chain(
+        extract_file_task.si(file_id),
+        embed_store_file_task.si(file_id),
+        finalize_file_task.si(file_id),
+    )
+    transaction.on_commit(lambda: pipeline.apply_async())
+
+
+def mark_file_error(file_id: int, message: str):
+    Files.objects.filter(id=file_id).update(status="error", error_message=message[:2000])
+
+
+def _extraction_name(file_record: Files, abs_path: str) -> str:
+    """
+    `extract_text_from_file` decide el formato por la extensión del nombre.
+    Los documentos del catálogo a veces traen un nombre sin extensión; en ese
+    caso se usa el nombre real del archivo en disco.
+    """
+    filename = file_record.filename or ""
+    if filename.lower().split(".")[-1] in SUPPORTED_EXTENSIONS:
+        return filename
+    return os.path.basename(abs_path)
+
+
+def extract_to_spool(file_record: Files) -> int:
+    """
+    Etapa 1: extrae el contenido y escribe cada chunk en el spool conforme el
+    parser lo genera. La memoria usada no depende del tamaño del archivo.
+    Devuelve el número de chunks generados.
+    """
+    from .utils import iter_file_chunks
+
+    abs_path = get_storage().path(file_record.path)
+    path = spool_path(file_record.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    total = 0
+    sample = []
+    with open(abs_path, "rb") as fh, open(path, "w", encoding="utf-8") as spool:
+        source = File(fh, name=_extraction_name(file_record, abs_path))
+        for text, original, metadata in iter_file_chunks(source):
+            if len(sample) < 3:
+                sample.append(text)
+            spool.write(json.dumps({
+                "text": text,
+                "json": original,
+                "meta": metadata,
+            }, ensure_ascii=False, default=_json_default) + "\n")
+            total += 1
+
+            if total % 10000 == 0:
+                Files.objects.filter(id=file_record.id).update(chunks_total=total)
+
+    if not total:
+        raise ValueError("Formato no soportado o archivo sin contenido extraíble")
+
+    try:
+        language = embedder.detect_language(" ".join(sample))
+    except Exception as e:
+        logger.warning(f"Error detectando idioma: {e}")
+        language = "unknown"
+
+    Files.objects.filter(id=file_record.id).update(
+        chunks_total=total,
+        chunks_done=0,
+        language=language,
+        status="embedding",
+    )
+    logger.info(f"🧩 {file_record.filename}: {total} chunks en spool (idioma={language})")
+    return total
+
+
+def _store_window(file_record: Files, window):
+    """Genera los embeddings de una ventana de chunks y la guarda con su progreso"""
+    texts = [item["text"] for _, item in window]
+    embeddings = embedder.embed_texts(texts)
+
+    # Contextos actuales del archivo (se consulta por ventana: el archivo puede
+    # agregarse a un contexto mientras se procesa; ver signals.py)
+    context_ids = list(
+        Context.files.through.objects.filter(files_id=file_record.id).values_list("context_id", flat=True)
+    )
+
+    objs = [
+        DocumentEmbedding(
+            file_id=file_record.id,
+            chunk_index=idx,
+            text=item["text"],
+            text_json=item.get("json"),
+            metadata_json=item.get("meta"),
+            embedding=embedding,
+            embedding_half=list(embedding),
+            language=file_record.language,
+            context_ids=context_ids,
+            metadata={
+                "source": file_record.filename,
+                "content_type": file_record.document_type,
+                "chunk_size": len(item["text"]),
+            },
+        )
+        for (idx, item), embedding in zip(window, embeddings)
+    ]
+
+    # Guardado y progreso en la misma transacción: un reintento reanuda
+    # exactamente después de la última ventana confirmada. search_vector lo
+    # llena el trigger en el mismo INSERT (migración 0018)
+    with transaction.atomic():
+        DocumentEmbedding.objects.bulk_create(objs, batch_size=500)
+        JsonKeyCatalog.add_metadata_rows(file_record.id, (item.get("meta") for _, item in window))
+        Files.objects.filter(id=file_record.id).update(chunks_done=window[-1][0] + 1)
+
+
+def embed_and_store_spool(file_record: Files, window_size: int = INGEST_WINDOW_SIZE) -> int:
+    """
+    Etapa 2: lee el spool por ventanas, genera embeddings y los inserta.
+    Reanuda desde `chunks_done` si la tarea se reintenta.
+    """
+    start = file_record.chunks_done
+    stored = 0
+    window = []
+
+    with open(spool_path(file_record.id), encoding="utf-8") as spool:
+        for idx, line in enumerate(spool):
+            if idx < start:
+                continue
+            window.append((idx, json.loads(line)))
+            if len(window) >= window_size:
+                _store_window(file_record, window)
+                stored += len(window)
+                window = []
+
+        if window:
+            _store_window(file_record, window)
+            stored += len(window)
+
+    logger.info(f"📈 {file_record.filename}: {stored} chunks almacenados")
+    return stored
+
+
+def finalize_file(file_record: Files):
+    """Etapa 3: marca el archivo como procesado y limpia spool y archivo original"""
+    # Reconciliar context_ids por si la membresía cambió durante la ingesta
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE fileuploads_documentembedding
+            SET context_ids = COALESCE((
+                SELECT array_agg(DISTINCT context_id ORDER BY context_id)
+                FROM fileuploads_context_files
+                WHERE files_id = %s
+            ), '{}')
+            WHERE file_id = %s
+            """,
+            [file_record.id, file_record.id],
+        )
+
+    Files.objects.filter(id=file_record.id).update(
+        status="done",
+        processed=True,
+        chunks_done=file_record.chunks_total,
+        error_message=None,
+    )
+
+    try:
+        os.remove(spool_path(file_record.id))
+    except FileNotFoundError:
+        pass
+
+    if not getattr(settings, "INGEST_KEEP_UPLOADS", False):
+        storage = get_storage()
+        if file_record.path and storage.exists(file_record.path):
+            storage.delete(file_record.path)
+
+
+def register_catalog_document(file_record, register, geonode_info):
+    """
+    Descarga un documento/dataset del catálogo de GeoNode y lo guarda en disco.
+    `file_record` es el registro `Files` que el request creó como "pending"
+    (así el estado se puede consultar aunque la descarga falle); recibe el
+    primer archivo y, si es un ZIP con varios, el resto se crea a partir de
+    él. `geonode_info` es la respuesta de `get_geonode_document_uuid_by_id`,
+    resuelta en el request (así el token del usuario no viaja al broker).
+    Devuelve la lista de registros, listos para encolar su ingesta.
+    """
+    id_document = register["id"]
+    file_name = register["nombre"]
+
+    url = geonode_info["url_download"]
+    if not url:
+        raise ValueError(f"El documento {id_document} no tiene URL de descarga")
+    logger.debug(f"Descargando documento {id_document} del catálogo: {url}")
+
+    storage = get_storage()
+    target_dir = os.path.join(UPLOADS_DIR, str(file_record.workspace_id), "catalogo", str(id_document))
+    created = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Descarga en streaming a disco para no cargar el archivo completo en memoria
+        download_path = os.path.join(tmpdir, "download")
+        with requests.get(url, stream=True, timeout=600) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            with open(download_path, "wb") as fh:
+                for block in response.iter_content(chunk_size=1024 * 1024):
+                    fh.write(block)
+
+        is_zip = zipfile.is_zipfile(download_path)
+        if is_zip:
+            extract_dir = os.path.join(tmpdir, "zip")
+            with zipfile.ZipFile(download_path) as zf:
+                zf.extractall(extract_dir)
+            local_files = [
+                os.path.join(root, name)
+                for root, _, names in os.walk(extract_dir)
+                for name in names
+            ]
+        else:
+            name = file_name
+            if "." not in os.path.basename(name):
+                name += mimetypes.guess_extension(content_type) or ""
+            local_path = os.path.join(tmpdir, os.path.basename(name))
+            shutil.move(download_path, local_path)
+            local_files = [local_path]
+        if not local_files:
+            raise ValueError(f"El documento {id_document} es un ZIP vacío")
+
+        for local_path in local_files:
+            with open(local_path, "rb") as fh:
+                saved_path = storage.save(
+                    os.path.join(target_dir, os.path.basename(local_path)), File(fh)
+                )
+
+            document_type, _ = mimetypes.guess_type(local_path)
+            record = file_record if not created else Files(
+                geonode_uuid=file_record.geonode_uuid,
+                geonode_id=file_record.geonode_id,
+                geonode_type=file_record.geonode_type,
+                geonode_category=file_record.geonode_category,
+                user_id=file_record.user_id,
+                workspace_id=file_record.workspace_id,
+                status="pending",
+            )
+            record.filename = file_name if is_zip else os.path.basename(local_path)
+            record.document_type = document_type or "application/octet-stream"
+            record.path = saved_path
+            record.save()
+            created.append(record)
+
+    return created
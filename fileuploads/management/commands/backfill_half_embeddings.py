@@ -0,0 +1,51 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Pobla DocumentEmbedding.embedding_half (halfvec) a partir de embedding en lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Filas actualizadas por lote')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        table = 'fileuploads_documentembedding'
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table} WHERE embedding_half IS NULL")
+            pending = cursor.fetchone()[0]
+        self.stdout.write(f'Filas sin embedding_half: {pending}')
+
+        # Cada lote es su propia transacción (autocommit) para no bloquear la
+        # tabla completa ni acumular un UPDATE gigante
+        done, last_id, started = 0, 0, perf_counter()
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    WITH batch AS (
+                        SELECT id FROM {table}
+                        WHERE id > %s AND embedding_half IS NULL
+                        ORDER BY id
+                        LIMIT %s
+                    )
+                    UPDATE {table} de
+                    SET embedding_half = de.embedding::halfvec(768)
+                    FROM batch
+                    WHERE de.id = batch.id
+                    RETURNING de.id
+                    """,
+                    [last_id, batch_size],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+
+            if not ids:
+                break
+            done += len(ids)
+            last_id = max(ids)
+            self.stdout.write(f'  {done}/{pending} filas ({perf_counter() - started:.1f}s)')
+
+        self.stdout.write(self.style.SUCCESS(f'embedding_half poblado en {done} filas'))
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from fileuploads.utils import CSV_CHUNK_SIZE, SIN_VALOR, csv_rows_to_texts, limpiar_valor
+
+
+def csv_rows_to_texts_iterrows(df):
+    """Conversión fila por fila original, referencia de tiempo y de salida para el benchmark"""
+    texts = []
+    df.fillna(SIN_VALOR, inplace=True)
+    for _, row in df.iterrows():
+        texto = "\n".join(
+            f"{col.replace('_', ' ').capitalize()}: {limpiar_valor(val)}"
+            for col, val in row.items()
+        )
+        if texto.strip():
+            texts.append(texto.strip())
+    return texts
+
+
+class Command(BaseCommand):
+    help = 'Compara la conversión CSV→texto vectorizada contra la versión con iterrows()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='CSV a usar; si se omite se genera uno sintético')
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Filas del CSV sintético')
+        parser.add_argument('--cols', type=int, default=12, help='Columnas del CSV sintético')
+        parser.add_argument(
+            '--legacy-rows',
+            type=int,
+            default=100_000,
+            help='Filas procesadas con iterrows() (el tiempo se extrapola al total); 0 = todas',
+        )
+
+    def _synthetic_csv(self, rows, cols):
+        rng = np.random.default_rng(42)
+        words = np.array(['Ciudad de México', 'Jalisco', '  Nuevo   León ', 'desconocido', '',
+                          'N/A', 'null', '12.5', '2024-01-01', 'Oaxaca de Juárez'])
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        block = 100_000
+        for start in range(0, rows, block):
+            n = min(block, rows - start)
+            df = pd.DataFrame({
+                f'columna_{c}': words[rng.integers(0, len(words), n)] for c in range(cols)
+            })
+            df.to_csv(handle, index=False, header=(start == 0))
+        handle.close()
+        return handle.name
+
+    def _run(self, path, converter, max_rows=None):
+        rows, texts, started = 0, [], perf_counter()
+        for df_chunk in pd.read_csv(path, dtype=str, chunksize=CSV_CHUNK_SIZE, low_memory=False):
+            if max_rows and rows >= max_rows:
+                break
+            if max_rows:
+                df_chunk = df_chunk.iloc[:max_rows - rows]
+            rows += len(df_chunk)
+            texts.extend(converter(df_chunk))
+        return rows, texts, perf_counter() - started
+
+    def handle(self, *args, **options):
+        path = options['file']
+        generated = False
+        if path:
+            if not os.path.exists(path):
+                raise CommandError(f'No existe el archivo {path}')
+        else:
+            self.stdout.write(f"Generando CSV sintético ({options['rows']} filas x {options['cols']} columnas)...")
+            path = self._synthetic_csv(options['rows'], options['cols'])
+            generated = True
+
+        try:
+            total_rows, fast_texts, fast_secs = self._run(path, csv_rows_to_texts)
+            self.stdout.write(f'Vectorizado: {total_rows} filas en {fast_secs:.2f}s')
+
+            legacy_limit = options['legacy_rows'] or None
+            legacy_rows, legacy_texts, legacy_secs = self._run(path, csv_rows_to_texts_iterrows, legacy_limit)
+            estimated = legacy_secs * total_rows / max(legacy_rows, 1)
+            self.stdout.write(
+                f'iterrows(): {legacy_rows} filas en {legacy_secs:.2f}s '
+                f'(estimado para {total_rows} filas: {estimated:.2f}s)'
+            )
+
+            if legacy_texts != fast_texts[:len(legacy_texts)]:
+                raise CommandError('La salida vectorizada no coincide con la de iterrows()')
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Salida idéntica en {legacy_rows} filas. Aceleración: {estimated / max(fast_secs, 1e-9):.1f}x'
+            ))
+        finally:
+            if generated:
+                os.remove(path)
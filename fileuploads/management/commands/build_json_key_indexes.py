@@ -0,0 +1,134 @@
+import hashlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from fileuploads.models import Files, JsonKeyCatalog
+
+TABLE = 'fileuploads_documentembedding'
+INDEX_PREFIX = 'docemb_jk_'
+
+
+def key_expression(key: str) -> str:
+    """
+    Expresión sobre text_json con la misma forma que exige BASE_SYSTEM_PROMPT_JSON
+    (`->` en niveles intermedios y `->>` en el último) para que el planner la
+    reconozca en el SQL generado: "documento.nombre" -> (text_json->'documento')->>'nombre'
+    """
+    parts = [part.replace("'", "''") for part in key.split(".")]
+    expression = "text_json"
+    for part in parts[:-1]:
+        expression = f"({expression}->'{part}')"
+    return f"({expression}->>'{parts[-1]}')"
+
+
+def index_name(key: str, method: str) -> str:
+    return f"{INDEX_PREFIX}{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}_{method}"
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea (CONCURRENTLY) índices de expresión sobre las llaves más frecuentes de text_json '
+        'en los archivos JSON grandes, a partir de JsonKeyCatalog'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=int,
+            action='append',
+            dest='files',
+            help='Archivo(s) a considerar (por defecto todos los JSON con al menos --min-rows chunks)',
+        )
+        parser.add_argument('--min-rows', type=int, default=10000, help='Tamaño mínimo del archivo (chunks)')
+        parser.add_argument('--keys', type=int, default=5, help='Llaves por archivo (las de más filas)')
+        parser.add_argument(
+            '--method',
+            choices=['trgm', 'btree'],
+            default='trgm',
+            help='trgm: GIN gin_trgm_ops para el operador %% (requiere pg_trgm); btree: igualdad y orden',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra el DDL')
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help=f'Elimina todos los índices {INDEX_PREFIX}* creados por este comando',
+        )
+
+    def _existing_indexes(self, cursor):
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname LIKE %s",
+            [TABLE, INDEX_PREFIX + '%'],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def _hot_keys(self, options):
+        files = Files.objects.filter(document_type='application/json', processed=True)
+        if options['files']:
+            files = files.filter(id__in=options['files'])
+        else:
+            files = files.filter(chunks_total__gte=options['min_rows'])
+
+        keys = {}
+        for file_id in files.values_list('id', flat=True):
+            rows = (
+                JsonKeyCatalog.objects.filter(file_id=file_id)
+                .values('key')
+                .annotate(rows=Sum('row_count'))
+                .order_by('-rows')
+            )
+            # Los valores dentro de arrays no admiten índice de expresión;
+            # esos filtros los cubre el GIN jsonb_path_ops (@>)
+            hot = [row['key'] for row in rows if 'array' not in row['key'].split('.')]
+            for key in hot[:options['keys']]:
+                keys.setdefault(key, []).append(file_id)
+        return keys
+
+    def handle(self, *args, **options):
+        if connection.in_atomic_block:
+            raise CommandError('CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción')
+
+        with connection.cursor() as cursor:
+            existing = self._existing_indexes(cursor)
+
+            if options['drop']:
+                for name in sorted(existing):
+                    self.stdout.write(f'Eliminando índice {name}...')
+                    if not options['dry_run']:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                self.stdout.write(self.style.SUCCESS(f'{len(existing)} índices eliminados'))
+                return
+
+            method = options['method']
+            if method == 'trgm':
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                if cursor.fetchone() is None:
+                    raise CommandError('La extensión pg_trgm no está instalada (use --method btree)')
+
+            keys = self._hot_keys(options)
+            if not keys:
+                self.stdout.write(self.style.WARNING('No hay archivos JSON que cumplan los criterios'))
+                return
+
+            created = 0
+            for key, file_ids in sorted(keys.items()):
+                name = index_name(key, method)
+                if name in existing:
+                    self.stdout.write(f'{name} ({key}) ya existe')
+                    continue
+
+                expression = key_expression(key)
+                using = f"gin ({expression} gin_trgm_ops)" if method == 'trgm' else f"btree ({expression})"
+                # Parcial: solo las filas que tienen la llave. El filtro del SQL
+                # generado (operador estricto sobre la expresión) implica el predicado
+                ddl = (
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {TABLE} "
+                    f"USING {using} WHERE {expression} IS NOT NULL"
+                )
+                self.stdout.write(f'{key} (archivos {file_ids}): {ddl}')
+                if not options['dry_run']:
+                    cursor.execute(ddl)
+                    created += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{created} índices creados'))
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from fileuploads.retrieval import VECTOR_INDEX_NAME, VECTOR_INDEX_IVFFLAT_NAME
+
+
+class Command(BaseCommand):
+    help = 'Construye o reconstruye (CONCURRENTLY) el índice ANN de DocumentEmbedding.embedding_half'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--method',
+            choices=['hnsw', 'ivfflat'],
+            default='hnsw',
+            help='Tipo de índice pgvector (hnsw por defecto)',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Elimina y vuelve a crear el índice aunque ya exista',
+        )
+        parser.add_argument('--m', type=int, default=16, help='HNSW: conexiones por nodo')
+        parser.add_argument('--ef-construction', type=int, default=64, help='HNSW: candidatos al construir')
+        parser.add_argument(
+            '--lists',
+            type=int,
+            default=None,
+            help='IVFFlat: número de listas (por defecto filas/1000, mínimo 10)',
+        )
+        parser.add_argument(
+            '--maintenance-work-mem',
+            default='1GB',
+            help='maintenance_work_mem para la sesión de construcción',
+        )
+
+    def _index_exists(self, cursor, name):
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [name])
+        return cursor.fetchone() is not None
+
+    def handle(self, *args, **options):
+        if connection.in_atomic_block:
+            raise CommandError('CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción')
+
+        method = options['method']
+        table = 'fileuploads_documentembedding'
+
+        with connection.cursor() as cursor:
+            cursor.execute("SET maintenance_work_mem = %s", [options['maintenance_work_mem']])
+
+            if method == 'hnsw':
+                name = VECTOR_INDEX_NAME
+                ddl = (
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+                    f"USING hnsw (embedding_half halfvec_l2_ops) "
+                    f"WITH (m = {int(options['m'])}, ef_construction = {int(options['ef_construction'])})"
+                )
+            else:
+                name = VECTOR_INDEX_IVFFLAT_NAME
+                lists = options['lists']
+                if not lists:
+                    cursor.execute(f"SELECT count(*) FROM {table}")
+                    lists = max(10, cursor.fetchone()[0] // 1000)
+                ddl = (
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+                    f"USING ivfflat (embedding_half halfvec_l2_ops) WITH (lists = {int(lists)})"
+                )
+
+            if self._index_exists(cursor, name):
+                if not options['rebuild']:
+                    self.stdout.write(self.style.WARNING(f'El índice {name} ya existe (use --rebuild para recrearlo)'))
+                    return
+                self.stdout.write(f'Eliminando índice {name}...')
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+            self.stdout.write(f'Construyendo índice {name} ({method})...')
+            cursor.execute(ddl)
+
+        self.stdout.write(self.style.SUCCESS(f'Índice {name} listo'))
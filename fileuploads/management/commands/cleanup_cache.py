@@ -16,6 +16,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Solo muestra estadísticas del cache',
         )
+        parser.add_argument(
+            '--shared',
+            action='store_true',
+            help='Con --force, limpia también el cache compartido (Redis) del modelo',
+        )
 
     def handle(self, *args, **options):
         cache_stats = embedder.get_cache_stats()
@@ -27,9 +32,12 @@ class Command(BaseCommand):
             return
 
         if options['force']:
-            embedder.clear_cache()
+            embedder.clear_cache(shared=options['shared'])
             self.stdout.write(
-                self.style.SUCCESS('Cache limpiado forzosamente')
+                self.style.SUCCESS(
+                    'Cache local y compartido limpiado forzosamente' if options['shared']
+                    else 'Cache local limpiado forzosamente'
+                )
             )
         else:
             if embedder.should_cleanup_cache():
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0008_documentembedding_metadata_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='files',
+            name='chunks_done',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='files',
+            name='chunks_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='files',
+            name='error_message',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='files',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pendiente'), ('extracting', 'Extrayendo'), ('embedding', 'Generando embeddings'), ('done', 'Listo'), ('error', 'Error')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='files',
+            name='task_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='files',
+            index=models.Index(fields=['status'], name='fileuploads_status_94536d_idx'),
+        ),
+        # Los archivos ya procesados de forma síncrona quedan como terminados
+        migrations.RunSQL(
+            sql="""
+                UPDATE fileuploads_files f
+                SET status = 'done',
+                    chunks_total = c.total,
+                    chunks_done = c.total
+                FROM (
+                    SELECT fl.id, COUNT(de.id) AS total
+                    FROM fileuploads_files fl
+                    LEFT JOIN fileuploads_documentembedding de ON de.file_id = fl.id
+                    WHERE fl.processed
+                    GROUP BY fl.id
+                ) c
+                WHERE f.id = c.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+import pgvector.django
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('fileuploads', '0009_files_ingestion_status'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='documentembedding',
+            index=pgvector.django.HnswIndex(ef_construction=64, fields=['embedding'], m=16, name='docemb_embedding_hnsw', opclasses=['vector_l2_ops']),
+        ),
+    ]
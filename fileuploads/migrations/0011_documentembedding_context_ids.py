@@ -0,0 +1,41 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:48
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('fileuploads', '0010_documentembedding_hnsw_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentembedding',
+            name='context_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None),
+        ),
+        # Poblar context_ids con la membresía actual de cada archivo
+        migrations.RunSQL(
+            sql="""
+                UPDATE fileuploads_documentembedding de
+                SET context_ids = cf.context_ids
+                FROM (
+                    SELECT files_id, array_agg(DISTINCT context_id ORDER BY context_id) AS context_ids
+                    FROM fileuploads_context_files
+                    GROUP BY files_id
+                ) cf
+                WHERE cf.files_id = de.file_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='documentembedding',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['context_ids'], name='docemb_context_ids_gin'),
+        ),
+    ]
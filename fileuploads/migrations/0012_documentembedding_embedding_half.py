@@ -0,0 +1,40 @@
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations
+import pgvector.django
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('fileuploads', '0011_documentembedding_context_ids'),
+    ]
+
+    operations = [
+        # halfvec requiere pgvector >= 0.7 (la extensión se actualiza en
+        # initdb/init-vector-extension.sql, con permisos de superusuario)
+        migrations.AddField(
+            model_name='documentembedding',
+            name='embedding_half',
+            field=pgvector.django.HalfVectorField(blank=True, dimensions=768, null=True),
+        ),
+        # Poblar las filas existentes antes de construir el índice; si no, la
+        # primera pasada sobre embedding_half las ignoraría
+        migrations.RunSQL(
+            sql="""
+                UPDATE fileuploads_documentembedding
+                SET embedding_half = embedding::halfvec(768)
+                WHERE embedding_half IS NULL;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='documentembedding',
+            index=pgvector.django.HnswIndex(ef_construction=64, fields=['embedding_half'], m=16, name='docemb_embedding_half_hnsw', opclasses=['halfvec_l2_ops']),
+        ),
+        RemoveIndexConcurrently(
+            model_name='documentembedding',
+            name='docemb_embedding_hnsw',
+        ),
+    ]
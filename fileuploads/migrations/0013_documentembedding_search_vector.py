@@ -0,0 +1,42 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('fileuploads', '0012_documentembedding_embedding_half'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentembedding',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        # Poblar el tsvector con el diccionario del idioma de cada chunk
+        # (mismo mapeo que retrieval.TEXT_SEARCH_CONFIGS)
+        migrations.RunSQL(
+            sql="""
+                UPDATE fileuploads_documentembedding
+                SET search_vector = to_tsvector(
+                    CASE language
+                        WHEN 'es' THEN 'spanish'
+                        WHEN 'en' THEN 'english'
+                        WHEN 'fr' THEN 'french'
+                        ELSE 'simple'
+                    END::regconfig,
+                    coalesce(text, '')
+                );
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='documentembedding',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='docemb_search_vector_gin'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0013_documentembedding_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JsonKeyCatalog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField()),
+                ('json_type', models.CharField(max_length=20)),
+                ('row_count', models.BigIntegerField(default=0)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='json_keys', to='fileuploads.files')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='jsonkeycatalog',
+            constraint=models.UniqueConstraint(fields=('file', 'key', 'json_type'), name='jsonkeycatalog_file_key_type'),
+        ),
+        # Catálogo de los archivos ya ingeridos (misma agregación que la consulta anterior)
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO fileuploads_jsonkeycatalog (file_id, key, json_type, row_count)
+                SELECT f.file_id, j.key, jsonb_typeof(j.value), COUNT(*)
+                FROM fileuploads_documentembedding f,
+                     LATERAL jsonb_each(f.metadata_json::jsonb) AS j(key, value)
+                WHERE jsonb_typeof(f.metadata_json::jsonb) = 'object'
+                GROUP BY f.file_id, j.key, jsonb_typeof(j.value);
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
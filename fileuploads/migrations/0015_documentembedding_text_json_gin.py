@@ -0,0 +1,21 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('fileuploads', '0014_jsonkeycatalog'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='documentembedding',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['text_json'], name='docemb_text_json_gin', opclasses=['jsonb_path_ops'],
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0015_documentembedding_text_json_gin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationEntity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_key', models.CharField(max_length=40)),
+                ('position', models.IntegerField()),
+                ('name', models.TextField()),
+                ('type', models.CharField(blank=True, max_length=50, null=True)),
+                ('estado', models.TextField(blank=True, null=True)),
+                ('pais', models.TextField(blank=True, null=True)),
+                ('context', models.TextField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_entities', to='fileuploads.documentembedding')),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_entities', to='fileuploads.files')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LocationExtraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_key', models.CharField(max_length=40)),
+                ('raw_output', models.JSONField(blank=True, null=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_extractions', to='fileuploads.documentembedding')),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_extractions', to='fileuploads.files')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['file', 'model', 'prompt_key'], name='locextraction_file_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='locationextraction',
+            constraint=models.UniqueConstraint(fields=('chunk', 'model', 'prompt_key'), name='locextraction_chunk_model_prompt'),
+        ),
+        migrations.AddIndex(
+            model_name='locationentity',
+            index=models.Index(fields=['file', 'model', 'prompt_key'], name='locentity_file_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0016_locationextraction_locationentity'),
+    ]
+
+    operations = [
+        # Los vectores de /api/embeddings no venían normalizados; los de /api/embed
+        # sí. Se normalizan los guardados (l2_normalize, pgvector >= 0.7) para que
+        # la distancia L2/coseno ordene igual los chunks viejos y los nuevos.
+        migrations.RunSQL(
+            sql="""
+                UPDATE fileuploads_documentembedding
+                SET embedding = l2_normalize(embedding),
+                    embedding_half = l2_normalize(embedding)::halfvec(768)
+                WHERE embedding IS NOT NULL;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
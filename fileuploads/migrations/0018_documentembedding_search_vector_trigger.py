@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0017_normalize_embeddings'),
+    ]
+
+    operations = [
+        # El tsvector se calcula en el mismo INSERT (antes era un UPDATE aparte
+        # que reescribía cada chunk y sus índices HNSW/GIN). Mismo mapeo de
+        # idiomas que retrieval.TEXT_SEARCH_CONFIGS; solo se recalcula si cambia
+        # `text` o `language`, así las demás actualizaciones siguen siendo HOT.
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION fileuploads_docemb_search_vector() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := to_tsvector(
+                        CASE NEW.language
+                            WHEN 'es' THEN 'spanish'
+                            WHEN 'en' THEN 'english'
+                            WHEN 'fr' THEN 'french'
+                            ELSE 'simple'
+                        END::regconfig,
+                        coalesce(NEW.text, '')
+                    );
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER docemb_search_vector_tg
+                    BEFORE INSERT OR UPDATE OF text, language ON fileuploads_documentembedding
+                    FOR EACH ROW EXECUTE FUNCTION fileuploads_docemb_search_vector();
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS docemb_search_vector_tg ON fileuploads_documentembedding;
+                DROP FUNCTION IF EXISTS fileuploads_docemb_search_vector();
+            """,
+        ),
+    ]
@@ -8,9 +8,8 @@ from typing import Any, Dict, List, Optional, Tuple
 import ollama
 import requests
 from PyPDF2 import PdfReader
-from pgvector.django import L2Distance
 
-from .embeddings_service import embedder
+from .retrieval import retrieve_chunks
 from .models import DocumentEmbedding, Files
 from django.conf import settings
 
@@ -314,19 +313,14 @@ class HybridMinimumMetadataExtractor:
 
     def _retrieve_context_chunks(self, file_record: Files, limit: int = 8) -> List[Tuple[str, float]]:
         base_query = "contenido principal documento metadatos información"
-        query_embedding = embedder.embed_query(base_query)
 
-        if query_embedding is None:
-            logger.info("[Metadata] Embedder sin respuesta para consulta base")
-            return []
-
-        embeddings_qs = (
-            DocumentEmbedding.objects.filter(file=file_record)
-            .annotate(distance=L2Distance("embedding", query_embedding.tolist()))
-            .order_by("distance")[:limit]
+        embeddings_list = retrieve_chunks(
+            DocumentEmbedding.objects.filter(file=file_record),
+            base_query,
+            top_k=limit,
+            log_prefix=f"[Metadata] file_id={getattr(file_record, 'pk', None)}",
         )
 
-        embeddings_list = list(embeddings_qs)
         logger.info(
             "[Metadata] Chunks recuperados para file_id=%s: %s/%s",
             getattr(file_record, "pk", None),
@@ -334,7 +328,7 @@ class HybridMinimumMetadataExtractor:
             limit,
         )
 
-        return [(item.text, float(item.distance or 0)) for item in embeddings_list]
+        return [(chunk.text, chunk.distance) for chunk in embeddings_list]
 
     def _build_prompt(self, field: str, context: str, question: str) -> str:
         if field == "description":
@@ -1,6 +1,9 @@
 from django.db import connection
 from django.db import models
-from pgvector.django import VectorField
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from pgvector.django import VectorField, HalfVectorField, HnswIndex
 import uuid
 import os
 
@@ -49,6 +52,14 @@ class Context(models.Model):
         ]
 
 class Files(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Pendiente"),
+        ("extracting", "Extrayendo"),
+        ("embedding", "Generando embeddings"),
+        ("done", "Listo"),
+        ("error", "Error"),
+    ]
+
     workspace        = models.ForeignKey(Workspace, on_delete=models.CASCADE, null=True)
     geonode_id       = models.IntegerField(null=True, blank=True)
     geonode_uuid     = models.UUIDField(null=True, blank=True)
@@ -61,11 +72,19 @@ class Files(models.Model):
     processed        = models.BooleanField(default=False)
     language         = models.CharField(max_length=10, default='es')
     created_date     = models.DateTimeField(auto_now_add=True)
+
+    # Estado de la ingesta asíncrona (extracción -> embeddings -> guardado)
+    status           = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    chunks_total     = models.IntegerField(default=0)
+    chunks_done      = models.IntegerField(default=0)
+    task_id          = models.CharField(max_length=255, null=True, blank=True)
+    error_message    = models.TextField(null=True, blank=True)
     
     class Meta:
         indexes = [
             models.Index(fields=['workspace']),
             models.Index(fields=['language']),
+            models.Index(fields=['status']),
         ]
 
 class DocumentEmbedding(models.Model):
@@ -75,29 +94,64 @@ class DocumentEmbedding(models.Model):
     text_json       = models.JSONField(default=dict, blank=True, null=True)
     metadata_json   = models.JSONField(default=dict, blank=True, null=True)
     embedding       = VectorField(dimensions=768)  # nomic-embed-text-v2 usa 768 dimensiones
+    # Copia en media precisión (2 bytes por dimensión) para la primera pasada
+    # de la búsqueda; el reordenamiento final usa `embedding` (ver retrieval.py)
+    embedding_half  = HalfVectorField(dimensions=768, null=True, blank=True)
     language        = models.CharField(max_length=10, default='es')
     metadata        = models.JSONField(default=dict)
     created_date    = models.DateTimeField(auto_now_add=True)
+    # Copia desnormalizada de file.contexts (ver signals.py) para filtrar
+    # la búsqueda vectorial por contexto sin joins
+    context_ids     = ArrayField(models.BigIntegerField(), default=list, blank=True)
+    # tsvector de `text` con el diccionario del idioma del archivo (búsqueda híbrida)
+    search_vector   = SearchVectorField(null=True, blank=True)
     
     #indices
     class Meta:
         indexes = [
             models.Index(fields=['file']),
             models.Index(fields=['language']),
+            GinIndex(fields=['context_ids'], name='docemb_context_ids_gin'),
+            GinIndex(fields=['search_vector'], name='docemb_search_vector_gin'),
+            # Contención (@>) en el SQL que genera el LLM sobre text_json
+            GinIndex(fields=['text_json'], name='docemb_text_json_gin', opclasses=['jsonb_path_ops']),
+            # Índice ANN sobre la columna compacta (ver build_vector_index)
+            HnswIndex(
+                name='docemb_embedding_half_hnsw',
+                fields=['embedding_half'],
+                m=16,
+                ef_construction=64,
+                opclasses=['halfvec_l2_ops'],
+            ),
         ]
 
+    def save(self, *args, **kwargs):
+        # bulk_create no pasa por aquí: la ingesta asigna embedding_half explícitamente
+        if self.embedding_half is None and self.embedding is not None:
+            self.embedding_half = list(self.embedding)
+        # Chunks creados con .create() después de que el archivo entró a un
+        # contexto (p. ej. los comandos de demo): los signals de m2m ya corrieron
+        if not self.context_ids and self.file_id:
+            self.context_ids = list(Context.objects.filter(files=self.file_id).values_list('id', flat=True))
+        # search_vector lo calcula el trigger docemb_search_vector_tg (migración 0018)
+        super().save(*args, **kwargs)
+
     @staticmethod
     def get_json_keys_with_types(list_files_json_ids):
+        """
+        Llaves de metadata_json de los archivos con su tipo y número de filas.
+        Se agrega sobre JsonKeyCatalog (unas filas por archivo) en lugar de
+        recorrer todos los chunks con jsonb_each.
+        """
         query = """
-            SELECT 
-                j.key,
-                jsonb_typeof(j.value) AS value_type,
-                COUNT(*) AS count_rows
-            FROM fileuploads_documentembedding f,
-                 LATERAL jsonb_each(f.metadata_json::jsonb) AS j(key, value)
-            where file_id = ANY(%s)
-            GROUP BY j.key, jsonb_typeof(j.value)
-            ORDER BY j.key;
+            SELECT
+                key,
+                json_type AS value_type,
+                SUM(row_count) AS count_rows
+            FROM fileuploads_jsonkeycatalog
+            WHERE file_id = ANY(%s)
+            GROUP BY key, json_type
+            ORDER BY key;
         """
         if not list_files_json_ids:
             return []
@@ -105,10 +159,105 @@ class DocumentEmbedding(models.Model):
         with connection.cursor() as cursor:
             cursor.execute(query, [list_files_json_ids])
             return [
-                {"key": k, "type": t, "count": c}
+                {"key": k, "type": t, "count": int(c)}
                 for k, t, c in cursor.fetchall()
             ]
 
+class JsonKeyCatalog(models.Model):
+    """
+    Catálogo por archivo de las llaves de metadata_json (llave, tipo JSON,
+    número de filas). Se actualiza en la ingesta por cada ventana guardada.
+    """
+    file            = models.ForeignKey(Files, on_delete=models.CASCADE, related_name='json_keys')
+    key             = models.TextField()
+    json_type       = models.CharField(max_length=20)
+    row_count       = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'key', 'json_type'], name='jsonkeycatalog_file_key_type'),
+        ]
+
+    @staticmethod
+    def jsonb_typeof(value) -> str:
+        """Mismo resultado que jsonb_typeof() de Postgres para un valor de Python"""
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "boolean"
+        if isinstance(value, (int, float)):
+            return "number"
+        if isinstance(value, str):
+            return "string"
+        if isinstance(value, (list, tuple)):
+            return "array"
+        return "object"
+
+    @classmethod
+    def add_metadata_rows(cls, file_id, metadata_rows):
+        """Suma al catálogo del archivo las llaves de una lista de metadata_json"""
+        counts = {}
+        for metadata in metadata_rows:
+            if not isinstance(metadata, dict):
+                continue
+            for key, value in metadata.items():
+                type_key = (key, cls.jsonb_typeof(value))
+                counts[type_key] = counts.get(type_key, 0) + 1
+        if not counts:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO fileuploads_jsonkeycatalog (file_id, key, json_type, row_count)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (file_id, key, json_type)
+                DO UPDATE SET row_count = fileuploads_jsonkeycatalog.row_count + EXCLUDED.row_count
+                """,
+                [(file_id, key, json_type, count) for (key, json_type), count in counts.items()],
+            )
+
+class LocationExtraction(models.Model):
+    """
+    Marca de que un chunk ya pasó por un extractor de lugares (modelo + prompt),
+    aunque no se haya encontrado ninguno. `raw_output` guarda la salida cruda
+    del LLM del lote y solo se llena en el primer chunk de cada lote.
+    """
+    chunk           = models.ForeignKey(DocumentEmbedding, on_delete=models.CASCADE, related_name='location_extractions')
+    file            = models.ForeignKey(Files, on_delete=models.CASCADE, related_name='location_extractions')
+    model           = models.CharField(max_length=100)
+    prompt_key      = models.CharField(max_length=40)  # sha1 del prompt del extractor
+    raw_output      = models.JSONField(null=True, blank=True)
+    created_date    = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chunk', 'model', 'prompt_key'], name='locextraction_chunk_model_prompt'),
+        ]
+        indexes = [
+            models.Index(fields=['file', 'model', 'prompt_key'], name='locextraction_file_idx'),
+        ]
+
+class LocationEntity(models.Model):
+    """Lugar normalizado que el extractor encontró en un chunk"""
+    chunk           = models.ForeignKey(DocumentEmbedding, on_delete=models.CASCADE, related_name='location_entities')
+    file            = models.ForeignKey(Files, on_delete=models.CASCADE, related_name='location_entities')
+    model           = models.CharField(max_length=100)
+    prompt_key      = models.CharField(max_length=40)
+    position        = models.IntegerField()  # chunk_index, para conservar el orden del documento
+    name            = models.TextField()
+    type            = models.CharField(max_length=50, null=True, blank=True)
+    estado          = models.TextField(null=True, blank=True)
+    pais            = models.TextField(null=True, blank=True)
+    context         = models.TextField(null=True, blank=True)
+    longitude       = models.FloatField(null=True, blank=True)
+    latitude        = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['file', 'model', 'prompt_key'], name='locentity_file_idx'),
+        ]
+
 # from django.db import models
 # from pgvector.django import VectorField
 
@@ -0,0 +1,133 @@
+"""
+Re-ranking local de los chunks recuperados, antes de armar el prompt.
+
+Corre en CPU dentro del proceso (sin llamadas al LLM) y se compone de etapas
+configurables con RAG_RERANKERS:
+
+    cross_encoder  -> un cross-encoder pequeño puntúa cada par (consulta, pasaje)
+    mmr            -> Maximal Marginal Relevance sobre los vectores que ya trajo
+                      la recuperación (retrieve_chunks con with_vectors):
+                      equilibra relevancia y diversidad y elige pasajes hasta
+                      agotar el presupuesto de tokens
+
+Sin la etapa mmr los pasajes se toman en el orden de relevancia hasta el
+presupuesto. El presupuesto y el conteo de tokens los da quien llama (el chat
+usa los de su ContextPacker), para no tener un segundo estimador.
+"""
+import logging
+import threading
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+
+from .retrieval import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+RERANKERS = ("cross_encoder", "mmr")
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder():
+    """Carga una sola vez el cross-encoder configurado (None si no está disponible)"""
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    _cross_encoder = CrossEncoder(
+                        getattr(settings, "RAG_CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"),
+                        device="cpu",
+                    )
+                except Exception as e:
+                    logger.error(f"No se pudo cargar el cross-encoder: {str(e)}")
+                    _cross_encoder = False
+    return _cross_encoder or None
+
+
+def cross_encoder_scores(query: str, chunks: Sequence[RetrievedChunk], max_chars: int) -> Optional[np.ndarray]:
+    """Relevancia (0..1) de cada pasaje según el cross-encoder, o None si no está disponible"""
+    model = get_cross_encoder()
+    if model is None or not chunks:
+        return None
+    scores = np.asarray(model.predict([(query, chunk.text[:max_chars]) for chunk in chunks]), dtype=float)
+    return 1.0 / (1.0 + np.exp(-scores))
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, costs: Sequence[int],
+               token_budget: int, lambda_mult: float) -> List[int]:
+    """
+    Selección MMR con presupuesto: en cada paso elige el candidato que maximiza
+    lambda * relevancia - (1 - lambda) * similitud máxima con lo ya elegido,
+    entre los que todavía caben en el presupuesto. Devuelve índices en orden.
+    """
+    remaining = list(range(len(relevance)))
+    selected: List[int] = []
+    used = 0
+    max_similarity = np.zeros(len(relevance))
+
+    while remaining:
+        fitting = [i for i in remaining if used + costs[i] <= token_budget]
+        if not fitting:
+            break
+        scores = lambda_mult * relevance[fitting] - (1 - lambda_mult) * max_similarity[fitting]
+        best = fitting[int(np.argmax(scores))]
+
+        selected.append(best)
+        remaining.remove(best)
+        used += costs[best]
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[best])
+
+    return selected
+
+
+def select_passages(query: str, chunks: List[RetrievedChunk], token_budget: int,
+                    count_tokens: Callable[[str], int], max_chars: int = 800,
+                    rerankers: Optional[Sequence[str]] = None) -> List[RetrievedChunk]:
+    """
+    Reordena y recorta los chunks recuperados para que quepan en `token_budget`.
+    El costo de cada pasaje se calcula con `count_tokens` sobre text[:max_chars],
+    que es lo que después entra al prompt.
+    """
+    if not chunks:
+        return []
+    if rerankers is None:
+        rerankers = getattr(settings, "RAG_RERANKERS", ["mmr"])
+
+    costs = [max(1, count_tokens(chunk.text[:max_chars])) for chunk in chunks]
+
+    # Relevancia base: puntaje RRF de la búsqueda híbrida o, si no lo hay,
+    # el orden en que llegaron los chunks (distancia)
+    rrf_scores = np.array([chunk.score for chunk in chunks], dtype=float)
+    if rrf_scores.max() > 0:
+        relevance = rrf_scores / rrf_scores.max()
+    else:
+        relevance = np.linspace(1.0, 0.5, num=len(chunks))
+
+    if "cross_encoder" in rerankers:
+        scores = cross_encoder_scores(query, chunks, max_chars)
+        if scores is not None:
+            relevance = scores
+
+    if "mmr" in rerankers:
+        # Sin vectores (no se pidieron o falta embedding_half) no hay MMR
+        if all(chunk.vector is not None for chunk in chunks):
+            vectors = np.vstack([chunk.vector for chunk in chunks])
+            order = mmr_select(
+                relevance, vectors, costs, token_budget,
+                getattr(settings, "RAG_MMR_LAMBDA", 0.7),
+            )
+            logger.debug(f"Re-ranking MMR: {len(order)}/{len(chunks)} pasajes, presupuesto {token_budget} tokens")
+            return [chunks[i] for i in order]
+
+    order = sorted(range(len(chunks)), key=lambda i: relevance[i], reverse=True)
+    selected, used = [], 0
+    for i in order:
+        if used + costs[i] <= token_budget:
+            selected.append(chunks[i])
+            used += costs[i]
+    return selected
@@ -0,0 +1,416 @@
+"""
+Utilidades compartidas para la búsqueda vectorial sobre DocumentEmbedding.
+
+`vector_search_session` ajusta los parámetros de pgvector solo durante la
+transacción de la consulta (SET LOCAL), de modo que cada búsqueda puede elegir
+su compromiso entre recall y latencia sin afectar a otras conexiones.
+
+La búsqueda se hace en dos etapas: una primera pasada ANN sobre la columna
+compacta `embedding_half` (halfvec, la mitad de memoria para el índice) que
+elige un pool de candidatos, y un reordenamiento exacto de ese pool contra
+`embedding` en precisión completa.
+
+`retrieve_chunks` es la API común de chat, reportes y metadatos: combina la
+búsqueda vectorial con la de texto completo de Postgres (`search_vector`,
+ts_rank) mediante reciprocal rank fusion, de modo que códigos, nombres o años
+exactos suban aunque su embedding no sea el más cercano. El tsvector lo
+calcula un trigger al insertar (migración 0018) con el diccionario del idioma
+de cada chunk, y la consulta se arma con ese mismo diccionario.
+"""
+import logging
+import operator
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from functools import reduce
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, Subquery, Value, When
+from pgvector import HalfVector
+from pgvector.django import L2Distance
+
+from .embeddings_service import embedder
+
+VECTOR_INDEX_NAME = "docemb_embedding_half_hnsw"
+VECTOR_INDEX_IVFFLAT_NAME = "docemb_embedding_half_ivfflat"
+VECTOR_SEARCH_MODES = ("ann", "exact")
+
+# Idiomas para los que se priorizan chunks en el mismo idioma de la consulta
+RANKED_LANGUAGES = ["es", "en", "fr"]
+
+# Diccionario de Postgres para el tsvector de cada idioma detectado (el
+# trigger de la migración 0018 usa el mismo mapeo)
+TEXT_SEARCH_CONFIGS = {"es": "spanish", "en": "english", "fr": "french"}
+DEFAULT_TEXT_SEARCH_CONFIG = "simple"
+MAX_LEXICAL_TERMS = 32
+# Palabras que websearch_to_tsquery interpreta como operador
+WEBSEARCH_OPERATORS = {"or"}
+
+# hnsw.ef_search admite a lo más 1000
+MAX_EF_SEARCH = 1000
+ITERATIVE_SCAN_MODES = ("relaxed_order", "strict_order")
+
+# Columnas que se leen de cada chunk recuperado; de los embeddings solo
+# `embedding_half` y solo si se pide (with_vectors, para MMR)
+RETRIEVED_FIELDS = ("id", "file_id", "file__filename", "chunk_index", "text", "metadata_json", "language")
+
+
+@dataclass(frozen=True)
+class RetrievedChunk:
+    """Resultado compacto de una búsqueda vectorial"""
+    id: int
+    file_id: int
+    filename: str
+    chunk_index: int
+    text: str
+    distance: float
+    metadata_json: Optional[dict] = None
+    language: str = ""
+    # Puntaje RRF (solo búsqueda híbrida) y si el chunk coincidió por texto
+    score: float = 0.0
+    lexical: bool = False
+    # embedding_half normalizado (float32), solo con with_vectors
+    vector: Optional[np.ndarray] = field(default=None, compare=False, repr=False)
+
+    @property
+    def similarity(self) -> float:
+        return 1 - self.distance
+
+
+logger = logging.getLogger(__name__)
+
+
+def text_search_config(language: Optional[str]) -> str:
+    return TEXT_SEARCH_CONFIGS.get(language or "", DEFAULT_TEXT_SEARCH_CONFIG)
+
+
+def _unit_vector(value) -> Optional[np.ndarray]:
+    if value is None:
+        return None
+    vector = np.asarray(value.to_numpy() if hasattr(value, "to_numpy") else value, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def to_retrieved_chunks(queryset, with_vectors: bool = False) -> List[RetrievedChunk]:
+    """
+    Evalúa un queryset de DocumentEmbedding anotado con `distance` en una sola
+    consulta (con JOIN a Files para el nombre) y sin traer `embedding`. Con
+    `with_vectors` trae además `embedding_half` (la mitad de bytes) para el
+    re-ranking MMR, en la misma consulta.
+    """
+    fields = RETRIEVED_FIELDS + (("embedding_half",) if with_vectors else ())
+    return [
+        RetrievedChunk(
+            id=row["id"],
+            file_id=row["file_id"],
+            filename=row["file__filename"] or "",
+            chunk_index=row["chunk_index"],
+            text=row["text"],
+            distance=float(row["distance"]),
+            metadata_json=row["metadata_json"],
+            language=row["language"],
+            vector=_unit_vector(row["embedding_half"]) if with_vectors else None,
+        )
+        for row in queryset.values(*fields, "distance")
+    ]
+
+
+_pgvector_version: Optional[Tuple[int, ...]] = None
+
+
+def pgvector_version() -> Tuple[int, ...]:
+    """Versión instalada de la extensión vector (una consulta por proceso)"""
+    global _pgvector_version
+    if _pgvector_version is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+        _pgvector_version = tuple(int(part) for part in re.findall(r"\d+", row[0])) if row else ()
+    return _pgvector_version
+
+
+def iterative_scan_mode() -> Optional[str]:
+    """VECTOR_SEARCH_ITERATIVE_SCAN; 'auto' = relaxed_order si pgvector >= 0.8"""
+    mode = getattr(settings, "VECTOR_SEARCH_ITERATIVE_SCAN", "auto")
+    if mode == "auto":
+        return "relaxed_order" if pgvector_version() >= (0, 8) else None
+    return mode if mode in ITERATIVE_SCAN_MODES else None
+
+
+def candidate_factor_for(query_language: Optional[str], coarse: bool,
+                         candidate_factor: Optional[int] = None) -> Optional[int]:
+    """Factor del pool de candidatos de `ranked_chunks_queryset` (None = sin pool)"""
+    if query_language in RANKED_LANGUAGES:
+        if candidate_factor is None:
+            candidate_factor = getattr(settings, "RAG_LANGUAGE_CANDIDATE_FACTOR", 4)
+        return candidate_factor
+    if coarse:
+        return getattr(settings, "VECTOR_SEARCH_RERANK_FACTOR", 4)
+    return None
+
+
+def candidate_limit(query_language: Optional[str], top_k: int, coarse: bool) -> int:
+    """Filas que la consulta pide al índice ANN (LIMIT del pool de candidatos)"""
+    return top_k * (candidate_factor_for(query_language, coarse) or 1)
+
+
+@contextmanager
+def vector_search_session(ef_search: Optional[int] = None,
+                          probes: Optional[int] = None,
+                          exact: Optional[bool] = None,
+                          limit: Optional[int] = None):
+    """
+    Abre una transacción y configura la búsqueda vectorial para ella.
+
+    Args:
+        ef_search: tamaño de la lista de candidatos de HNSW (más alto = mejor recall).
+        probes: número de listas visitadas por IVFFlat.
+        exact: si es True desactiva los índices y fuerza el escaneo exacto.
+        limit: filas que pedirá la consulta; HNSW devuelve a lo más ef_search,
+            así que ef_search se sube a este valor si es menor.
+
+    Los valores omitidos se toman de VECTOR_SEARCH_EF_SEARCH,
+    VECTOR_SEARCH_PROBES y VECTOR_SEARCH_MODE. Con pgvector >= 0.8 el escaneo
+    iterativo (VECTOR_SEARCH_ITERATIVE_SCAN, 'auto' por defecto) sigue
+    recorriendo el índice cuando el filtro (p. ej. context_ids @> [id])
+    descarta candidatos. Las consultas deben evaluarse (list(...)) dentro del
+    bloque `with`.
+    """
+    if ef_search is None:
+        ef_search = getattr(settings, "VECTOR_SEARCH_EF_SEARCH", None)
+    if ef_search and limit:
+        ef_search = min(max(ef_search, limit), MAX_EF_SEARCH)
+    if probes is None:
+        probes = getattr(settings, "VECTOR_SEARCH_PROBES", None)
+    if exact is None:
+        exact = getattr(settings, "VECTOR_SEARCH_MODE", "ann") == "exact"
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if exact:
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            else:
+                if ef_search:
+                    cursor.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+                if probes:
+                    cursor.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+                # pgvector >= 0.8: sigue recorriendo el índice HNSW hasta completar
+                # las filas pedidas que cumplan el filtro (p. ej. context_ids @> [id])
+                iterative_scan = iterative_scan_mode()
+                if iterative_scan:
+                    cursor.execute(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}")
+        yield
+
+
+def ranked_chunks_queryset(base_queryset, query_embedding, query_language: Optional[str] = None,
+                           top_k: int = 20, candidate_factor: Optional[int] = None,
+                           coarse: Optional[bool] = None):
+    """
+    Construye una sola consulta que ordena los chunks por cercanía a la consulta,
+    poniendo primero los del mismo idioma y después el resto (sin exists()
+    previo ni segunda pasada).
+
+    Los candidatos se toman por distancia (lo que permite usar el índice ANN)
+    en un pool de top_k * candidate_factor, y solo ese pool se reordena con
+    ORDER BY (language = idioma) DESC, distance.
+
+    Con `coarse` (por defecto VECTOR_SEARCH_COARSE) el pool se elige con la
+    distancia sobre `embedding_half` y `distance` se recalcula de forma exacta
+    sobre `embedding`; sin él todo se calcula sobre `embedding`.
+    """
+    if coarse is None:
+        coarse = getattr(settings, "VECTOR_SEARCH_COARSE", True)
+
+    distance = L2Distance("embedding", query_embedding)
+
+    candidate_factor = candidate_factor_for(query_language, coarse, candidate_factor)
+    if candidate_factor is None:
+        return base_queryset.annotate(distance=distance).order_by("distance")[:top_k]
+
+    if coarse:
+        candidate_distance = L2Distance("embedding_half", HalfVector(query_embedding))
+    else:
+        candidate_distance = distance
+
+    candidates = (
+        base_queryset.annotate(candidate_distance=candidate_distance)
+        .order_by("candidate_distance")
+        .values("id")[:top_k * candidate_factor]
+    )
+
+    ranked = base_queryset.model.objects.filter(id__in=Subquery(candidates)).annotate(distance=distance)
+    if query_language not in RANKED_LANGUAGES:
+        return ranked.order_by("distance")[:top_k]
+
+    return (
+        ranked.annotate(
+            same_language=Case(
+                When(language=query_language, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        )
+        .order_by("-same_language", "distance")[:top_k]
+    )
+
+
+def search_chunks(base_queryset, query_embedding, query_language: Optional[str] = None,
+                  top_k: int = 20, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                  exact: Optional[bool] = None, log_prefix: str = "[RAG]",
+                  with_vectors: bool = False) -> List[RetrievedChunk]:
+    """
+    Búsqueda vectorial con prioridad de idioma en una sola consulta SQL.
+    Los conteos de diagnóstico solo se calculan con RAG_DEBUG activado.
+    En modo exacto se omite la pasada sobre `embedding_half`.
+    """
+    if exact is None:
+        exact = getattr(settings, "VECTOR_SEARCH_MODE", "ann") == "exact"
+    coarse = False if exact else getattr(settings, "VECTOR_SEARCH_COARSE", True)
+    limit = candidate_limit(query_language, top_k, coarse)
+
+    with vector_search_session(ef_search=ef_search, probes=probes, exact=exact, limit=limit):
+        if getattr(settings, "RAG_DEBUG", False):
+            total = base_queryset.count()
+            same_language = base_queryset.filter(language=query_language).count()
+            logger.debug(f"{log_prefix} chunks candidatos: {total} (idioma={query_language}: {same_language})")
+
+        return to_retrieved_chunks(
+            ranked_chunks_queryset(base_queryset, query_embedding, query_language, top_k, coarse=coarse),
+            with_vectors=with_vectors,
+        )
+
+
+def lexical_query(query: str) -> List[Tuple[Q, SearchQuery]]:
+    """
+    Una tsquery por diccionario, con el filtro de los chunks indexados con él:
+    cada chunk se compara con los términos derivados con el diccionario de
+    su propio idioma. Los términos van unidos por OR (una pregunta en lenguaje
+    natural rara vez contiene todos sus términos en un mismo chunk) en una
+    sola llamada a websearch_to_tsquery, que descarta las stopwords.
+    """
+    terms = [
+        term for term in dict.fromkeys(re.findall(r"\w+", query.lower()))
+        if term not in WEBSEARCH_OPERATORS
+    ][:MAX_LEXICAL_TERMS]
+    if not terms:
+        return []
+
+    text = " or ".join(terms)
+    queries = []
+    for config in dict.fromkeys(list(TEXT_SEARCH_CONFIGS.values()) + [DEFAULT_TEXT_SEARCH_CONFIG]):
+        languages = [lang for lang, lang_config in TEXT_SEARCH_CONFIGS.items() if lang_config == config]
+        language_filter = Q(language__in=languages) if languages else ~Q(language__in=list(TEXT_SEARCH_CONFIGS))
+        queries.append((language_filter, SearchQuery(text, config=config, search_type="websearch")))
+    return queries
+
+
+def lexical_ranking(base_queryset, queries: List[Tuple[Q, SearchQuery]], limit: int) -> List[int]:
+    """
+    Ids de los `limit` chunks con mejor ts_rank. Solo se rankean las primeras
+    RAG_LEXICAL_MAX_MATCHES coincidencias, para no calcular ts_rank sobre casi
+    todo el contexto cuando la pregunta tiene términos frecuentes.
+    """
+    matches = reduce(operator.or_, (language & Q(search_vector=sq) for language, sq in queries))
+    max_matches = getattr(settings, "RAG_LEXICAL_MAX_MATCHES", 2000)
+    matched_ids = base_queryset.filter(matches).values("id")[:max_matches]
+
+    rank = Case(
+        *[
+            When(language, then=SearchRank(F("search_vector"), sq, normalization=Value(1)))
+            for language, sq in queries
+        ],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return list(
+        base_queryset.model.objects.filter(id__in=Subquery(matched_ids))
+        .annotate(rank=rank)
+        .order_by("-rank")
+        .values_list("id", flat=True)[:limit]
+    )
+
+
+def hybrid_search_chunks(base_queryset, query: str, query_embedding, query_language: Optional[str] = None,
+                         top_k: int = 20, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                         exact: Optional[bool] = None, log_prefix: str = "[RAG]",
+                         with_vectors: bool = False) -> List[RetrievedChunk]:
+    """
+    Fusiona el top de la búsqueda vectorial con el de ts_rank sobre
+    `search_vector` usando reciprocal rank fusion:
+
+        score(chunk) = sum(1 / (RAG_RRF_K + posición en cada lista))
+
+    Cada lista aporta top_k * RAG_HYBRID_CANDIDATE_FACTOR candidatos. Los
+    chunks resultantes conservan `distance` exacta para los filtros de similitud.
+    """
+    if exact is None:
+        exact = getattr(settings, "VECTOR_SEARCH_MODE", "ann") == "exact"
+    rrf_k = getattr(settings, "RAG_RRF_K", 60)
+    pool = top_k * getattr(settings, "RAG_HYBRID_CANDIDATE_FACTOR", 2)
+    lexical_queries = lexical_query(query)
+    coarse = False if exact else getattr(settings, "VECTOR_SEARCH_COARSE", True)
+    limit = candidate_limit(query_language, pool, coarse)
+
+    with vector_search_session(ef_search=ef_search, probes=probes, exact=exact, limit=limit):
+        vector_ids = list(
+            ranked_chunks_queryset(base_queryset, query_embedding, query_language, pool, coarse=coarse)
+            .values_list("id", flat=True)
+        )
+
+        lexical_ids = lexical_ranking(base_queryset, lexical_queries, pool) if lexical_queries else []
+
+        scores = {}
+        for ranking in (vector_ids, lexical_ids):
+            for position, chunk_id in enumerate(ranking, start=1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + position)
+        fused_ids = sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+        chunks = to_retrieved_chunks(
+            base_queryset.model.objects.filter(id__in=fused_ids)
+            .annotate(distance=L2Distance("embedding", query_embedding)),
+            with_vectors=with_vectors,
+        )
+
+    lexical_set = set(lexical_ids)
+    chunks = [replace(c, score=scores[c.id], lexical=c.id in lexical_set) for c in chunks]
+    chunks.sort(key=lambda c: c.score, reverse=True)
+
+    if getattr(settings, "RAG_DEBUG", False):
+        both = len(lexical_set.intersection(vector_ids))
+        logger.debug(f"{log_prefix} híbrida: vector={len(vector_ids)} texto={len(lexical_ids)} "
+                     f"en ambas={both} -> {len(chunks)} chunks")
+    return chunks
+
+
+def retrieve_chunks(base_queryset, query: str, top_k: int = 20, hybrid: Optional[bool] = None,
+                    ef_search: Optional[int] = None, probes: Optional[int] = None,
+                    exact: Optional[bool] = None, log_prefix: str = "[RAG]",
+                    with_vectors: bool = False) -> List[RetrievedChunk]:
+    """
+    API única de recuperación: genera el embedding de la consulta, detecta su
+    idioma y ejecuta la búsqueda híbrida (o solo vectorial con hybrid=False o
+    RAG_HYBRID desactivado) sobre `base_queryset`. Con `with_vectors` cada
+    chunk trae su `embedding_half` normalizado (para el MMR de reranking.py).
+    """
+    query_embedding = embedder.embed_query(query)
+    if query_embedding is None or len(query_embedding) == 0:
+        logger.warning(f"{log_prefix} No se pudo generar embedding para la consulta: {query[:100]}...")
+        return []
+
+    query_language = embedder.detect_language(query)
+
+    if hybrid is None:
+        hybrid = getattr(settings, "RAG_HYBRID", True)
+
+    if hybrid:
+        return hybrid_search_chunks(base_queryset, query, query_embedding, query_language, top_k,
+                                    ef_search=ef_search, probes=probes, exact=exact, log_prefix=log_prefix,
+                                    with_vectors=with_vectors)
+    return search_chunks(base_queryset, query_embedding, query_language, top_k,
+                         ef_search=ef_search, probes=probes, exact=exact, log_prefix=log_prefix,
+                         with_vectors=with_vectors)
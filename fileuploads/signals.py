@@ -0,0 +1,104 @@
+"""
+Mantiene sincronizado DocumentEmbedding.context_ids con Context.files.
+
+La búsqueda vectorial filtra por `context_ids @> [context_id]` (índice GIN)
+en lugar de hacer el join documentembedding → files → context_files, así que
+cada cambio en la relación se replica aquí con un UPDATE por lote.
+"""
+from django.db import connection
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from .models import Context
+
+TABLE = "fileuploads_documentembedding"
+
+
+def add_context_to_files(context_ids, file_ids):
+    if not context_ids or not file_ids:
+        return
+    with connection.cursor() as cursor:
+        for context_id in context_ids:
+            cursor.execute(
+                f"""
+                UPDATE {TABLE}
+                SET context_ids = array_append(context_ids, %s)
+                WHERE file_id = ANY(%s) AND NOT (context_ids @> ARRAY[%s]::bigint[])
+                """,
+                [context_id, list(file_ids), context_id],
+            )
+
+
+def remove_context_from_files(context_ids, file_ids=None):
+    """Quita los contextos de los chunks de `file_ids` (o de todos si es None)"""
+    if not context_ids:
+        return
+    with connection.cursor() as cursor:
+        for context_id in context_ids:
+            if file_ids is None:
+                cursor.execute(
+                    f"""
+                    UPDATE {TABLE}
+                    SET context_ids = array_remove(context_ids, %s)
+                    WHERE context_ids @> ARRAY[%s]::bigint[]
+                    """,
+                    [context_id, context_id],
+                )
+            elif file_ids:
+                cursor.execute(
+                    f"""
+                    UPDATE {TABLE}
+                    SET context_ids = array_remove(context_ids, %s)
+                    WHERE file_id = ANY(%s) AND context_ids @> ARRAY[%s]::bigint[]
+                    """,
+                    [context_id, list(file_ids), context_id],
+                )
+
+
+def cleared_context_ids(files_instance):
+    """Contextos que tenía un archivo antes de `files.contexts.clear()` (válido en post_clear)"""
+    return getattr(files_instance, "_cleared_context_ids", [])
+
+
+def cleared_file_ids(context_instance):
+    """Archivos que tenía un contexto antes de `context.files.clear()` (válido en post_clear)"""
+    return getattr(context_instance, "_cleared_file_ids", [])
+
+
+@receiver(m2m_changed, sender=Context.files.through)
+def sync_context_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    reverse=False: instance es un Context y pk_set son ids de Files.
+    reverse=True:  instance es un Files y pk_set son ids de Context.
+    """
+    if action == "pre_clear":
+        # En clear() Django no entrega pk_set; se guarda la relación actual
+        if reverse:
+            instance._cleared_context_ids = list(instance.contexts.values_list("id", flat=True))
+        else:
+            instance._cleared_file_ids = list(instance.files.values_list("id", flat=True))
+        return
+
+    if action == "post_add":
+        if reverse:
+            add_context_to_files(pk_set, [instance.pk])
+        else:
+            add_context_to_files([instance.pk], pk_set)
+
+    elif action == "post_remove":
+        if reverse:
+            remove_context_from_files(pk_set, [instance.pk])
+        else:
+            remove_context_from_files([instance.pk], pk_set)
+
+    elif action == "post_clear":
+        if reverse:
+            remove_context_from_files(cleared_context_ids(instance), [instance.pk])
+        else:
+            remove_context_from_files([instance.pk], cleared_file_ids(instance))
+
+
+@receiver(pre_delete, sender=Context)
+def drop_deleted_context(sender, instance, **kwargs):
+    # Borrar un contexto elimina las filas de context_files sin emitir m2m_changed
+    remove_context_from_files([instance.pk])
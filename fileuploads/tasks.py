@@ -2,6 +2,7 @@
 Tareas asíncronas de Celery para fileuploads
 """
 from celery import shared_task
+from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
 import os
 import io
@@ -120,4 +121,93 @@ def update_geonode_metadata_task(
             'geonode_document_id': geonode_document_id,
             'reason': 'exception',
             'message': str(e)
-        }
\ No newline at end of file
+        }
+
+# ---------------------------------------------------------------------------
+# Ingesta asíncrona de archivos: extracción -> embeddings/guardado -> cierre
+# ---------------------------------------------------------------------------
+
+def _run_ingestion_stage(task, file_id: int, status: str, stage):
+    """
+    Ejecuta una etapa de la ingesta sobre el registro `Files`.
+    Si la etapa falla, el archivo queda en estado "error" y se relanza la
+    excepción para que Celery corte la cadena.
+    """
+    from .models import Files
+    from .ingestion import mark_file_error
+
+    try:
+        file_record = Files.objects.get(id=file_id)
+        if status:
+            Files.objects.filter(id=file_id).update(status=status, task_id=task.request.id)
+        return stage(file_record)
+    except Exception as e:
+        print(f"[CELERY] ERROR: ingesta del archivo {file_id} falló: {str(e)}")
+        mark_file_error(file_id, str(e))
+        raise
+
+
+@shared_task(bind=True, name='fileuploads.extract_file', acks_late=True,
+             time_limit=settings.INGEST_TASK_TIME_LIMIT,
+             soft_time_limit=settings.INGEST_TASK_TIME_LIMIT - 60)
+def extract_file_task(self, file_id: int):
+    """Etapa 1: extrae el contenido del archivo y lo divide en chunks (spool en disco)"""
+    from .ingestion import extract_to_spool
+
+    total = _run_ingestion_stage(self, file_id, "extracting", extract_to_spool)
+    return {'file_id': file_id, 'chunks_total': total}
+
+
+@shared_task(bind=True, name='fileuploads.embed_store_file', acks_late=True,
+             time_limit=settings.INGEST_TASK_TIME_LIMIT,
+             soft_time_limit=settings.INGEST_TASK_TIME_LIMIT - 60)
+def embed_store_file_task(self, file_id: int):
+    """Etapa 2: genera embeddings y guarda los chunks por ventanas, reanudable"""
+    from .ingestion import embed_and_store_spool
+
+    stored = _run_ingestion_stage(self, file_id, "embedding", embed_and_store_spool)
+    return {'file_id': file_id, 'chunks_stored': stored}
+
+
+@shared_task(bind=True, name='fileuploads.finalize_file', acks_late=True,
+             time_limit=settings.INGEST_TASK_TIME_LIMIT,
+             soft_time_limit=settings.INGEST_TASK_TIME_LIMIT - 60)
+def finalize_file_task(self, file_id: int):
+    """Etapa 3: marca el archivo como listo y limpia archivos temporales"""
+    from .ingestion import finalize_file
+
+    _run_ingestion_stage(self, file_id, None, finalize_file)
+
+    if getattr(settings, "LOCATION_INDEX_AFTER_INGEST", False):
+        from chat.tasks import index_file_locations_task
+        index_file_locations_task.delay(file_id)
+
+    return {'file_id': file_id, 'status': 'done'}
+
+
+@shared_task(bind=True, name='fileuploads.ingest_catalog_document',
+             time_limit=settings.INGEST_TASK_TIME_LIMIT,
+             soft_time_limit=settings.INGEST_TASK_TIME_LIMIT - 60)
+def ingest_catalog_document_task(self, file_id: int, register: dict, geonode_info: dict):
+    """
+    Descarga un documento del catálogo de GeoNode y encola la ingesta de cada
+    archivo resultante (un ZIP puede contener varios). `file_id` es el registro
+    "pending" creado en el request; si la descarga falla queda en "error".
+    `geonode_info` (uuid y URL de descarga) ya viene resuelto; el mensaje no
+    lleva credenciales.
+    """
+    from .models import Files
+    from .ingestion import register_catalog_document, enqueue_file_ingestion, mark_file_error
+
+    try:
+        file_record = Files.objects.get(id=file_id)
+        created = register_catalog_document(file_record, register, geonode_info)
+    except Exception as e:
+        print(f"[CELERY] ERROR: no se pudo descargar el documento {register.get('id')}: {str(e)}")
+        mark_file_error(file_id, str(e))
+        raise
+
+    for file_record in created:
+        enqueue_file_ingestion(file_record.id)
+
+    return {'geonode_id': register.get('id'), 'file_ids': [f.id for f in created]}
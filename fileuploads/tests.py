@@ -1,3 +1,28 @@
-from django.test import TestCase
+import pandas as pd
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from fileuploads.management.commands.benchmark_csv_extract import csv_rows_to_texts_iterrows
+from fileuploads.utils import csv_rows_to_texts
+
+
+class CsvRowsToTextsTests(SimpleTestCase):
+    """La conversión vectorizada debe producir lo mismo que la de iterrows()"""
+
+    def assertSameTexts(self, df):
+        self.assertEqual(csv_rows_to_texts(df.copy()), csv_rows_to_texts_iterrows(df.copy()))
+
+    def test_valores_mixtos(self):
+        self.assertSameTexts(pd.DataFrame({
+            "nombre_lugar": ["Ciudad de México", "  Nuevo   León ", None, "N/A", "Oaxaca de Juárez"],
+            "poblacion": ["9209944", None, "null", "12.5", ""],
+            "fecha": ["2024-01-01", "desconocido", None, "2024-01-01", "nan"],
+        }, dtype=str))
+
+    def test_columna_vacia_y_filas_repetidas(self):
+        self.assertSameTexts(pd.DataFrame({
+            "estado": ["Jalisco", "Jalisco", "Jalisco"],
+            "vacia": [None, None, None],
+        }, dtype=str))
+
+    def test_bloque_vacio(self):
+        self.assertEqual(csv_rows_to_texts(pd.DataFrame()), [])
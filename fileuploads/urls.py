@@ -20,6 +20,8 @@ urlpatterns = [
     path('workspaces/admin/contexts/edit/<int:context_id>', views.edit_admin_workspaces_contexts, name='admin-contexts-edit'),
     path('workspaces/admin/contexts/delete/<int:context_id>', views.delete_admin_workspaces_contexts, name='admin-contexts-delete'),
     path('workspaces/admin/<int:workspace_id>/files', views.list_admin_workspaces_files, name='admin-workspaces-files-list'),  
+    path('workspaces/admin/<int:workspace_id>/files/status', views.workspace_files_status, name='admin-workspaces-files-status'),
+    path('workspaces/admin/files/<int:file_id>/status', views.file_status, name='admin-file-status'),
     
     path('workspaces/admin/<int:workspace_id>/contexts/<int:context_id>/files', views.list_admin_workspaces_contexts_files, name='admin-contexts-files-list'),   
     path('workspaces/admin/contexts/files/create', views.create_admin_workspaces_contexts_files, name='contexts-files-create'),
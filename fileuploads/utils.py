@@ -6,6 +6,7 @@ from PyPDF2 import PdfReader
 from sentence_transformers import SentenceTransformer
 from .models import DocumentEmbedding, Files
 from django.conf import settings
+from django.db import transaction
 from django.core.files.storage import FileSystemStorage
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from .embeddings_service import embedder
@@ -161,11 +162,8 @@ def iter_json_entries(file, file_size_mb):
 def json_entry_to_text_and_metadata(entry):
     flattened = flatten_json(entry)
 
-    campos_validos = {
-        k: limpiar_valor(v)
-        for k, v in flattened.items()
-        if limpiar_valor(v) != "(sin valor)"
-    }
+    limpios = ((k, limpiar_valor(v)) for k, v in flattened.items())
+    campos_validos = {k: v for k, v in limpios if v != "(sin valor)"}
 
     texto = "\n".join(
         f"{k.replace('_', ' ').capitalize()}: {v}" for k, v in campos_validos.items()
@@ -176,45 +174,117 @@ def json_entry_to_text_and_metadata(entry):
     return texto.strip(), metadata
 
 
-def extract_csv(file, file_size_mb):
-    chunks = []
-
-    def process_df(df):
-        df.fillna("(sin valor)", inplace=True)
-        for _, row in df.iterrows():
-            texto = "\n".join(
-                f"{col.replace('_', ' ').capitalize()}: {limpiar_valor(val)}"
-                for col, val in row.items()
-            )
-            if texto.strip():
-                chunks.append(texto.strip())
+SIN_VALOR = "(sin valor)"
+
+
+def limpiar_columna(serie, etiqueta=""):
+    """
+    Versión vectorizada de `limpiar_valor` para una columna del CSV.
+    `limpiar_valor` (y la etiqueta de la columna) se aplican una sola vez por
+    valor distinto y el resultado se expande con los códigos de `pd.factorize`;
+    los nulos (código -1) toman el último elemento, "(sin valor)".
+    """
+    codigos, unicos = pd.factorize(serie)
+    limpios = [etiqueta + limpiar_valor(valor) for valor in unicos]
+    limpios.append(etiqueta + SIN_VALOR)
+    return np.array(limpios, dtype=object)[codigos]
+
+
+def csv_rows_to_texts(df):
+    """
+    Convierte un bloque de filas del CSV en un texto por fila.
+    Las etiquetas se calculan una sola vez, cada columna se limpia completa
+    (ver `limpiar_columna`) y las filas se arman uniendo las columnas ya
+    etiquetadas, en lugar de recorrer celda por celda con iterrows().
+    """
+    if df.empty or len(df.columns) == 0:
+        return []
+
+    columnas = [
+        limpiar_columna(df.iloc[:, posicion], f"{col.replace('_', ' ').capitalize()}: ")
+        for posicion, col in enumerate(df.columns)
+    ]
+
+    texts = []
+    for partes in zip(*columnas):
+        texto = "\n".join(partes).strip()
+        if texto:
+            texts.append(texto)
+    return texts
 
+
+def iter_csv_texts(file):
+    """
+    Genera el texto de cada fila del CSV leyendo siempre por bloques de
+    CSV_CHUNK_SIZE filas, de modo que la memoria no depende del tamaño del archivo.
+    """
+    for df_chunk in pd.read_csv(
+        file, dtype=str, chunksize=CSV_CHUNK_SIZE, low_memory=False
+    ):
+        yield from csv_rows_to_texts(df_chunk)
+
+
+def extract_csv(file, file_size_mb):
     try:
-        if file_size_mb < MAX_MEMORY_MB:
-            process_df(pd.read_csv(file, dtype=str, low_memory=False))
-        else:
+        if file_size_mb >= MAX_MEMORY_MB:
             print("📦 CSV grande, lectura por chunks")
-            for df_chunk in pd.read_csv(
-                file, dtype=str, chunksize=CSV_CHUNK_SIZE, low_memory=False
-            ):
-                process_df(df_chunk)
-
-        return chunks
+        return list(iter_csv_texts(file))
 
     except Exception as e:
         print(f"⚠️ Error procesando CSV: {e}")
         return []
 
 
-def extract_text_from_file(file):
-    ext = file.name.lower().split(".")[-1]
-
+def get_file_size_mb(file):
     try:
         file.seek(0, 2)
         file_size_mb = file.tell() / (1024 * 1024)
         file.seek(0)
     except Exception:
         file_size_mb = 0
+    return file_size_mb
+
+
+def iter_file_chunks(file):
+    """
+    Versión en streaming de `extract_text_from_file` para la ingesta.
+
+    Genera tuplas (texto, json_original, metadata) conforme el parser avanza:
+    los CSV se leen por bloques y los JSON grandes con ijson, así que nunca se
+    materializa la lista completa de chunks. PDF, DOCX y TXT se extraen como
+    texto plano y se dividen con el splitter habitual.
+    """
+    ext = file.name.lower().split(".")[-1]
+    file_size_mb = get_file_size_mb(file)
+
+    if ext == "json":
+        for entry in iter_json_entries(file, file_size_mb):
+            texto, meta = json_entry_to_text_and_metadata(entry)
+            if texto:
+                yield texto, entry, meta
+        return
+
+    if ext == "csv":
+        for texto in iter_csv_texts(file):
+            yield texto, None, None
+        return
+
+    text = extract_text_from_file(file)
+    if not isinstance(text, str):
+        return
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len
+    )
+    for chunk in text_splitter.split_text(text):
+        yield chunk, None, None
+
+
+def extract_text_from_file(file):
+    ext = file.name.lower().split(".")[-1]
+    file_size_mb = get_file_size_mb(file)
 
     print(f"📦 Procesando {file.name} ({file_size_mb:.2f} MB)")
 
@@ -223,12 +293,10 @@ def extract_text_from_file(file):
         chunks, originals, metadata = [], [], []
 
         try:
-            for idx, entry in enumerate(iter_json_entries(file, file_size_mb)):
-                texto, meta = json_entry_to_text_and_metadata(entry)
-                if texto:
-                    chunks.append(texto)
-                    metadata.append(meta)
-                    originals.append(entry)
+            for texto, entry, meta in iter_file_chunks(file):
+                chunks.append(texto)
+                metadata.append(meta)
+                originals.append(entry)
 
             print(f"🧩 JSON → {len(chunks)} chunks generados")
             return chunks, originals, metadata
@@ -595,26 +663,27 @@ def get_geonode_document_uuid_by_id(
         raise ValueError(f"No se pudo obtener el UUID del documento: {str(e)}")
 
 def process_files(request, workspace, user_id):
-    start_time = time()
+    """
+    Registra los archivos subidos y encola su ingesta en Celery.
+    La extracción, los embeddings y el guardado ocurren fuera del request;
+    el progreso se consulta en los endpoints de estado de archivos.
+    """
+    from .ingestion import save_upload, enqueue_file_ingestion
+
     uploaded_files = []
 
     if "archivos" not in request.FILES:
         print("⚠️ No se encontraron archivos.")
         return uploaded_files
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-
     file_type = request.POST.get("type", "archivos cargados")
 
     for uploaded_file in request.FILES.getlist("archivos"):
-        print(f"\n🚀 Procesando archivo: {uploaded_file.name}")
+        print(f"\n🚀 Encolando archivo: {uploaded_file.name}")
+
+        saved_path = save_upload(uploaded_file, workspace)
 
-        # --- Crear registro del archivo ---
-        upload_file = Files(
+        upload_file = Files.objects.create(
             geonode_uuid=uuid.uuid4(),
             geonode_id=0,
             geonode_type=file_type,
@@ -622,363 +691,76 @@ def process_files(request, workspace, user_id):
             user_id=user_id,
             filename=uploaded_file.name,
             document_type=uploaded_file.content_type,
-            path=os.path.join(
-                "uploads/proyectos", str(workspace.id), uploaded_file.name
-            ),
+            path=saved_path,
             workspace=workspace,
+            status="pending",
         )
-        upload_file.save()
-
-        # =========================
-        # 1. Extracción de contenido
-        # =========================
-        uploaded_file.seek(0)
-        extracted = extract_text_from_file(uploaded_file)
-
-        # Limpieza defensiva (CLAVE para evitar bug)
-        chunks = []
-        json_originals = []
-        metadata_chunks = []
-        is_structured = False
-
-        # --- Normalización estricta ---
-        if isinstance(extracted, tuple):
-            # JSON → (chunks, originals, metadata)
-            chunks, json_originals, metadata_chunks = extracted
-            is_structured = True
-
-        elif isinstance(extracted, list):
-            # CSV → lista de textos
-            chunks = extracted
-            is_structured = True
-
-        elif isinstance(extracted, str):
-            # PDF / TXT → texto plano
-            try:
-                chunks = text_splitter.split_text(extracted)
-            except Exception as e:
-                print(f"⚠️ Error al dividir texto: {e}")
-                continue
-
-        else:
-            print("⚠️ Formato inesperado al extraer texto")
-            continue
-
-        # Fuerza nueva referencia (evita contaminación entre archivos)
-        chunks = list(chunks)
-
-        if not chunks:
-            print("🚧 No se generaron chunks, se omite el archivo.")
-            continue
-
-        print(f"🧩 Chunks generados: {len(chunks)}")
-
-        # =========================
-        # 2. Detección de idioma
-        # =========================
-        try:
-            sample = " ".join(chunks[:3])
-            language = embedder.detect_language(sample)
-        except Exception as e:
-            print(f"⚠️ Error detectando idioma: {e}")
-            language = "unknown"
-
-        # =========================
-        # 3. Embeddings en paralelo
-        # =========================
-        def process_batch(batch, batch_idx):
-            print(f"🧵 Batch {batch_idx + 1}: {len(batch)} chunks")
-            try:
-                return embedder.embed_texts(batch)
-            except Exception as e:
-                print(f"⚠️ Error en batch {batch_idx + 1}: {e}")
-                return [np.zeros(768) for _ in batch]
-
-        batches = [
-            chunks[i:i + BATCH_SIZE]
-            for i in range(0, len(chunks), BATCH_SIZE)
-        ]
-
-        print(
-            f"🚀 Paralelismo: {len(batches)} batches | "
-            f"batch_size={BATCH_SIZE} | workers={MAX_WORKERS}"
-        )
-
-        all_embeddings = []
-
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {
-                executor.submit(process_batch, batch, i): i
-                for i, batch in enumerate(batches)
-            }
-            for future in as_completed(futures):
-                all_embeddings.extend(future.result())
-
-        print(f"📈 Embeddings generados: {len(all_embeddings)}")
-
-        # =========================
-        # 4. Guardado en BD
-        # =========================
-        objs = []
-
-        for idx, (chunk, embedding) in enumerate(zip(chunks, all_embeddings)):
-            objs.append(
-                DocumentEmbedding(
-                    file=upload_file,
-                    chunk_index=idx,
-                    text=chunk,
-                    text_json=json_originals[idx] if json_originals else None,
-                    metadata_json=metadata_chunks[idx] if metadata_chunks else None,
-                    embedding=embedding,
-                    language=language,
-                    metadata={
-                        "source": uploaded_file.name,
-                        "content_type": uploaded_file.content_type,
-                        "chunk_size": len(chunk),
-                    },
-                )
-            )
-
-        DocumentEmbedding.objects.bulk_create(objs, batch_size=500)
-
-        upload_file.processed = True
-        upload_file.language = language
-        upload_file.save()
+        enqueue_file_ingestion(upload_file.id)
 
         uploaded_files.append({
+            "id": upload_file.id,
             "name": uploaded_file.name,
             "type": uploaded_file.content_type,
             "path": upload_file.path,
+            "status": upload_file.status,
         })
 
-        print(f"✅ Archivo procesado correctamente: {uploaded_file.name}")
-    end_time = time()
-    elapsed = end_time - start_time
-    mins, secs = divmod(elapsed, 60)
-    print(f"✅ Procesamiento completado en {int(mins)} min {secs:.2f} s ({len(uploaded_files)} archivo/s)")
     return uploaded_files
 
 
-
 def process_files_catalog(request, workspace, user_id):
+    """
+    Encola la descarga e ingesta de los documentos seleccionados del catálogo.
+    Cada documento se descarga en el worker de Celery, no en el request.
+    """
+    from .tasks import ingest_catalog_document_task
+
     uploaded_files = []
     archivos_geonode = request.POST.getlist("archivos_geonode")
 
     if len(archivos_geonode) > 0:
         token = request.headers.get("Authorization")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
 
         for file in archivos_geonode:
             register = json.loads(file)
-            id_document = register["id"]
-            file_name = register["nombre"]
-            
+
+            # Los metadatos (uuid y URL de descarga) se resuelven aquí con el
+            # token del usuario; a la tarea solo viaja el resultado
             try:
-                # url = "https://geonode.dev.geoint.mx/documents/{register}/download".format(register=id_document)
-                # url = "https://geonode.dev.geoint.mx/datasets/{register}/download".format(register=id_document)
-
-                geonode_info = get_geonode_document_uuid_by_id(
-                    id_document, token, register["category"]
-                )
-                print("url", geonode_info["url_download"], flush=True)
-                url = geonode_info["url_download"]
-
-                response = requests.get(url)
-                response.raise_for_status()
-
-                # 2. Crear directorio temporal
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    content = io.BytesIO(response.content)
-                    if zipfile.is_zipfile(content):
-                        # 3. Abrir ZIP desde memoria
-                        with zipfile.ZipFile(content) as zf:
-                            zf.extractall(tmpdir)
-
-                            for root, dirs, files in os.walk(tmpdir):
-                                for file in files:
-                                    filepath = os.path.join(root, file)
-                                    uploaded_file = convert_to_uploadedfile(filepath, file_name)
-                                    filename = uploaded_file.name
-
-                                    # Guardar info en la base de datos
-                                    upload_file = Files()
-                                    upload_file.geonode_uuid = geonode_info["uuid"]
-                                    upload_file.geonode_id = id_document
-                                    upload_file.geonode_type = "Catalogo"
-                                    upload_file.geonode_category = register["category"]
-                                    upload_file.user_id = user_id
-                                    upload_file.filename = filename
-                                    upload_file.document_type = (
-                                        uploaded_file.content_type
-                                    )
-                                    upload_file.path = os.path.join(
-                                        "uploads/proyectos", str(workspace.id), filename
-                                    )  # delete
-                                    upload_file.workspace = workspace
-                                    upload_file.save()
-                                    archivo_id = upload_file.id
-                                    print(archivo_id)
-
-                                    # extraer texto
-                                    uploaded_file.seek(0)
-                                    extracted_text = extract_text_from_file(
-                                        uploaded_file
-                                    )
-
-                                    # Detectar idioma
-                                    language = embedder.detect_language(extracted_text)
-
-                                    # Dividir texto en chunks
-                                    if isinstance(extracted_text, list):
-                                        # CSV o JSON serializado por registro → ya son chunks
-                                        chunks = extracted_text
-                                    else:
-                                        try:
-                                            chunks = text_splitter.split_text(
-                                                extracted_text
-                                            )
-                                        except Exception as e:
-                                            print(
-                                                f"⚠️ Error al hacer split del texto: {str(e)}"
-                                            )
-                                            chunks = []
-
-                                    # Generar embeddings por lotes (batch) para mejor rendimiento
-                                    embeddings = embedder.embed_texts(chunks)
-
-                                    # Guardar chunks con embeddings
-                                    DocumentEmbedding.objects.bulk_create(
-                                        [
-                                            DocumentEmbedding(
-                                                file=upload_file,
-                                                chunk_index=idx,
-                                                text=chunk,
-                                                embedding=embedding,
-                                                language=language,
-                                                metadata={
-                                                    "source": uploaded_file.name,
-                                                    "content_type": uploaded_file.content_type,
-                                                    "chunk_size": len(chunk),
-                                                },
-                                            )
-                                            for idx, (chunk, embedding) in enumerate(
-                                                zip(chunks, embeddings)
-                                            )
-                                        ]
-                                    )
-
-                                    upload_file.processed = True
-                                    # upload_file.size = os.path.getsize(filename)
-                                    upload_file.language = language
-                                    upload_file.save()
-
-                                    uploaded_files.append(
-                                        {
-                                            "name": uploaded_file.name,
-                                            "type": uploaded_file.content_type,
-                                            "size": uploaded_file.size,
-                                            "path": filename,
-                                        }
-                                    )
-                    else:
-                        filename = file_name
-                        # content_disp = response.headers.get("Content-Disposition", "")
-                        # if content_disp:
-                        #     match = re.findall('filename="?([^"]+)"?', content_disp)
-                        #     if match:
-                        #         filename = match[0]
-
-                        print("csv!!", filename, flush=True)
-                        file_path = os.path.join(tmpdir, filename)
-                        with open(file_path, "wb") as f:
-                            f.write(response.content)
-
-                        for root, dirs, files in os.walk(tmpdir):
-                            for file in files:
-                                filepath = os.path.join(root, file)
-                                uploaded_file = convert_to_uploadedfile(filepath)
-                                filename = uploaded_file.name
-
-                                # Guardar info en la base de datos
-                                upload_file = Files()
-                                upload_file.geonode_uuid = geonode_info["uuid"]
-                                upload_file.geonode_id = id_document
-                                upload_file.geonode_type = "Catalogo"
-                                upload_file.geonode_category = register["category"]
-                                upload_file.user_id = user_id
-                                upload_file.filename = filename
-                                upload_file.document_type = uploaded_file.content_type
-                                upload_file.path = os.path.join(
-                                    "uploads/proyectos", str(workspace.id), filename
-                                )  # delete
-                                upload_file.workspace = workspace
-                                upload_file.save()
-                                archivo_id = upload_file.id
-                                print(archivo_id)
-
-                                # extraer texto
-                                uploaded_file.seek(0)
-                                extracted_text = extract_text_from_file(uploaded_file)
-
-                                # Detectar idioma
-                                language = embedder.detect_language(extracted_text)
-
-                                # Dividir texto en chunks
-                                if isinstance(extracted_text, list):
-                                    # CSV o JSON serializado por registro → ya son chunks
-                                    chunks = extracted_text
-                                else:
-                                    try:
-                                        chunks = text_splitter.split_text(
-                                            extracted_text
-                                        )
-                                    except Exception as e:
-                                        print(
-                                            f"⚠️ Error al hacer split del texto: {str(e)}"
-                                        )
-                                        chunks = []
-
-                                # Generar embeddings por lotes (batch) para mejor rendimiento
-                                embeddings = embedder.embed_texts(chunks)
-
-                                # Guardar chunks con embeddings
-                                DocumentEmbedding.objects.bulk_create(
-                                    [
-                                        DocumentEmbedding(
-                                            file=upload_file,
-                                            chunk_index=idx,
-                                            text=chunk,
-                                            embedding=embedding,
-                                            language=language,
-                                            metadata={
-                                                "source": uploaded_file.name,
-                                                "content_type": uploaded_file.content_type,
-                                                "chunk_size": len(chunk),
-                                            },
-                                        )
-                                        for idx, (chunk, embedding) in enumerate(
-                                            zip(chunks, embeddings)
-                                        )
-                                    ]
-                                )
-
-                                upload_file.processed = True
-                                # upload_file.size = os.path.getsize(filename)
-                                upload_file.language = language
-                                upload_file.save()
-
-                                uploaded_files.append(
-                                    {
-                                        "name": uploaded_file.name,
-                                        "type": uploaded_file.content_type,
-                                        "size": uploaded_file.size,
-                                        "path": filename,
-                                    }
-                                )
-
-            except requests.RequestException as e:
-                print(f"Error al descargar el archivo: {str(e)}")
-
-    return uploaded_files
\ No newline at end of file
+                geonode_info = get_geonode_document_uuid_by_id(register["id"], token, register["category"])
+            except ValueError as e:
+                print(f"❌ Documento {register['id']} del catálogo: {str(e)}")
+                uploaded_files.append({
+                    "geonode_id": register["id"],
+                    "name": register["nombre"],
+                    "status": "error",
+                    "error_message": str(e),
+                })
+                continue
+
+            # El registro se crea antes de descargar para que el estado (y un
+            # posible error de descarga) se pueda consultar desde ya
+            file_record = Files.objects.create(
+                geonode_uuid=geonode_info["uuid"],
+                geonode_id=register["id"],
+                geonode_type="Catalogo",
+                geonode_category=register["category"],
+                user_id=user_id,
+                filename=register["nombre"],
+                document_type="",
+                workspace=workspace,
+                status="pending",
+            )
+            transaction.on_commit(
+                lambda file_id=file_record.id, register=register, geonode_info=geonode_info:
+                    ingest_catalog_document_task.delay(file_id, register, geonode_info)
+            )
+
+            uploaded_files.append({
+                "id": file_record.id,
+                "geonode_id": register["id"],
+                "name": register["nombre"],
+                "status": "pending",
+            })
+
+    return uploaded_files
@@ -18,9 +18,10 @@ import shutil
 import requests
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from .embeddings_service import embedder
+from .retrieval import retrieve_chunks, RetrievedChunk
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
 import uuid
-from typing import List
+from typing import List, Optional
 import time
 #import textract
 #import magic
@@ -163,7 +164,7 @@ def list_admin_workspaces(request):
                 "id": {"type": "integer"},
                 "saved": {"type": "boolean"},
                 "files_uploaded": {"type": "boolean"},
-                "uploaded_files": {"type": "array", "items": {"type": "string"}},
+                "uploaded_files": {"type": "array", "items": {"type": "object"}},
             },
         }
     },
@@ -229,6 +230,11 @@ def create_admin_workspaces(request):
                 "healthy": {"type": "boolean"},
                 "memory_usage_mb": {"type": "number"},
                 "cached_embeddings": {"type": "number"},
+                "max_memory_mb": {"type": "number"},
+                "shared_enabled": {"type": "boolean"},
+                "hits_local": {"type": "number"},
+                "hits_shared": {"type": "number"},
+                "misses": {"type": "number"},
                 "warnings": {"type": "array", "items": {"type": "string"}},
                 "should_cleanup": {"type": "boolean"},
             },
@@ -248,6 +254,11 @@ def cache_status(request):
             'healthy': True,
             'memory_usage_mb': cache_stats['memory_usage_mb'],
             'cached_embeddings': cache_stats['cached_embeddings'],
+            'max_memory_mb': cache_stats['max_memory_mb'],
+            'shared_enabled': cache_stats['shared_enabled'],
+            'hits_local': cache_stats['hits_local'],
+            'hits_shared': cache_stats['hits_shared'],
+            'misses': cache_stats['misses'],
             'warnings': [],
             'should_cleanup': embedder.should_cleanup_cache()
         }
@@ -256,8 +267,8 @@ def cache_status(request):
             status['healthy'] = False
             status['warnings'].append('Cache usando mucha memoria')
 
-        if cache_stats['cached_embeddings'] > 1000:
-            status['warnings'].append('Muchos embeddings en cache')
+        if not cache_stats['shared_enabled']:
+            status['warnings'].append('Cache compartido (Redis) no disponible')
 
         return JsonResponse(status)
 
@@ -284,10 +295,11 @@ def cache_status(request):
 )
 @api_view(['POST'])
 def force_cache_cleanup(request):
-    """Endpoint para forzar limpieza del cache"""
+    """Endpoint para forzar limpieza del cache (shared=true limpia también Redis)"""
     try:
+        shared = str(request.data.get('shared', 'false')).lower() == 'true'
         cache_stats_before = embedder.get_cache_stats()
-        embedder.clear_cache()
+        embedder.clear_cache(shared=shared)
 
         return JsonResponse({
             "success": True,
@@ -308,7 +320,7 @@ def force_cache_cleanup(request):
                 "id": {"type": "integer"},
                 "saved": {"type": "boolean"},
                 "files_uploaded": {"type": "boolean"},
-                "uploaded_files": {"type": "array", "items": {"type": "string"}},
+                "uploaded_files": {"type": "array", "items": {"type": "object"}},
             },
         }
     },
@@ -850,11 +862,75 @@ def list_admin_workspaces_files(request, workspace_id):
     list_files = list(Files.objects.filter(
         workspace=workspace_id
     ).values(
-        'id', 'geonode_id', 'document_type','geonode_type','geonode_category', 'user_id', 'filename','path'
+        'id', 'geonode_id', 'document_type','geonode_type','geonode_category', 'user_id', 'filename','path',
+        'status', 'chunks_total', 'chunks_done'
     ))
     
     return JsonResponse(list(list_files), safe=False)
 
+
+FILE_STATUS_FIELDS = ('id', 'filename', 'status', 'chunks_total', 'chunks_done', 'error_message', 'processed')
+
+
+def _file_status_payload(values):
+    """Agrega el porcentaje de avance a los campos de estado de un archivo"""
+    total = values['chunks_total']
+    if values['status'] == 'done':
+        values['progress'] = 100.0
+    else:
+        values['progress'] = round(100.0 * values['chunks_done'] / total, 1) if total else 0.0
+    return values
+
+
+@extend_schema(
+    methods=["GET"],
+    responses={
+        200: {
+            "type": "object",
+            "properties": {
+                "workspace_id": {"type": "integer"},
+                "pending": {"type": "integer"},
+                "files": {"type": "array", "items": {"type": "object"}},
+            },
+        }
+    },
+    summary="Estado de ingesta de los archivos de un workspace",
+    description="Devuelve el estado y avance (chunks procesados) de cada archivo del workspace.",
+    tags=["Workspaces"],
+)
+@api_view(["GET"])
+def workspace_files_status(request, workspace_id):
+    files = [
+        _file_status_payload(values)
+        for values in Files.objects.filter(workspace=workspace_id).order_by('id').values(*FILE_STATUS_FIELDS)
+    ]
+    pending = sum(1 for f in files if f['status'] not in ('done', 'error'))
+
+    return JsonResponse({
+        "workspace_id": workspace_id,
+        "pending": pending,
+        "files": files,
+    })
+
+
+@extend_schema(
+    methods=["GET"],
+    responses={
+        200: {"type": "object"},
+        404: {"type": "object", "properties": {"error": {"type": "string"}}},
+    },
+    summary="Estado de ingesta de un archivo",
+    description="Devuelve el estado y avance de la ingesta asíncrona de un archivo.",
+    tags=["Workspaces"],
+)
+@api_view(["GET"])
+def file_status(request, file_id):
+    values = Files.objects.filter(id=file_id).values(*FILE_STATUS_FIELDS).first()
+    if values is None:
+        return JsonResponse({"error": "Archivo no encontrado"}, status=404)
+
+    return JsonResponse(_file_status_payload(values))
+
 @extend_schema(
     methods=["POST"],
     responses={
@@ -1023,72 +1099,51 @@ def embeddingFile(archivo_id,file,context_id,user_id,document_type):
         return JsonResponse({"error": f"Vectorización fallida: {str(e)}"}, status=500)
 
 
-def optimized_rag_search(context_id: int, query: str, top_k: int = 50) -> List[DocumentEmbedding]:
+def optimized_rag_search(context_id: int, query: str, top_k: int = 50,
+                         ef_search: Optional[int] = None, probes: Optional[int] = None,
+                         exact: Optional[bool] = None) -> List[RetrievedChunk]:
     """
-    Búsqueda RAG optimizada con mejor ranking y filtrado
+    Búsqueda RAG optimizada con mejor ranking y filtrado.
+    `ef_search`, `probes` y `exact` ajustan la búsqueda en el índice ANN
+    (ver fileuploads.retrieval.vector_search_session).
     """
-    # Generar embedding de la consulta
-    query_embedding = embedder.embed_query(query)
-
-    if query_embedding is None:
-        return []
-
-    # Detectar idioma de la consulta
-    query_language = embedder.detect_language(query)
-
-    # Buscar chunks relevantes con filtros mejorados
-    relevant_chunks = DocumentEmbedding.objects.filter(
-        file__contexts__id=context_id
-    ).annotate(
-        similarity=1 - L2Distance('embedding', query_embedding)
+    # Búsqueda híbrida (vector + texto completo) en el idioma de la consulta
+    top_chunks = retrieve_chunks(
+        DocumentEmbedding.objects.filter(context_ids__contains=[context_id]),
+        query,
+        top_k=top_k,
+        ef_search=ef_search,
+        probes=probes,
+        exact=exact,
     )
 
-    # Filtrar por idioma si coincide
-    if query_language in ['es', 'en', 'fr']:
-        language_chunks = relevant_chunks.filter(language=query_language)
-        if language_chunks.exists():
-            relevant_chunks = language_chunks
-
-    # Obtener top chunks ordenados por similitud
-    top_chunks = relevant_chunks.order_by('-similarity')[:top_k]
-
     # Filtrar chunks con similitud muy baja (umbral mínimo)
-    filtered_chunks = [chunk for chunk in top_chunks if chunk.similarity > 0.3]
+    # (las coincidencias exactas por texto se conservan aunque estén lejos en el espacio vectorial)
+    filtered_chunks = [chunk for chunk in top_chunks if chunk.similarity > 0.3 or chunk.lexical]
 
-    print(f"RAG search: {len(filtered_chunks)} chunks encontrados para query en {query_language}")
+    print(f"RAG search: {len(filtered_chunks)} chunks encontrados para query")
 
     return filtered_chunks[:min(20, len(filtered_chunks))]  # Limitar a 20 mejores resultados
 
-def optimized_rag_search_files(file_ids: List[int], query: str, top_k: int = 20) -> List[DocumentEmbedding]:
-    query_embedding = embedder.embed_query(query)
-    if query_embedding is None:
-        print("[REPORT RAG] query_embedding=None")
-        return []
-
-    query_language = embedder.detect_language(query)
-
-    qs = DocumentEmbedding.objects.filter(file_id__in=file_ids).annotate(
-        distance=L2Distance("embedding", query_embedding)
+def optimized_rag_search_files(file_ids: List[int], query: str, top_k: int = 20,
+                               ef_search: Optional[int] = None, probes: Optional[int] = None,
+                               exact: Optional[bool] = None) -> List[RetrievedChunk]:
+    # Búsqueda híbrida: vector (idioma de la consulta primero) + texto completo, fusionadas con RRF
+    top_chunks = retrieve_chunks(
+        DocumentEmbedding.objects.filter(file_id__in=file_ids),
+        query,
+        top_k=top_k,
+        ef_search=ef_search,
+        probes=probes,
+        exact=exact,
+        log_prefix=f"[REPORT RAG] files={file_ids}",
     )
 
-    # Log: cuántos chunks totales hay para esos files
-    total = qs.count()
-    print(f"[REPORT RAG] total chunks en BD para files={file_ids}: {total} (lang={query_language})")
-
-    if query_language in ["es", "en", "fr"]:
-        lang_qs = qs.filter(language=query_language)
-        if lang_qs.exists():
-            qs = lang_qs
-            print(f"[REPORT RAG] usando filtro por idioma={query_language}. chunks={qs.count()}")
-
-    # con L2, lo correcto es ordenar ASC (menor distancia = más parecido)
-    top_chunks = qs.order_by("distance")[:top_k]
-
     # Log: top distancias
-    dists = [float(getattr(c, "distance", 0.0)) for c in top_chunks[:5]]
+    dists = [c.distance for c in top_chunks[:5]]
     print(f"[REPORT RAG] top distances (5): {dists}")
 
-    return list(top_chunks)
+    return top_chunks
 
 
 # Función auxiliar para limpiar cache periódicamente
@@ -1,2 +1,6 @@
 -- init-vector-extension.sql
-CREATE EXTENSION IF NOT EXISTS vector;
\ No newline at end of file
+CREATE EXTENSION IF NOT EXISTS vector;
+-- halfvec requiere pgvector >= 0.7 (volúmenes creados con versiones anteriores)
+ALTER EXTENSION vector UPDATE;
+-- Geometrías de localidades (localidades_locality)
+CREATE EXTENSION IF NOT EXISTS postgis;
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'llm.settings')
 
 application = get_asgi_application()
+
+# El chat async necesita el `receive` de la conexión para detectar desconexiones
+from chat.async_views import expose_receive  # noqa: E402
+
+application = expose_receive(application)
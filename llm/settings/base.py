@@ -141,6 +141,11 @@ EMBEDDING_MODEL = "mxbai-embed-large"  # Modelo multilingüe
 # Configuración para el modelo de embeddings
 PGVECTOR_VECTOR_SIZE = 768  # Dimensión para nomic-embed-text-v2
 
+# Cache de embeddings: LRU local por proceso (MB) + almacén compartido en Redis
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', 50))
+EMBEDDING_CACHE_REDIS_URL = os.environ.get('EMBEDDING_CACHE_REDIS_URL', 'redis://redis:6379/1')
+EMBEDDING_CACHE_TTL = int(os.environ.get('EMBEDDING_CACHE_TTL', 30 * 24 * 3600))  # 30 días
+
 # Configuración de Celery
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
@@ -151,3 +156,75 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutos
 CELERY_TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutos
+
+# Búsqueda vectorial (índice ANN de pgvector)
+VECTOR_SEARCH_MODE = os.environ.get('VECTOR_SEARCH_MODE', 'ann')  # 'ann' o 'exact'
+VECTOR_SEARCH_EF_SEARCH = int(os.environ.get('VECTOR_SEARCH_EF_SEARCH', 100))  # HNSW
+VECTOR_SEARCH_PROBES = int(os.environ.get('VECTOR_SEARCH_PROBES', 10))  # IVFFlat
+VECTOR_SEARCH_ITERATIVE_SCAN = os.environ.get('VECTOR_SEARCH_ITERATIVE_SCAN', 'auto')  # auto | off | relaxed_order | strict_order (pgvector >= 0.8)
+RAG_LANGUAGE_CANDIDATE_FACTOR = int(os.environ.get('RAG_LANGUAGE_CANDIDATE_FACTOR', 4))  # pool = top_k x factor
+VECTOR_SEARCH_COARSE = os.environ.get('VECTOR_SEARCH_COARSE', 'True').lower() == 'true'  # primera pasada sobre embedding_half
+VECTOR_SEARCH_RERANK_FACTOR = int(os.environ.get('VECTOR_SEARCH_RERANK_FACTOR', 4))  # candidatos halfvec = top_k x factor
+RAG_HYBRID = os.environ.get('RAG_HYBRID', 'True').lower() == 'true'  # fusiona vector + texto completo (RRF)
+RAG_RRF_K = int(os.environ.get('RAG_RRF_K', 60))  # constante k de reciprocal rank fusion
+RAG_HYBRID_CANDIDATE_FACTOR = int(os.environ.get('RAG_HYBRID_CANDIDATE_FACTOR', 2))  # candidatos por lista = top_k x factor
+RAG_LEXICAL_MAX_MATCHES = int(os.environ.get('RAG_LEXICAL_MAX_MATCHES', 2000))  # coincidencias de texto que se rankean con ts_rank
+# Re-ranking local de pasajes (fileuploads/reranking.py): etapas 'cross_encoder' y/o 'mmr'
+RAG_RERANKERS = [r.strip() for r in os.environ.get('RAG_RERANKERS', 'mmr').split(',') if r.strip()]
+RAG_CROSS_ENCODER_MODEL = os.environ.get('RAG_CROSS_ENCODER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RAG_MMR_LAMBDA = float(os.environ.get('RAG_MMR_LAMBDA', 0.7))  # 1 = solo relevancia, 0 = solo diversidad
+CHAT_LLM_CONTEXT_FILTER = os.environ.get('CHAT_LLM_CONTEXT_FILTER', 'False').lower() == 'true'  # filtro previo con el LLM (opt-in)
+RAG_PASSAGE_MAX_CHARS = int(os.environ.get('RAG_PASSAGE_MAX_CHARS', 1200))  # caracteres máximos por pasaje en el prompt
+RAG_DEBUG = os.environ.get('RAG_DEBUG', 'False').lower() == 'true'  # conteos de diagnóstico por búsqueda
+
+# Planificador de peticiones al LLM (chat)
+LLM_MAX_CONCURRENT = int(os.environ.get('OLLAMA_NUM_PARALLEL', 1))  # generaciones simultáneas por proceso
+LLM_QUEUE_MAX = int(os.environ.get('LLM_QUEUE_MAX', 20))  # peticiones en espera
+LLM_QUEUE_TIMEOUT = int(os.environ.get('LLM_QUEUE_TIMEOUT', 120))  # segundos máximos en cola
+
+# Extracción de lugares/localidades por lotes (chat/llm_batches.py)
+LLM_EXTRACTION_CONCURRENCY = int(os.environ.get('LLM_EXTRACTION_CONCURRENCY', LLM_MAX_CONCURRENT))  # lotes simultáneos por proceso
+LLM_EXTRACTION_BATCH_TOKENS = int(os.environ.get('LLM_EXTRACTION_BATCH_TOKENS', 3000))  # tokens de texto por lote
+# Índice de lugares por chunk (chat/location_index.py): llenarlo al terminar la ingesta (opt-in)
+LOCATION_INDEX_AFTER_INGEST = os.environ.get('LOCATION_INDEX_AFTER_INGEST', 'False').lower() == 'true'
+LOCATION_INDEX_MODEL = os.environ.get('LOCATION_INDEX_MODEL', 'llama3.1')  # modelo de get_context_locations
+
+# Geometrías de localidades vía Nominatim con caché local (localidades/geocoding.py)
+GEOCODER_RATE = float(os.environ.get('GEOCODER_RATE', 1.0))  # peticiones por segundo a Nominatim
+GEOCODER_BURST = int(os.environ.get('GEOCODER_BURST', 1))
+GEOCODER_REDIS_URL = os.environ.get('GEOCODER_REDIS_URL', EMBEDDING_CACHE_REDIS_URL)  # límite compartido por todos los workers
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))  # sin Redis, cada worker usa GEOCODER_RATE / WEB_WORKERS
+GEOCODER_WAIT = int(os.environ.get('GEOCODER_WAIT', 30))  # segundos que una petición espera a la cola
+GEOCODER_NEGATIVE_TTL = int(os.environ.get('GEOCODER_NEGATIVE_TTL', 30 * 24 * 3600))  # "no encontrado" en caché (segundos)
+GEOMETRY_SIMPLIFY_TOLERANCE = float(os.environ.get('GEOMETRY_SIMPLIFY_TOLERANCE', 0.001))  # grados
+# Consultas de localidades en PostGIS (localidades/store.py): tamaño de página del GeoJSON
+LOCALIDADES_PAGE_SIZE = int(os.environ.get('LOCALIDADES_PAGE_SIZE', 500))
+LOCALIDADES_MAX_PAGE_SIZE = int(os.environ.get('LOCALIDADES_MAX_PAGE_SIZE', 5000))
+LOCALIDADES_EXPORT_CHUNK = int(os.environ.get('LOCALIDADES_EXPORT_CHUNK', 1000))  # features por bloque al exportar (localidades/export.py)
+
+# Presupuesto del prompt del chat (chat/context_packer.py)
+CHAT_NUM_CTX = int(os.environ.get('CHAT_NUM_CTX', 8192))  # ventana enviada a Ollama como options.num_ctx
+CHAT_RESPONSE_TOKENS = int(os.environ.get('CHAT_RESPONSE_TOKENS', 1024))  # tokens reservados para la respuesta
+CHAT_TOKENIZER = os.environ.get('CHAT_TOKENIZER', '')  # tokenizer de Hugging Face; vacío = estimador calibrado
+CHAT_CHARS_PER_TOKEN = float(os.environ.get('CHAT_CHARS_PER_TOKEN', 3.5))  # valor inicial del estimador
+CHAT_HISTORY_MAX_TURNS = int(os.environ.get('CHAT_HISTORY_MAX_TURNS', 10))
+
+# Caché semántica de respuestas del chat por contexto (chat/answer_cache.py)
+CHAT_ANSWER_CACHE = os.environ.get('CHAT_ANSWER_CACHE', 'True').lower() == 'true'
+CHAT_ANSWER_CACHE_THRESHOLD = float(os.environ.get('CHAT_ANSWER_CACHE_THRESHOLD', 0.95))  # similitud coseno mínima
+CHAT_ANSWER_CACHE_TTL = int(os.environ.get('CHAT_ANSWER_CACHE_TTL', 7 * 24 * 3600))  # segundos
+
+# Caché de planes SQL de la búsqueda en archivos JSON (chat/sql_plan_cache.py)
+CHAT_SQL_PLAN_CACHE = os.environ.get('CHAT_SQL_PLAN_CACHE', 'True').lower() == 'true'
+
+# Ramas de recuperación del chat (RAG y JSON/SQL) en paralelo: plazo en segundos por rama
+CHAT_BRANCH_WORKERS = int(os.environ.get('CHAT_BRANCH_WORKERS', 8))
+CHAT_BRANCH_DEADLINES = {
+    'rag': int(os.environ.get('CHAT_RAG_DEADLINE', 20)),
+    'json': int(os.environ.get('CHAT_JSON_DEADLINE', 90)),
+}
+
+# Ingesta asíncrona de archivos
+INGEST_WINDOW_SIZE = int(os.environ.get('INGEST_WINDOW_SIZE', 500))  # chunks por ventana de embeddings
+INGEST_TASK_TIME_LIMIT = int(os.environ.get('INGEST_TASK_TIME_LIMIT', 4 * 3600))  # 4 horas
+INGEST_KEEP_UPLOADS = os.environ.get('INGEST_KEEP_UPLOADS', 'False').lower() == 'true'
@@ -0,0 +1,215 @@
+"""
+Exportación de localidades desde PostGIS (localidades_locality) a archivo.
+
+Las features se leen con un cursor del lado del servidor (store.iter_features)
+y se escriben al disco por bloques de LOCALIDADES_EXPORT_CHUNK:
+
+- geojson / geojsonl: el texto de cada feature va directo al archivo
+  (FeatureCollection o una feature por línea).
+- gpkg / shp: escrituras incrementales con pyogrio (append); el shapefile se
+  comprime en zip al final. En exportaciones de polígonos, los lugares que
+  aún no se resuelven conservan el punto del LLM: la capa GPKG es de
+  geometría genérica y el zip del shapefile lleva esos puntos aparte.
+
+El archivo se escribe con un nombre temporal y se renombra al terminar, así
+la URL de descarga nunca apunta a un archivo a medias.
+"""
+import json
+import logging
+import os
+import shutil
+import zipfile
+from typing import Iterable, Iterator, List, Optional
+
+from django.conf import settings
+
+from .store import iter_features
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "geojson": ".geojson",
+    "geojsonl": ".geojsonl",
+    "gpkg": ".gpkg",
+    "shp": ".zip",
+}
+
+# Atributos de las capas GPKG/SHP (las propiedades del GeoJSON pueden variar)
+TEXT_COLUMNS = ["name", "type", "context", "país", "estado"]
+INT_COLUMNS = ["menciones", "file_id"]
+
+LAYER_NAME = "localidades"
+
+
+def _chunks(features: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for feature in features:
+        chunk.append(feature)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_geojson(features: Iterable[str], path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as out:
+        out.write('{"type": "FeatureCollection", "features": [\n')
+        for feature in features:
+            if count:
+                out.write(",\n")
+            out.write(feature)
+            count += 1
+        out.write("\n]}\n")
+    return count
+
+
+def _write_geojsonl(features: Iterable[str], path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as out:
+        for feature in features:
+            out.write(feature)
+            out.write("\n")
+            count += 1
+    return count
+
+
+def _frame(features: List[dict]):
+    """GeoDataFrame de un bloque de features con columnas y tipos fijos"""
+    import geopandas as gpd
+    from shapely.geometry import shape
+
+    data = {column: [] for column in TEXT_COLUMNS + INT_COLUMNS}
+    geometries = []
+    for feature in features:
+        properties = feature.get("properties") or {}
+        for column in TEXT_COLUMNS:
+            value = properties.get(column)
+            data[column].append("" if value is None else str(value))
+        for column in INT_COLUMNS:
+            data[column].append(int(properties.get(column) or 0))
+        geometry = feature.get("geometry")
+        geometries.append(shape(geometry) if geometry else None)
+    return gpd.GeoDataFrame(data, geometry=geometries, crs="EPSG:4326")
+
+
+class _OgrLayer:
+    """Capa escrita por bloques con pyogrio: el primer bloque la crea, los demás se agregan"""
+
+    def __init__(self, path: str, driver: str, geometry_type: str, layer: Optional[str] = None):
+        self.path = path
+        self.options = {
+            "driver": driver,
+            "geometry_type": geometry_type,
+            "promote_to_multi": geometry_type.startswith("Multi"),
+        }
+        if layer:
+            self.options["layer"] = layer
+        self.count = 0
+
+    def write(self, features: List[dict]):
+        if not features:
+            return
+        from pyogrio import write_dataframe
+        write_dataframe(_frame(features), self.path, append=self.count > 0, **self.options)
+        self.count += len(features)
+
+    def finish(self):
+        """Capa vacía con el esquema si no se escribió nada, para que el archivo se pueda abrir"""
+        if not self.count:
+            from pyogrio import write_dataframe
+            write_dataframe(_frame([]), self.path, **self.options)
+
+
+def _geometry_type(feature: dict) -> Optional[str]:
+    return (feature.get("geometry") or {}).get("type")
+
+
+def _write_gpkg(features: Iterable[str], path: str, geom_kind: str, chunk_size: int) -> int:
+    # Con polígonos, los lugares que aún no se resuelven conservan el punto del
+    # LLM: la capa se declara con geometría genérica para admitir ambos
+    layer = _OgrLayer(path, "GPKG", "Unknown" if geom_kind == "polygon" else "Point", LAYER_NAME)
+    for chunk in _chunks(features, chunk_size):
+        layer.write([json.loads(feature) for feature in chunk])
+    layer.finish()
+    return layer.count
+
+
+def _write_shp_zip(features: Iterable[str], path: str, base_name: str, geom_kind: str, chunk_size: int) -> int:
+    """
+    Un shapefile admite un solo tipo de geometría: en exportaciones de
+    polígonos los lugares que siguen con su punto van en `<nombre>_puntos.shp`
+    dentro del mismo zip.
+    """
+    shp_dir = os.path.join(os.path.dirname(path), f"shp_{base_name}")
+    os.makedirs(shp_dir, exist_ok=True)
+    try:
+        if geom_kind == "polygon":
+            main = _OgrLayer(os.path.join(shp_dir, f"{base_name}.shp"), "ESRI Shapefile", "MultiPolygon")
+            points = _OgrLayer(os.path.join(shp_dir, f"{base_name}_puntos.shp"), "ESRI Shapefile", "Point")
+        else:
+            main = _OgrLayer(os.path.join(shp_dir, f"{base_name}.shp"), "ESRI Shapefile", "Point")
+            points = None
+
+        skipped = 0
+        for chunk in _chunks(features, chunk_size):
+            parsed = [json.loads(feature) for feature in chunk]
+            if points is None:
+                main.write(parsed)
+                continue
+            main.write([f for f in parsed if _geometry_type(f) in (None, "Polygon", "MultiPolygon")])
+            points.write([f for f in parsed if _geometry_type(f) == "Point"])
+            skipped += sum(1 for f in parsed if _geometry_type(f) not in (None, "Polygon", "MultiPolygon", "Point"))
+        main.finish()
+        if skipped:
+            logger.warning(f"{skipped} localidades con geometrías no exportables a shapefile omitidas")
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(shp_dir)):
+                archive.write(os.path.join(shp_dir, name), name)
+    finally:
+        shutil.rmtree(shp_dir, ignore_errors=True)
+    return main.count + (points.count if points else 0)
+
+
+def export_localities(base_filename: str, export_format: str = "geojson", context_id=None,
+                      file_ids=None, geom_kind: str = "point") -> dict:
+    """
+    Escribe las localidades guardadas en MEDIA_ROOT/geojsons y devuelve el
+    formato usado, la URL de descarga y el número de features.
+    """
+    export_format = str(export_format).lower()
+    if export_format not in EXPORT_FORMATS:
+        export_format = "geojson"
+    chunk_size = getattr(settings, "LOCALIDADES_EXPORT_CHUNK", 1000)
+
+    exports_dir = os.path.join(settings.MEDIA_ROOT, "geojsons")
+    os.makedirs(exports_dir, exist_ok=True)
+    filename = f"{base_filename}{EXPORT_FORMATS[export_format]}"
+    tmp_path = os.path.join(exports_dir, f"tmp_{filename}")
+
+    features = iter_features(context_id, file_ids, geom_kind, chunk_size=chunk_size)
+    try:
+        if export_format == "geojson":
+            count = _write_geojson(features, tmp_path)
+        elif export_format == "geojsonl":
+            count = _write_geojsonl(features, tmp_path)
+        elif export_format == "gpkg":
+            count = _write_gpkg(features, tmp_path, geom_kind, chunk_size)
+        else:
+            count = _write_shp_zip(features, tmp_path, base_filename, geom_kind, chunk_size)
+        os.replace(tmp_path, os.path.join(exports_dir, filename))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        features.close()
+
+    logger.info(f"Exportadas {count} localidades a {filename}")
+    return {
+        "export_format": export_format,
+        "download_url": f"{settings.MEDIA_URL}geojsons/{filename}",
+        "feature_count": count,
+    }
@@ -0,0 +1,305 @@
+"""
+Geometrías de lugares (polígono o centroide) con caché local.
+
+Las consultas a Nominatim pasan por GeometryCache, con llave
+(nombre, tipo, estado, país, tipo de geometría) normalizada:
+
+- Los aciertos (incluidos los lugares del gazetteer cargado con
+  `manage.py seed_gazetteer`) se responden de inmediato.
+- Los fallos se encolan en una cola de fondo por proceso. Todas las colas
+  comparten un token bucket en Redis (GEOCODER_REDIS_URL), así el total de
+  peticiones a Nominatim no pasa de GEOCODER_RATE por segundo (política de
+  uso) aunque haya varios workers. Si Redis no está disponible, cada proceso
+  usa un bucket local con GEOCODER_RATE / WEB_WORKERS. Cada geometría
+  encontrada se simplifica y se guarda.
+- La petición espera a la cola a lo más GEOCODER_WAIT segundos; lo que no
+  alcance a resolverse sigue en la cola y queda en caché para la siguiente.
+"""
+import logging
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import GeometryCache
+
+logger = logging.getLogger(__name__)
+
+# (nombre, tipo, estado, país) normalizados
+PlaceKey = Tuple[str, str, str, str]
+
+UNSPECIFIED = {"", "no especificado", "n/a", "none"}
+
+
+def _normalize(value) -> str:
+    if not isinstance(value, str):
+        return ""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    value = " ".join(value.lower().split())
+    return "" if value in UNSPECIFIED else value[:255]
+
+
+def normalize_key(name, entity_type, state, country) -> PlaceKey:
+    """Sin acentos, mayúsculas ni espacios repetidos; "No especificado" cuenta como vacío"""
+    return _normalize(name), _normalize(entity_type), _normalize(state), _normalize(country)
+
+
+class TokenBucket:
+    """Limita la tasa de peticiones: `rate` fichas por segundo, hasta `capacity` acumuladas"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = max(rate, 0.01)
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+# Token bucket atómico en Redis: repone `rate` fichas por segundo hasta
+# `capacity` y devuelve cuántos segundos esperar (0 = ficha tomada)
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class SharedTokenBucket:
+    """
+    TokenBucket compartido por todos los procesos a través de Redis. Si Redis
+    falla, usa `fallback` (bucket local) y reintenta Redis después de
+    `retry_after_seconds`.
+    """
+
+    def __init__(self, redis_url: Optional[str], key: str, rate: float, capacity: float,
+                 fallback: TokenBucket, retry_after_seconds: int = 60):
+        self.redis_url = redis_url
+        self.key = key
+        self.rate = max(rate, 0.01)
+        self.capacity = max(capacity, 1)
+        self.fallback = fallback
+        self.retry_after_seconds = retry_after_seconds
+        self._script = None
+        self._redis_down_until = 0.0
+
+    def _get_script(self):
+        if not self.redis_url or time.time() < self._redis_down_until:
+            return None
+        if self._script is None:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=2, socket_connect_timeout=2)
+            self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    def acquire(self):
+        while True:
+            try:
+                script = self._get_script()
+                if script is None:
+                    return self.fallback.acquire()
+                delay = float(script(keys=[self.key], args=[self.rate, self.capacity]))
+            except Exception as e:
+                logger.warning(f"Límite compartido de Nominatim no disponible ({e}), "
+                               f"se usa el local por {self.retry_after_seconds}s")
+                self._redis_down_until = time.time() + self.retry_after_seconds
+                return self.fallback.acquire()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+def simplify_geometry(geometry: Optional[dict]) -> Optional[dict]:
+    """Simplifica polígonos (GEOMETRY_SIMPLIFY_TOLERANCE, en grados) conservando la topología"""
+    tolerance = getattr(settings, "GEOMETRY_SIMPLIFY_TOLERANCE", 0.001)
+    if not geometry or geometry.get("type") == "Point" or tolerance <= 0:
+        return geometry
+    try:
+        from shapely.geometry import mapping, shape
+        simplified = shape(geometry).simplify(tolerance, preserve_topology=True)
+        if simplified.is_empty:
+            return geometry
+        return mapping(simplified)
+    except Exception as e:
+        logger.warning(f"No se pudo simplificar la geometría: {e}")
+        return geometry
+
+
+def query_nominatim(name, entity_type, country, state, geom_type="polygon") -> Optional[dict]:
+    """
+    Geometría (Polígono o Centroide) de un lugar en Nominatim (OSM), o None si
+    no se encontró. Arma una consulta ('q') según el nivel de detalle. Los
+    errores de red o de HTTP se propagan para no guardarlos en caché como
+    "no encontrado".
+    """
+    base_url = "https://nominatim.openstreetmap.org/search"
+
+    # Construir query según nivel de detalle
+    query_parts = [name]
+    if state and state != "No especificado":
+        query_parts.append(state)
+    if country and country != "No especificado":
+        query_parts.append(country)
+
+    query = ", ".join(query_parts)
+
+    params = {
+        'q': query,
+        'format': 'json',
+        'limit': 1
+    }
+
+    if geom_type == "polygon":
+        params['polygon_geojson'] = 1
+
+    headers = {
+        'User-Agent': 'SIGIC-IA-Engine/1.0 (Integration for GeoJSON)'
+    }
+
+    response = requests.get(base_url, params=params, headers=headers, timeout=5)
+    response.raise_for_status()
+    results = response.json()
+    if results and len(results) > 0:
+        first_result = results[0]
+
+        if geom_type == "polygon":
+            geojson_geom = first_result.get("geojson")
+            # Garantizar que realmente sea un polígono
+            if geojson_geom and geojson_geom.get("type") in ["Polygon", "MultiPolygon"]:
+                return geojson_geom
+        elif geom_type == "centroid":
+            lat = first_result.get("lat")
+            lon = first_result.get("lon")
+            if lat and lon:
+                return {
+                    "type": "Point",
+                    "coordinates": [float(lon), float(lat)]
+                }
+    return None
+
+
+class GeometryResolver:
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocoder")
+        rate = getattr(settings, "GEOCODER_RATE", 1.0)
+        burst = getattr(settings, "GEOCODER_BURST", 1)
+        self._bucket = SharedTokenBucket(
+            getattr(settings, "GEOCODER_REDIS_URL", None),
+            "geocoder:nominatim:bucket",
+            rate,
+            burst,
+            fallback=TokenBucket(rate / max(1, getattr(settings, "WEB_WORKERS", 1)), burst),
+        )
+        self._inflight: Dict[Tuple[PlaceKey, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, keys: Iterable[PlaceKey], geom_type: str) -> Dict[PlaceKey, Optional[dict]]:
+        """Entradas vigentes de la caché (una consulta); geometry None = no encontrado"""
+        keys = set(keys)
+        if not keys:
+            return {}
+        negative_ttl = getattr(settings, "GEOCODER_NEGATIVE_TTL", 30 * 24 * 3600)
+        rows = (
+            GeometryCache.objects.filter(geom_type=geom_type, name__in={key[0] for key in keys})
+            .filter(Q(geometry__isnull=False) | Q(created_date__gte=timezone.now() - timedelta(seconds=negative_ttl)))
+            .values_list("name", "entity_type", "state", "country", "geometry")
+        )
+        found = {}
+        for name, entity_type, state, country, geometry in rows:
+            key = (name, entity_type, state, country)
+            if key in keys:
+                found[key] = geometry
+        return found
+
+    def _fetch(self, key: PlaceKey, place: tuple, geom_type: str) -> Tuple[bool, Optional[dict]]:
+        """Consulta Nominatim respetando el token bucket y guarda el resultado"""
+        close_old_connections()
+        try:
+            self._bucket.acquire()
+            name, entity_type, state, country = place
+            geometry = simplify_geometry(query_nominatim(name, entity_type, country, state, geom_type))
+            GeometryCache.objects.update_or_create(
+                name=key[0], entity_type=key[1], state=key[2], country=key[3], geom_type=geom_type,
+                defaults={"geometry": geometry, "source": "osm", "created_date": timezone.now()},
+            )
+            return True, geometry
+        except Exception as e:
+            logger.warning(f"Error consultando Nominatim para '{place[0]}': {e}")
+            return False, None
+        finally:
+            with self._lock:
+                self._inflight.pop((key, geom_type), None)
+
+    def _enqueue(self, key: PlaceKey, place: tuple, geom_type: str) -> Future:
+        with self._lock:
+            future = self._inflight.get((key, geom_type))
+            if future is None:
+                future = self._executor.submit(self._fetch, key, place, geom_type)
+                self._inflight[(key, geom_type)] = future
+            return future
+
+    def resolve(self, places: Iterable[tuple], geom_type: str,
+                wait_seconds: Optional[float] = None) -> Dict[PlaceKey, Optional[dict]]:
+        """
+        `places` son tuplas (nombre, tipo, estado, país) tal como las dio el
+        extractor. Devuelve llave normalizada -> geometría (None = no
+        encontrado); las llaves que siguen en la cola no aparecen.
+        """
+        if wait_seconds is None:
+            wait_seconds = getattr(settings, "GEOCODER_WAIT", 30)
+
+        by_key = {}
+        for place in places:
+            by_key.setdefault(normalize_key(*place), place)
+
+        resolved = self.cached(by_key.keys(), geom_type)
+        misses = {key: place for key, place in by_key.items() if key not in resolved}
+        futures = {self._enqueue(key, place, geom_type): key for key, place in misses.items()}
+        if futures:
+            done, not_done = wait(futures, timeout=wait_seconds)
+            for future in done:
+                ok, geometry = future.result()
+                if ok:
+                    resolved[futures[future]] = geometry
+            logger.info(
+                f"Geometrías ({geom_type}): {len(by_key) - len(misses)} en caché, "
+                f"{len(done)} consultadas, {len(not_done)} siguen en cola"
+            )
+        return resolved
+
+
+geometry_resolver = GeometryResolver()
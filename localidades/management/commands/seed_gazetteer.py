@@ -0,0 +1,85 @@
+"""
+Carga un gazetteer local (GeoJSON, GPKG o SHP) en GeometryCache para que los
+lugares frecuentes no consulten Nominatim.
+
+Cada registro se guarda como centroide (punto interior) y, si es un área,
+también como polígono simplificado, con source="gazetteer".
+
+Ejemplos (marco geoestadístico de INEGI):
+  python manage.py seed_gazetteer 00ent.shp --type estado --name-field NOMGEO
+  python manage.py seed_gazetteer mun.gpkg --type municipio --name-field NOMGEO --state-field NOM_ENT
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from localidades.geocoding import normalize_key, simplify_geometry
+from localidades.models import GeometryCache
+
+
+class Command(BaseCommand):
+    help = 'Precarga la caché de geometrías de localidades desde un gazetteer local'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo de lugares (GeoJSON, GPKG o SHP)')
+        parser.add_argument(
+            '--type',
+            required=True,
+            choices=['país', 'estado', 'municipio', 'localidad', 'infraestructura'],
+            help='Tipo de entidad de todos los registros del archivo',
+        )
+        parser.add_argument('--name-field', default='NOMGEO', help='Campo con el nombre del lugar')
+        parser.add_argument('--state-field', default=None, help='Campo con el nombre del estado (municipios/localidades)')
+        parser.add_argument('--country', default='México', help='País de todos los registros')
+        parser.add_argument('--batch-size', type=int, default=500, help='Filas por inserción')
+
+    def handle(self, *args, **options):
+        import geopandas as gpd
+
+        try:
+            gdf = gpd.read_file(options['path'])
+        except Exception as e:
+            raise CommandError(f"No se pudo leer {options['path']}: {e}")
+
+        if options['name_field'] not in gdf.columns:
+            raise CommandError(f"El campo {options['name_field']} no existe: {list(gdf.columns)}")
+        if options['state_field'] and options['state_field'] not in gdf.columns:
+            raise CommandError(f"El campo {options['state_field']} no existe: {list(gdf.columns)}")
+        if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+            gdf = gdf.to_crs(epsg=4326)
+
+        entity_type = options['type']
+        now = timezone.now()
+        rows = {}
+        for _, record in gdf.iterrows():
+            geometry = record.geometry
+            if geometry is None or geometry.is_empty:
+                continue
+            state = record[options['state_field']] if options['state_field'] else None
+            key = normalize_key(record[options['name_field']], entity_type, state, options['country'])
+            if not key[0]:
+                continue
+
+            point = geometry.representative_point()
+            if geometry.geom_type in ('Polygon', 'MultiPolygon'):
+                rows[key + ('polygon',)] = simplify_geometry(geometry.__geo_interface__)
+            rows[key + ('centroid',)] = {"type": "Point", "coordinates": [point.x, point.y]}
+
+        objects = [
+            GeometryCache(
+                name=name, entity_type=etype, state=state, country=country,
+                geom_type=geom_type, geometry=geometry, source="gazetteer", created_date=now,
+            )
+            for (name, etype, state, country, geom_type), geometry in rows.items()
+        ]
+        GeometryCache.objects.bulk_create(
+            objects,
+            batch_size=options['batch_size'],
+            update_conflicts=True,
+            unique_fields=['name', 'entity_type', 'state', 'country', 'geom_type'],
+            update_fields=['geometry', 'source'],
+        )
+
+        places = len({key[:4] for key in rows})
+        self.stdout.write(self.style.SUCCESS(
+            f"{places} lugares ({entity_type}) cargados en la caché de geometrías ({len(rows)} geometrías)"
+        ))
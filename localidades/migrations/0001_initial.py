@@ -0,0 +1,32 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeometryCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('entity_type', models.CharField(max_length=50)),
+                ('state', models.CharField(blank=True, default='', max_length=255)),
+                ('country', models.CharField(blank=True, default='', max_length=255)),
+                ('geom_type', models.CharField(max_length=20)),
+                ('geometry', models.JSONField(blank=True, null=True)),
+                ('source', models.CharField(choices=[('osm', 'OpenStreetMap / Nominatim'), ('gazetteer', 'Gazetteer local')], default='osm', max_length=20)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='geometrycache',
+            constraint=models.UniqueConstraint(fields=('name', 'entity_type', 'state', 'country', 'geom_type'), name='geometrycache_place_key'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileuploads', '0016_locationextraction_locationentity'),
+        ('localidades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE EXTENSION IF NOT EXISTS postgis;",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='Locality',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('entity_type', models.CharField(max_length=50)),
+                ('estado', models.CharField(blank=True, default='', max_length=255)),
+                ('pais', models.CharField(blank=True, default='', max_length=255)),
+                ('geom_kind', models.CharField(max_length=20)),
+                ('properties', models.JSONField(default=dict)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('context', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='localities', to='fileuploads.context')),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='localities', to='fileuploads.files')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['context', 'geom_kind'], name='locality_context_kind_idx'), models.Index(fields=['file', 'geom_kind'], name='locality_file_kind_idx')],
+            },
+        ),
+        # Geometría en PostGIS fuera del estado de Django (ver Locality)
+        migrations.RunSQL(
+            sql="""
+                ALTER TABLE localidades_locality ADD COLUMN geom geometry(Geometry, 4326);
+                CREATE INDEX locality_geom_gist ON localidades_locality USING gist (geom);
+            """,
+            reverse_sql="""
+                DROP INDEX IF EXISTS locality_geom_gist;
+                ALTER TABLE localidades_locality DROP COLUMN IF EXISTS geom;
+            """,
+        ),
+    ]
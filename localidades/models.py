@@ -0,0 +1,57 @@
+from django.db import models
+
+
+class GeometryCache(models.Model):
+    """
+    Geometría (simplificada) de un lugar resuelta en Nominatim o cargada desde
+    un gazetteer local. `geometry` nulo registra que Nominatim no encontró el
+    lugar, para no repetir la consulta hasta que venza GEOCODER_NEGATIVE_TTL.
+    Las llaves se guardan normalizadas (ver geocoding.normalize_key).
+    """
+    SOURCE_CHOICES = [
+        ("osm", "OpenStreetMap / Nominatim"),
+        ("gazetteer", "Gazetteer local"),
+    ]
+
+    name            = models.CharField(max_length=255)
+    entity_type     = models.CharField(max_length=50)
+    state           = models.CharField(max_length=255, blank=True, default='')
+    country         = models.CharField(max_length=255, blank=True, default='')
+    geom_type       = models.CharField(max_length=20)  # polygon | centroid
+    geometry        = models.JSONField(null=True, blank=True)
+    source          = models.CharField(max_length=20, choices=SOURCE_CHOICES, default="osm")
+    created_date    = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'entity_type', 'state', 'country', 'geom_type'],
+                name='geometrycache_place_key',
+            ),
+        ]
+
+
+class Locality(models.Model):
+    """
+    Localidad extraída de un contexto (o de un conjunto de archivos), con la
+    geometría de la última extracción para cada tipo de geometría.
+
+    La columna `geom` (PostGIS, geometry(Geometry, 4326), índice GiST) se crea
+    en la migración y se lee/escribe con SQL (ver store.py); el modelo no la
+    declara para no requerir GDAL/GeoDjango en la aplicación.
+    """
+    context         = models.ForeignKey('fileuploads.Context', on_delete=models.CASCADE, null=True, blank=True, related_name='localities')
+    file            = models.ForeignKey('fileuploads.Files', on_delete=models.CASCADE, null=True, blank=True, related_name='localities')
+    name            = models.CharField(max_length=255)
+    entity_type     = models.CharField(max_length=50)
+    estado          = models.CharField(max_length=255, blank=True, default='')
+    pais            = models.CharField(max_length=255, blank=True, default='')
+    geom_kind       = models.CharField(max_length=20)  # point | polygon | centroid
+    properties      = models.JSONField(default=dict)
+    created_date    = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['context', 'geom_kind'], name='locality_context_kind_idx'),
+            models.Index(fields=['file', 'geom_kind'], name='locality_file_kind_idx'),
+        ]
@@ -0,0 +1,189 @@
+"""
+Almacén de localidades en PostGIS (tabla localidades_locality, índice GiST).
+
+Cada extracción reemplaza las localidades del contexto (o de los archivos, si
+no hay contexto) para su tipo de geometría. Los clientes de mapa consultan la
+tabla por bbox, en páginas de GeoJSON o en vector tiles (MVT), en lugar de
+descargar la FeatureCollection completa.
+"""
+import json
+import logging
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+TILE_LAYER = "localidades"
+TILE_EXTENT = 4096
+
+
+def store_localities(context_id: Optional[int], file_ids: Optional[Sequence[int]], geom_kind: str,
+                     features: List[dict]) -> int:
+    """
+    Reemplaza las localidades de `file_ids` (dentro del contexto, si lo hay)
+    para `geom_kind`; las de los demás archivos del contexto se conservan.
+    Con contexto y sin `file_ids` se reemplaza la capa completa del contexto.
+    """
+    rows = []
+    for feature in features:
+        properties = feature.get("properties") or {}
+        geometry = feature.get("geometry")
+        rows.append([
+            context_id,
+            properties.get("file_id"),
+            str(properties.get("name", ""))[:255],
+            str(properties.get("type", ""))[:50],
+            str(properties.get("estado") or "")[:255],
+            str(properties.get("país") or "")[:255],
+            geom_kind,
+            json.dumps(properties, ensure_ascii=False, default=str),
+            json.dumps(geometry) if geometry else None,
+        ])
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if context_id and not file_ids:
+            cursor.execute(
+                "DELETE FROM localidades_locality WHERE context_id = %s AND geom_kind = %s",
+                [context_id, geom_kind],
+            )
+        elif context_id:
+            cursor.execute(
+                """
+                DELETE FROM localidades_locality
+                WHERE context_id = %s AND file_id = ANY(%s) AND geom_kind = %s
+                """,
+                [context_id, list(file_ids), geom_kind],
+            )
+        else:
+            cursor.execute(
+                "DELETE FROM localidades_locality WHERE context_id IS NULL AND file_id = ANY(%s) AND geom_kind = %s",
+                [list(file_ids), geom_kind],
+            )
+        if rows:
+            cursor.executemany(
+                """
+                INSERT INTO localidades_locality
+                    (context_id, file_id, name, entity_type, estado, pais, geom_kind,
+                     properties, created_date, geom)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s::jsonb, now(),
+                        ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
+                """,
+                rows,
+            )
+    return len(rows)
+
+
+def _filters(context_id=None, file_ids: Optional[Iterable[int]] = None, geom_kind: str = "point",
+             entity_type: Optional[str] = None, alias: str = "l"):
+    where = [f"{alias}.geom_kind = %s"]
+    params: list = [geom_kind]
+    if context_id:
+        where.append(f"{alias}.context_id = %s")
+        params.append(context_id)
+    else:
+        # Sin contexto solo la capa por archivo: las filas de los contextos
+        # que incluyen el archivo duplicarían cada lugar
+        where.append(f"{alias}.context_id IS NULL")
+    if file_ids:
+        where.append(f"{alias}.file_id = ANY(%s)")
+        params.append(list(file_ids))
+    if entity_type:
+        where.append(f"{alias}.entity_type = %s")
+        params.append(entity_type)
+    return where, params
+
+
+def feature_page(context_id=None, file_ids=None, geom_kind: str = "point", entity_type=None,
+                 bbox: Optional[Sequence[float]] = None, after: int = 0, limit: int = 500) -> dict:
+    """
+    Página de GeoJSON (paginación por id). Con `bbox` (minx, miny, maxx, maxy
+    en EPSG:4326) solo devuelve lo que intersecta la caja, usando el GiST.
+    """
+    where, params = _filters(context_id, file_ids, geom_kind, entity_type)
+    if bbox:
+        where.append("l.geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+        params.extend(bbox)
+    where.append("l.id > %s")
+    params.extend([after, limit + 1])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT l.id, json_build_object(
+                'type', 'Feature',
+                'id', l.id,
+                'geometry', ST_AsGeoJSON(l.geom)::json,
+                'properties', l.properties
+            )::text
+            FROM localidades_locality l
+            WHERE {" AND ".join(where)}
+            ORDER BY l.id
+            LIMIT %s
+            """,
+            params,
+        )
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "type": "FeatureCollection",
+        "features": [json.loads(feature) for _, feature in rows],
+        "next_after": rows[-1][0] if has_more else None,
+    }
+
+
+def iter_features(context_id=None, file_ids=None, geom_kind: str = "point", entity_type=None,
+                  chunk_size: int = 1000) -> Iterator[str]:
+    """
+    Features GeoJSON (texto) en orden de id con un cursor del lado del servidor:
+    la exportación recorre la tabla sin cargarla completa en memoria.
+    """
+    where, params = _filters(context_id, file_ids, geom_kind, entity_type)
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT json_build_object(
+                'type', 'Feature',
+                'id', l.id,
+                'geometry', ST_AsGeoJSON(l.geom)::json,
+                'properties', l.properties
+            )::text
+            FROM localidades_locality l
+            WHERE {" AND ".join(where)}
+            ORDER BY l.id
+            """,
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for (feature,) in rows:
+                yield feature
+
+
+def vector_tile(z: int, x: int, y: int, context_id=None, file_ids=None, geom_kind: str = "point",
+                entity_type=None) -> bytes:
+    """Vector tile (MVT) z/x/y con las localidades que intersectan la tesela"""
+    where, params = _filters(context_id, file_ids, geom_kind, entity_type)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH bounds AS (
+                SELECT ST_TileEnvelope(%s, %s, %s) AS env
+            ),
+            tile AS (
+                SELECT ST_AsMVTGeom(ST_Transform(l.geom, 3857), b.env, {TILE_EXTENT}, 64, true) AS geom,
+                       l.id, l.name, l.entity_type, l.estado, l.pais, l.file_id
+                FROM localidades_locality l, bounds b
+                WHERE {" AND ".join(where)}
+                  AND l.geom && ST_Transform(b.env, 4326)
+            )
+            SELECT ST_AsMVT(tile.*, %s, {TILE_EXTENT}, 'geom') FROM tile
+            """,
+            [z, x, y] + params + [TILE_LAYER],
+        )
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b""
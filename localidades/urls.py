@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import detect_localidades
+from .views import detect_localidades, localidades_features, localidades_tile
 
 urlpatterns = [
     path('detect/', detect_localidades, name='detect_localidades'),
+    path('features/', localidades_features, name='localidades_features'),
+    path('tiles/<int:z>/<int:x>/<int:y>.pbf', localidades_tile, name='localidades_tile'),
 ]
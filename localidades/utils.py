@@ -6,72 +6,37 @@ import time
 from urllib.parse import quote
 from django.conf import settings
 from fileuploads.models import Context, DocumentEmbedding, Files
+from chat.location_index import extract_pending, first_mentions, prompt_key
+from .geocoding import geometry_resolver, normalize_key
+from .export import export_localities
+from .store import store_localities
 
 logger = logging.getLogger(__name__)
 
-def fetch_osm_geometry(name, entity_type, country, state, geom_type="polygon"):
+VALID_ENTITY_TYPES = ["país", "estado", "municipio", "localidad", "infraestructura"]
+DEFAULT_ENTITY_TYPES = ["país", "estado", "municipio", "localidad"]
+
+
+def normalize_entity_types(entity_types=None):
+    """Tipos válidos en orden canónico (el orden de la petición no cambia el prompt)"""
+    entity_types = [t for t in VALID_ENTITY_TYPES if t in (entity_types or [])]
+    return entity_types or list(DEFAULT_ENTITY_TYPES)
+
+
+def index_key(entity_types=None):
     """
-    Intenta obtener la geometría (Polígono o Centroide) de un lugar desde Nominatim (OSM).
-    Arma una consulta ('q') robusta según el tipo de entidad.
+    Llave del índice de localidades (chat/location_index.py): plantilla del
+    prompt + tipos normalizados. El prompt no usa el enfoque (solo sirve para
+    rellenar 'país' al armar la respuesta), así que un enfoque distinto no
+    vuelve a extraer los chunks.
     """
-    base_url = "https://nominatim.openstreetmap.org/search"
-    
-    # Construir query según nivel de detalle
-    query_parts = [name]
-    if state and state != "No especificado":
-        query_parts.append(state)
-    if country and country != "No especificado":
-        query_parts.append(country)
-        
-    query = ", ".join(query_parts)
-    
-    params = {
-        'q': query,
-        'format': 'json',
-        'limit': 1
-    }
+    entity_types = normalize_entity_types(entity_types)
+    return prompt_key("|".join([get_system_prompt(None, entity_types)] + entity_types))
 
-    if geom_type == "polygon":
-        params['polygon_geojson'] = 1
-    
-    headers = {
-        'User-Agent': 'SIGIC-IA-Engine/1.0 (Integration for GeoJSON)'
-    }
-    
-    try:
-        response = requests.get(base_url, params=params, headers=headers, timeout=5)
-        if response.status_code == 200:
-            results = response.json()
-            if results and len(results) > 0:
-                first_result = results[0]
-                
-                if geom_type == "polygon":
-                    geojson_geom = first_result.get("geojson")
-                    # Garantizar que realmente sea un polígono
-                    if geojson_geom and geojson_geom.get("type") in ["Polygon", "MultiPolygon"]:
-                        return geojson_geom
-                elif geom_type == "centroid":
-                    lat = first_result.get("lat")
-                    lon = first_result.get("lon")
-                    if lat and lon:
-                        return {
-                            "type": "Point",
-                            "coordinates": [float(lon), float(lat)]
-                        }
-    except Exception as e:
-        logger.warning(f"Error consultando Nominatim para '{query}': {e}")
-        
-    return None
 
 def get_system_prompt(focus="México", entity_types=None):
-    if not entity_types:
-        entity_types = ["país", "estado", "municipio", "localidad"]
-        
-    valid_types = ["país", "estado", "municipio", "localidad", "infraestructura"]
-    entity_types = [t for t in entity_types if t in valid_types]
-    if not entity_types:
-        entity_types = ["país", "estado", "municipio", "localidad"]
-        
+    entity_types = normalize_entity_types(entity_types)
+
     types_str = " | ".join(entity_types)
     types_list_str = ", ".join([f"'{t}'" for t in entity_types])
     
@@ -157,7 +122,7 @@ def detect_geographic_focus(text, model="deepseek-r1:32b"):
         logger.warning(f"Error detectando enfoque, usando default 'México': {str(e)}")
         return "México"
 
-def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", focus=None, file_ids=None, entity_types=None, export_format="geojson", geometry_type="point"):
+def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", focus=None, file_ids=None, entity_types=None, export_format="geojson", geometry_type="point", include_geojson=False):
     # (El cuerpo comienza con validaciones, agregamos export_format a la definicion y pasamos al final)
     """
     Usa Ollama para extraer localidades de documentos, con enfoque geográfico configurable.
@@ -165,6 +130,7 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
     Acepta 'context_id' o una lista explícita de 'file_ids'.
     'entity_types' permite filtrar la extracción (ej. ['país', 'estado', 'municipio', 'localidad', 'infraestructura'])
     'geometry_type' permite cambiar el tipo de geometría final. 'point' (default del LLM), 'centroid' u 'polygon' vía OSM.
+    'include_geojson' agrega la FeatureCollection completa a la respuesta; por defecto solo se devuelve la URL de descarga.
     """
     server = settings.OLLAMA_API_URL
     
@@ -182,13 +148,13 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
             return {"entities": [], "error": "Se requiere context_id o file_ids."}
         
         all_entities = []
-        BATCH_SIZE = 5
+        SAMPLE_CHUNKS = 5
         sample_text = ""
         
         # Intentar recolectar texto de muestra si focus debe detectarse
         if not focus or focus == "auto":
             for file in files:
-                chunks = DocumentEmbedding.objects.filter(file=file).order_by('chunk_index')[:BATCH_SIZE]
+                chunks = DocumentEmbedding.objects.filter(file=file).order_by('chunk_index')[:SAMPLE_CHUNKS]
                 for chunk in chunks:
                     sample_text += chunk.text + "\n\n"
                 if sample_text:
@@ -201,33 +167,17 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
                 focus = "México"
         
         system_prompt = get_system_prompt(focus, entity_types)
-        print(system_prompt,flush=True)
 
-
-        for file in files:
-            chunks = DocumentEmbedding.objects.filter(file=file).order_by('chunk_index')
-            total_chunks = chunks.count()
-            
-            logger.info(f"Procesando archivo {file.filename} con {total_chunks} chunks para extracción de localidades.")
-            
-            current_batch_text = ""
-            current_chunk_count = 0
-            
-            for chunk in chunks:
-                current_batch_text += chunk.text + "\n\n"
-                current_chunk_count += 1
-                
-                if current_chunk_count >= BATCH_SIZE:
-                    batch_entities = process_entities_batch(current_batch_text, model, system_prompt, server)
-                    all_entities.extend(batch_entities)
-                    
-                    current_batch_text = ""
-                    current_chunk_count = 0
-            
-            # Remanente
-            if current_batch_text:
-                batch_entities = process_entities_batch(current_batch_text, model, system_prompt, server)
-                all_entities.extend(batch_entities)
+        # Solo los chunks que aún no pasaron por este extractor van al LLM; las
+        # entidades salen del índice persistente (chat/location_index.py)
+        target_file_ids = list(files.values_list('id', flat=True))
+        key = index_key(entity_types)
+        extract_pending(
+            target_file_ids, model, key,
+            lambda text: extract_entities_batch(text, model, system_prompt, server),
+            label="localidades",
+        )
+        all_entities = first_mentions(target_file_ids, model, key)
 
         # Eliminar posibles duplicados y aplicar filtro estricto (blacklist)
         unique_entities = []
@@ -287,15 +237,7 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
             if any(char.isdigit() for char in name_clean):
                continue
                
-            # Regla 4: Anti-alucinaciones de contexto
-            context_text = entity.get("context", "").lower()
-            if context_text and context_text != "contexto no proporcionado por el modelo.":
-                # Si el modelo alucina (ej. "Puebla") sin estar en el texto exacto, lo descartamos
-                # Comparamos si al menos la palabra del lugar o alguna de sus piezas principales está
-                name_words = [w for w in name_lower.split() if len(w) > 3]
-                if name_lower not in context_text:
-                    if not name_words or not any(w in context_text for w in name_words):
-                        continue # Evidencia de alucinación o no coincidencia literal
+            # Regla 4 (anti-alucinaciones de contexto): se aplica al guardar en normalize_entity
                 
             key = (name_clean.lower(), etype_clean)
             if key not in seen:
@@ -334,24 +276,6 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
                     "coordinates": coords
                 } if is_valid_coords else None
                 
-                # Si el usuario solicitó polígonos o centroides oficiales, intentamos buscarlo en Nominatim
-                geometry_type_clean = str(geometry_type).lower()
-                if geometry_type_clean in ["polygon", "centroid"]:
-                    # Pausa breve para respetar políticas de Nominatim (1 req/sec)
-                    time.sleep(1)
-                    osm_geom = fetch_osm_geometry(
-                        name=name_clean,
-                        entity_type=etype_clean,
-                        country=entity.get("país"),
-                        state=entity.get("estado"),
-                        geom_type=geometry_type_clean
-                    )
-                    if osm_geom:
-                        geometry = osm_geom
-                        entity[f"osm_{geometry_type_clean}_found"] = True
-                    else:
-                        entity[f"osm_{geometry_type_clean}_found"] = False
-
                 feature = {
                     "type": "Feature",
                     "geometry": geometry,
@@ -359,81 +283,60 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
                 }
                 geojson_features.append(feature)
 
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": geojson_features
-        }
+        # Si el usuario solicitó polígonos o centroides oficiales, se buscan en la
+        # caché de geometrías / Nominatim (cola con límite de tasa, ver geocoding.py)
+        geometry_type_clean = str(geometry_type).lower()
+        if geometry_type_clean in ["polygon", "centroid"] and geojson_features:
+            places = [
+                (f["properties"]["name"], f["properties"]["type"],
+                 f["properties"].get("estado"), f["properties"].get("país"))
+                for f in geojson_features
+            ]
+            resolved = geometry_resolver.resolve(places, geometry_type_clean)
+            for feature, place in zip(geojson_features, places):
+                key = normalize_key(*place)
+                osm_geom = resolved.get(key)
+                if osm_geom:
+                    feature["geometry"] = osm_geom
+                    feature["properties"][f"osm_{geometry_type_clean}_found"] = True
+                else:
+                    feature["properties"][f"osm_{geometry_type_clean}_found"] = False
+                    if key not in resolved:
+                        # Sigue en la cola: quedará en caché para la próxima consulta
+                        feature["properties"][f"osm_{geometry_type_clean}_pending"] = True
 
-        # Guardar archivo descargable
-        import geopandas as gpd
-        import shutil
-        import uuid
-        
+        # Persistir en PostGIS (store.py): de ahí salen la exportación y las
+        # consultas por bbox / tiles
+        geom_kind = geometry_type_clean if geometry_type_clean in ["polygon", "centroid"] else "point"
+        # Con context_id y file_ids solo se reemplazan esos archivos en la capa del contexto
+        store_localities(context_id, target_file_ids if file_ids or not context_id else None,
+                         geom_kind, geojson_features)
+
+        # Archivo descargable escrito por bloques desde la tabla (export.py)
         timestamp = int(time.time())
-        prefix = f"ctx_{context_id}" if context_id else f"files_{len(file_ids)}"
-        base_filename = f"localidades_{prefix}_{timestamp}"
-        geojsons_dir = os.path.join(settings.MEDIA_ROOT, "geojsons")
-        os.makedirs(geojsons_dir, exist_ok=True)
-        
-        # Validar export_format
-        export_format = str(export_format).lower()
-        if export_format not in ["geojson", "shp", "gpkg"]:
-            export_format = "geojson"
-            
-        file_url = ""
-        
-        if export_format == "geojson":
-            filename = f"{base_filename}.geojson"
-            file_path = os.path.join(geojsons_dir, filename)
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-            file_url = f"{settings.MEDIA_URL}geojsons/{filename}"
-            
-        else:
-            # Requerimos geopandas para shp y gpkg
-            # Convertimos el FeatureCollection dict a GeoDataFrame
-            if geojson_features:
-                gdf = gpd.GeoDataFrame.from_features(geojson_data["features"])
-                # Forzar CRS WGS84 ya que las coordenadas LLM vienen como lon, lat standard
-                gdf.set_crs(epsg=4326, inplace=True)
-            else:
-                # Si está vacío creamos uno en blanco con columnas básicas para evitar fallos
-                import pandas as pd
-                from shapely.geometry import Point
-                gdf = gpd.GeoDataFrame(pd.DataFrame(columns=["name", "type", "context", "país", "estado"]), geometry=[], crs="EPSG:4326")
-            
-            if export_format == "gpkg":
-                filename = f"{base_filename}.gpkg"
-                file_path = os.path.join(geojsons_dir, filename)
-                gdf.to_file(file_path, driver="GPKG", layer="localidades")
-                file_url = f"{settings.MEDIA_URL}geojsons/{filename}"
-                
-            elif export_format == "shp":
-                # Un shapefile son varios archivos, así que creamos un temporal, guardamos y comprimimos en zip
-                temp_shp_dir = os.path.join(geojsons_dir, f"shp_{base_filename}")
-                os.makedirs(temp_shp_dir, exist_ok=True)
-                
-                shp_path = os.path.join(temp_shp_dir, f"{base_filename}.shp")
-                gdf.to_file(shp_path, driver="ESRI Shapefile")
-                
-                zip_filename = f"{base_filename}.zip"
-                zip_path = os.path.join(geojsons_dir, zip_filename)
-                
-                # Crear el zip de todo el directorio
-                shutil.make_archive(zip_path.replace('.zip', ''), 'zip', temp_shp_dir)
-                
-                # Limpiar la carpeta temporal suelta
-                shutil.rmtree(temp_shp_dir)
-                
-                file_url = f"{settings.MEDIA_URL}geojsons/{zip_filename}"
+        prefix = f"ctx_{context_id}" if context_id else f"files_{len(target_file_ids)}"
+        export = export_localities(
+            f"localidades_{prefix}_{timestamp}",
+            export_format,
+            context_id=context_id,
+            file_ids=target_file_ids,
+            geom_kind=geom_kind,
+        )
 
-        return {
+        result = {
             "entities": unique_entities,
-            "geojson": geojson_data,
-            "export_format": export_format,
-            "download_url": file_url,
+            "export_format": export["export_format"],
+            "download_url": export["download_url"],
+            "feature_count": export["feature_count"],
+            "geometry_kind": geom_kind,
             "detected_focus": focus
         }
+        if include_geojson:
+            result["geojson"] = {
+                "type": "FeatureCollection",
+                "features": geojson_features
+            }
+        return result
 
     except Exception as e:
         logger.error(f"Error extrayendo localidades del contexto: {str(e)}")
@@ -442,11 +345,64 @@ def extract_localities_from_context(context_id=None, model="deepseek-r1:32b", fo
 def process_entities_batch(text, model, system_prompt, server):
     if not text.strip():
         return []
-        
+    return request_entities(text, model, system_prompt, server) or []
+
+def extract_entities_batch(text, model, system_prompt, server):
+    """Salida cruda del LLM y entidades normalizadas de un lote (para el índice de lugares)"""
+    raw = request_entities(text, model, system_prompt, server)
+    if raw is None:
+        return None, []
+    entities = [normalize_entity(entity) for entity in raw if isinstance(entity, dict)]
+    return raw, [entity for entity in entities if entity]
+
+def normalize_entity(entity):
+    """
+    Fila del índice de lugares a partir de una entidad del LLM, o None si no
+    es válida. Solo aplica reglas que no dependen de la petición; el tipo,
+    la blacklist y las jerarquías se resuelven al armar la respuesta.
+    """
+    name = entity.get("name", "")
+    etype = entity.get("type", "")
+    if not name or not isinstance(name, str) or not etype or not isinstance(etype, str):
+        return None
+
+    name_clean = name.strip()
+    name_lower = name_clean.lower()
+    context = entity.get("context")
+    context = context.strip() if isinstance(context, str) else None
+
+    # Regla 4: Anti-alucinaciones de contexto
+    context_text = (context or "").lower()
+    if context_text and context_text != "contexto no proporcionado por el modelo.":
+        # Si el modelo alucina (ej. "Puebla") sin estar en el texto exacto, lo descartamos
+        # Comparamos si al menos la palabra del lugar o alguna de sus piezas principales está
+        name_words = [w for w in name_lower.split() if len(w) > 3]
+        if name_lower not in context_text:
+            if not name_words or not any(w in context_text for w in name_words):
+                return None # Evidencia de alucinación o no coincidencia literal
+
+    coords = entity.get("coordenadas")
+    is_valid_coords = isinstance(coords, list) and len(coords) == 2 and all(
+        isinstance(c, (int, float)) and not isinstance(c, bool) for c in coords
+    )
+    estado = entity.get("estado")
+    pais = entity.get("país")
+    return {
+        "name": name_clean,
+        "type": etype.strip().lower()[:50],
+        "estado": estado.strip() if isinstance(estado, str) else None,
+        "pais": pais.strip() if isinstance(pais, str) else None,
+        "context": context,
+        "longitude": float(coords[0]) if is_valid_coords else None,
+        "latitude": float(coords[1]) if is_valid_coords else None,
+    }
+
+def request_entities(text, model, system_prompt, server):
+    """Lista de entidades que devuelve el LLM para un lote, o None si la llamada falla"""
     payload = {
         "model": model,
         "system": system_prompt,
-        "prompt": f"Extrae las localidades de este texto: {text[:12000]}", # límite por seguridad
+        "prompt": f"Extrae las localidades de este texto: {text}",  # el lote ya viene acotado por LLM_EXTRACTION_BATCH_TOKENS
         "stream": False,
         "format": "json"
     }
@@ -470,4 +426,4 @@ def process_entities_batch(text, model, system_prompt, server):
         return []
     except Exception as e:
         logger.error(f"Error en batch de extracción: {e}")
-        return []
+        return None
@@ -1,7 +1,10 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.http import HttpResponse
 from .utils import extract_localities_from_context
+from .store import feature_page, vector_tile
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
 import logging
 
@@ -28,29 +31,34 @@ logger = logging.getLogger(__name__)
                 },
                 "geojson": {
                     "type": "object",
-                    "description": "Objeto FeatureCollection válido de GeoJSON georreferenciado."
+                    "description": "Objeto FeatureCollection válido de GeoJSON georreferenciado. Solo si se pidió con include_geojson."
                 },
                 "download_url": {
                     "type": "string",
-                    "description": "URL pública para descargar el archivo georreferenciado mapeado (.geojson, .shp.zip, .gpkg)."
+                    "description": "URL pública para descargar el archivo georreferenciado mapeado (.geojson, .geojsonl, .zip de shp, .gpkg)."
                 },
                 "export_format": {
                     "type": "string",
-                    "description": "Formato de exportación elegido por el usuario (geojson, shp, gpkg)."
+                    "description": "Formato de exportación elegido por el usuario (geojson, geojsonl, shp, gpkg)."
+                },
+                "feature_count": {"type": "integer"},
+                "geometry_kind": {
+                    "type": "string",
+                    "description": "Tipo de geometría guardado (point, polygon, centroid); filtro geometry_type de features/ y tiles/."
                 },
                 "detected_focus": {"type": "string"}
             },
         }
     },
     summary="Detectar localidades en documentos",
-    description="Analiza los documentos de un contexto o un arreglo de archivos específicos para extraer entidades geográficas y exportarlas temporalmente.",
+    description="Analiza los documentos de un contexto o un arreglo de archivos específicos para extraer entidades geográficas y exportarlas temporalmente. La FeatureCollection completa solo se incluye con include_geojson=true; para mapas usar features/ o tiles/.",
     tags=["Localidades"],
 )
 @api_view(["POST"])
 def detect_localidades(request):
     """
     Endpoint para detectar localidades.
-    Recibe: {"context_id": id, "file_ids": [id1, id2], "model": "...", "focus": "...", "entity_types": ["país", "infraestructura", ...], "export_format": "geojson|shp|gpkg", "geometry_type": "point|polygon|centroid"}
+    Recibe: {"context_id": id, "file_ids": [id1, id2], "model": "...", "focus": "...", "entity_types": ["país", "infraestructura", ...], "export_format": "geojson|geojsonl|shp|gpkg", "geometry_type": "point|polygon|centroid", "include_geojson": false}
     """
     data = request.data
     context_id = data.get("context_id")
@@ -60,6 +68,7 @@ def detect_localidades(request):
     focus = data.get("focus", "México")
     export_format = data.get("export_format", "geojson")
     geometry_type = data.get("geometry_type", "point")
+    include_geojson = str(data.get("include_geojson", False)).lower() in ["true", "1"]
 
     if not context_id and not file_ids:
         return Response({"error": "Se requiere el parámetro 'context_id' o un arreglo de 'file_ids'"}, status=status.HTTP_400_BAD_REQUEST)
@@ -73,10 +82,98 @@ def detect_localidades(request):
         file_ids=file_ids, 
         entity_types=entity_types, 
         export_format=export_format,
-        geometry_type=geometry_type
+        geometry_type=geometry_type,
+        include_geojson=include_geojson
     )
     
     if "error" in result:
         return Response(result, status=status.HTTP_400_BAD_REQUEST)
         
     return Response(result, status=status.HTTP_200_OK)
+
+
+LAYER_PARAMETERS = [
+    OpenApiParameter(name="context_id", description="ID del contexto", required=False, type=OpenApiTypes.INT, location=OpenApiParameter.QUERY),
+    OpenApiParameter(name="file_ids", description="IDs de archivos separados por coma", required=False, type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+    OpenApiParameter(name="geometry_type", description="point | polygon | centroid (default point)", required=False, type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+    OpenApiParameter(name="type", description="Tipo de entidad (país, estado, municipio, localidad, infraestructura)", required=False, type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+]
+
+
+def _layer_filters(params):
+    """Filtros comunes de features/ y tiles/; ValueError si algún parámetro es inválido"""
+    context_id = params.get("context_id")
+    file_ids = [int(f) for f in params.get("file_ids", "").split(",") if f.strip()]
+    if not context_id and not file_ids:
+        raise ValueError("Se requiere el parámetro 'context_id' o 'file_ids'")
+    geom_kind = params.get("geometry_type", "point").lower()
+    if geom_kind not in ["point", "polygon", "centroid"]:
+        raise ValueError("geometry_type debe ser point, polygon o centroid")
+    return {
+        "context_id": int(context_id) if context_id else None,
+        "file_ids": file_ids,
+        "geom_kind": geom_kind,
+        "entity_type": params.get("type") or None,
+    }
+
+
+@extend_schema(
+    methods=["GET"],
+    parameters=LAYER_PARAMETERS + [
+        OpenApiParameter(name="bbox", description="minx,miny,maxx,maxy en EPSG:4326", required=False, type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+        OpenApiParameter(name="limit", description="Features por página", required=False, type=OpenApiTypes.INT, location=OpenApiParameter.QUERY),
+        OpenApiParameter(name="after", description="Cursor: valor 'next_after' de la página anterior", required=False, type=OpenApiTypes.INT, location=OpenApiParameter.QUERY),
+    ],
+    responses={
+        200: {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string"},
+                "features": {"type": "array", "items": {"type": "object"}},
+                "next_after": {"type": "integer", "nullable": True},
+            },
+        }
+    },
+    summary="Localidades guardadas (GeoJSON paginado)",
+    description="Página de la FeatureCollection de localidades extraídas, opcionalmente limitada a un bbox. Se recorre con 'after' hasta que 'next_after' sea null.",
+    tags=["Localidades"],
+)
+@api_view(["GET"])
+def localidades_features(request):
+    params = request.query_params
+    try:
+        filters = _layer_filters(params)
+        bbox = None
+        if params.get("bbox"):
+            bbox = [float(v) for v in params["bbox"].split(",")]
+            if len(bbox) != 4:
+                raise ValueError("bbox debe tener 4 valores: minx,miny,maxx,maxy")
+        page_size = getattr(settings, "LOCALIDADES_PAGE_SIZE", 500)
+        max_page_size = getattr(settings, "LOCALIDADES_MAX_PAGE_SIZE", 5000)
+        limit = min(max(int(params.get("limit", page_size)), 1), max_page_size)
+        after = int(params.get("after", 0))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(feature_page(bbox=bbox, after=after, limit=limit, **filters), status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    methods=["GET"],
+    parameters=LAYER_PARAMETERS,
+    responses={200: OpenApiTypes.BINARY},
+    summary="Vector tiles de localidades",
+    description="Tesela Mapbox Vector Tile (z/x/y, Web Mercator) con la capa 'localidades'.",
+    tags=["Localidades"],
+)
+@api_view(["GET"])
+def localidades_tile(request, z, x, y):
+    try:
+        filters = _layer_filters(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return Response({"error": "Tesela fuera de rango"}, status=status.HTTP_400_BAD_REQUEST)
+
+    tile = vector_tile(z, x, y, **filters)
+    return HttpResponse(tile, content_type="application/vnd.mapbox-vector-tile")
@@ -87,7 +87,7 @@ def generate_presentation_spec(
         meta = getattr(ch, "metadata_json", None) or {}
         evidence.append({
             "doc_id": getattr(ch, "file_id", None),
-            "title": getattr(getattr(ch, "file", None), "filename", "") or "",
+            "title": getattr(ch, "filename", "") or "",
             "page": meta.get("page"),
             "chunk_id": f"{getattr(ch, 'file_id', 'x')}-{getattr(ch, 'chunk_index', 'x')}",
             "text": getattr(ch, "text", "") or "",
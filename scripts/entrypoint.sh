@@ -58,6 +58,14 @@ else
     }' > /dev/null && echo "✅ Modelo precargado"
 
 
+  if [ "${ASGI_SERVER}" = "uvicorn" ]; then
+    # ASGI: el chat en streaming (/api/chat/v1/async) no ocupa un hilo por conexión
+    echo "▶️ Iniciando servidor Uvicorn (ASGI) para producción..."
+    export DJANGO_SETTINGS_MODULE=$DJANGO_SETTINGS
+    exec uvicorn llm.asgi:application \
+      --host 0.0.0.0 --port 8000 --workers ${WEB_WORKERS:-1} --timeout-keep-alive 600
+  fi
+
   echo "▶️ Iniciando servidor Gunicorn para producción..."
   exec gunicorn llm.wsgi:application \
     --bind 0.0.0.0:8000 --timeout 600 --workers=1 --threads=2 \